@@ -1,108 +1,295 @@
+import time
+_STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox
-import json
+import argparse
+import importlib.util
 import os
+import queue
+import sys
+import threading
+from collections import OrderedDict
 from datetime import datetime
-try:
-    import matplotlib.pyplot as plt
-    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-    from matplotlib.figure import Figure
-    MATPLOTLIB_AVAILABLE = True
-except ImportError:
-    MATPLOTLIB_AVAILABLE = False
 
-# Добавляем импорт для работы с изображениями
-from PIL import Image, ImageTk
-import urllib.request
+from emias_core import (STARTUP, METRICS, FAKER_AVAILABLE, SORT_FIELDS, ConflictError, Patient,
+                        PatientAggregates, PatientStore, StorageError, create_manager, fake_patient,
+                        lazy_import, load_faker, normalize_record)
+from emias_charts import (CHARTS, SCATTER_LIMIT, BmiAgePoints, age_figure, bmi_age_figure,
+                          bmi_gender_figure, gender_figure, patient_column)
 
-# Добавляем импорт Faker для генерации тестовых данных
-try:
-    from faker import Faker
-    FAKER_AVAILABLE = True
-except ImportError:
-    FAKER_AVAILABLE = False
+STARTUP.t0 = _STARTUP_T0
 
-class Patient:
-    def __init__(self, full_name, age, gender, height, weight):
-        self.full_name = full_name
-        self.age = age
-        self.gender = gender
-        self.height = height
-        self.weight = weight
-    
-    @property
-    def bmi(self):
-        return round(self.weight / ((self.height / 100) ** 2), 2)
+# matplotlib импортируется при первом открытии статистики
+MATPLOTLIB_AVAILABLE = importlib.util.find_spec('matplotlib') is not None
+FigureCanvasTkAgg = None
 
-class PatientManager:
-    def __init__(self, filename='patients.json'):
-        self.filename = filename
-        self.patients = self.load_data()
-        
-        # Если данных нет, генерируем тестовые данные
-        if not self.patients and FAKER_AVAILABLE:
-            self.generate_initial_data()
-    
-    def generate_initial_data(self):
-        """Генерация начальных тестовых данных с помощью Faker"""
-        fake = Faker('ru_RU')
-        
-        for _ in range(10):
-            gender = fake.random_element(elements=('М', 'Ж'))
-            if gender == 'М':
-                first_name = fake.first_name_male()
-                last_name = fake.last_name_male()
-            else:
-                first_name = fake.first_name_female()
-                last_name = fake.last_name_female()
-                
-            full_name = f"{last_name} {first_name} {fake.middle_name()}"
-            age = fake.random_int(min=18, max=80)
-            height = fake.random_int(min=150, max=190)
-            weight = fake.random_int(min=50, max=100)
-            
-            patient = Patient(full_name, age, gender, height, weight)
-            self.patients.append(patient)
+def load_matplotlib():
+    # Figure для графиков импортирует emias_charts при первом построении
+    global FigureCanvasTkAgg
+    if FigureCanvasTkAgg is None:
+        FigureCanvasTkAgg = lazy_import('matplotlib.backends.backend_tkagg').FigureCanvasTkAgg
+
+STARTUP.mark('импорт модулей')
+
+class VirtualTable:
+    """Виртуальная таблица: в Treeview существуют только строки видимого окна.
+    
+    Данные запрашиваются страницами через fetch_rows(offset, limit) с небольшим
+    запасом, прокрутка и изменения перерисовывают только затронутые строки.
+    Элементы Treeview называются ID пациентов, поэтому выделение указывает
+    на пациента при любом порядке строк.
+    """
+    
+    def __init__(self, tree, scrollbar, row_count, fetch_rows, format_row, fetch_patient,
+                 visible_rows=8, buffer_rows=32):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.row_count = row_count
+        self.fetch_rows = fetch_rows
+        self.fetch_patient = fetch_patient
+        self.format_row = format_row
+        self.visible_rows = visible_rows
+        self.buffer_rows = buffer_rows
+        self.offset = 0
+        self.total = 0
+        self.selected_index = None
+        # Представление: список ID пациентов для показа (результаты поиска) или None - все строки
+        self.view = None
+        self._items = []
+        self._cache_offset = 0
+        self._cache = []
         
-        self.save_data()
+        self.scrollbar.configure(command=self.on_scrollbar)
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        for key, step in (("<Up>", -1), ("<Down>", 1)):
+            self.tree.bind(key, lambda e, step=step: self.move_selection(step))
+        for key, pages in (("<Prior>", -1), ("<Next>", 1)):
+            self.tree.bind(key, lambda e, pages=pages: self.move_selection(pages * self.visible_rows))
+        self.tree.bind("<Home>", lambda e: self.move_selection(-self.total))
+        self.tree.bind("<End>", lambda e: self.move_selection(self.total))
     
-    def load_data(self):
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return [Patient(**item) for item in data]
-            except Exception as e:
-                print(f"Ошибка загрузки данных: {e}")
-                return []
-        return []
-    
-    def save_data(self):
-        try:
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump([{
-                    'full_name': p.full_name,
-                    'age': p.age,
-                    'gender': p.gender,
-                    'height': p.height,
-                    'weight': p.weight
-                } for p in self.patients], f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"Ошибка сохранения данных: {e}")
+    def selected_key(self):
+        """ID выбранного пациента или None; строка может быть прокручена за пределы окна"""
+        if self.selected_index is None:
+            return None
+        position = self.selected_index - self.offset
+        if 0 <= position < len(self._items):
+            return int(self._items[position])
+        return self.row(self.selected_index).key
+    
+    def set_view(self, view):
+        self.view = view
+        self.offset = 0
+        self.selected_index = None
+        self.refresh()
+    
+    def replace_view(self, view):
+        """Пересчитанное представление тех же строк: прокрутка и выбор сохраняются.
+        
+        Выбранный пациент ищется рядом с прежней позицией - после вставок и
+        удалений выше него он сдвигается недалеко.
+        """
+        key = self.selected_key()
+        self.view = view
+        if key is not None and view is not None:
+            index, total = self.selected_index, len(view)
+            near = sorted(range(max(0, index - self.visible_rows), min(total, index + self.visible_rows + 1)),
+                          key=lambda i: abs(i - index))
+            self.selected_index = next((i for i in near if view[i] == key), None)
+        self.refresh()
+    
+    def row(self, index):
+        """Пациент по позиции с подкачкой страницы в буфер"""
+        if self.view is not None:
+            return self.fetch_patient(self.view[index])
+        position = index - self._cache_offset
+        if not 0 <= position < len(self._cache):
+            self._cache_offset = max(0, index - self.buffer_rows // 2)
+            self._cache = self.fetch_rows(self._cache_offset,
+                                          self.visible_rows + self.buffer_rows)
+            position = index - self._cache_offset
+        return self._cache[position]
+    
+    def invalidate(self):
+        self._cache = []
+    
+    def refresh(self):
+        """Полная перерисовка видимого окна (O(видимых строк))"""
+        self.total = self.row_count() if self.view is None else len(self.view)
+        self.invalidate()
+        self.offset = max(0, min(self.offset, self.total - self.visible_rows))
+        if self.selected_index is not None and self.selected_index >= self.total:
+            self.selected_index = None
+        self.render()
+    
+    def render(self, start=0):
+        """Перерисовка строк окна начиная с позиции start"""
+        shown = max(0, min(self.visible_rows, self.total - self.offset))
+        start = min(start, shown, len(self._items))
+        patients = [self.row(self.offset + position) for position in range(start, shown)]
+        items = self._items[:start] + [str(patient.key) for patient in patients]
+        kept = set(items)
+        for iid in self._items[start:]:
+            if iid not in kept:
+                self.tree.delete(iid)
+        # Текущий порядок элементов дерева: каждый move сдвигает строки, сравниваем с ним
+        current = [iid for iid in self._items if iid in kept]
+        existing = set(current)
+        for position, patient in enumerate(patients, start):
+            iid = items[position]
+            if iid in existing:
+                self.tree.item(iid, values=self.format_row(patient))
+                if position >= len(current) or current[position] != iid:
+                    self.tree.move(iid, "", position)
+                    current.remove(iid)
+                    current.insert(position, iid)
+            else:
+                self.tree.insert("", position, iid=iid, values=self.format_row(patient))
+                current.insert(position, iid)
+        self._items = items
+        self.sync_selection()
+        self.update_scrollbar()
+    
+    def sync_selection(self):
+        position = None if self.selected_index is None else self.selected_index - self.offset
+        if position is not None and 0 <= position < len(self._items):
+            if self.tree.selection() != (self._items[position],):
+                self.tree.selection_set(self._items[position])
+        elif self.tree.selection():
+            self.tree.selection_set(())
+    
+    def update_scrollbar(self):
+        if self.total <= self.visible_rows:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.offset / self.total,
+                               (self.offset + self.visible_rows) / self.total)
+    
+    def set_offset(self, offset):
+        offset = max(0, min(offset, self.total - self.visible_rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+    
+    def scroll(self, rows):
+        self.set_offset(self.offset + rows)
+        return "break"
     
-    def add_patient(self, patient):
-        self.patients.append(patient)
-        self.save_data()
+    def on_scrollbar(self, command, value, unit=None):
+        if command == "moveto":
+            self.set_offset(int(float(value) * self.total))
+        elif command == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll(int(value) * step)
+    
+    def on_mousewheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+    
+    def on_select(self, event):
+        selected = self.tree.selection()
+        if selected and selected[0] in self._items:
+            self.selected_index = self.offset + self._items.index(selected[0])
     
-    def update_patient(self, index, patient):
-        self.patients[index] = patient
-        self.save_data()
+    def move_selection(self, step):
+        if not self.total:
+            return "break"
+        current = self.offset if self.selected_index is None else self.selected_index
+        self.selected_index = max(0, min(current + step, self.total - 1))
+        if self.selected_index < self.offset:
+            self.set_offset(self.selected_index)
+        elif self.selected_index >= self.offset + self.visible_rows:
+            self.set_offset(self.selected_index - self.visible_rows + 1)
+        self.sync_selection()
+        return "break"
+    
+    def key_changed(self, key):
+        """Изменен один пациент: обновляем только его элемент, если он виден"""
+        self.invalidate()
+        iid = str(key)
+        if iid in self._items:
+            self.tree.item(iid, values=self.format_row(self.fetch_patient(key)))
+    
+    def row_inserted(self, index):
+        """Вставлена строка: сдвигаются только строки окна ниже нее"""
+        self.total += 1
+        self.invalidate()
+        if self.selected_index is not None and self.selected_index >= index:
+            self.selected_index += 1
+        self.render(max(0, index - self.offset))
+    
+    def row_deleted(self, index):
+        """Удалена строка: сдвигаются только строки окна ниже нее"""
+        self.total -= 1
+        self.invalidate()
+        if self.selected_index is not None:
+            if self.selected_index == index:
+                self.selected_index = None
+            elif self.selected_index > index:
+                self.selected_index -= 1
+        if self.offset > max(0, self.total - self.visible_rows):
+            self.offset = max(0, self.total - self.visible_rows)
+            self.render()
+        else:
+            self.render(max(0, index - self.offset))
+
+# Фоновое изображение: адрес, локальная копия и уже декодированный кэш (PPM без сжатия)
+BACKGROUND_URL = "https://i.pinimg.com/736x/25/ae/54/25ae54efbed9fd04e426a9baccb3bdb9.jpg"
+BACKGROUND_PATH = "background.jpg"
+BACKGROUND_DECODED_PATH = "background.ppm"
+BACKGROUND_TIMEOUT = 5
+
+def read_background_image():
+    """Чтение фона (вызывается в рабочем потоке): кэш, локальный JPEG или скачивание"""
+    Image = lazy_import('PIL.Image')
+    if os.path.exists(BACKGROUND_DECODED_PATH) and (
+            not os.path.exists(BACKGROUND_PATH)
+            or os.path.getmtime(BACKGROUND_DECODED_PATH) >= os.path.getmtime(BACKGROUND_PATH)):
+        image = Image.open(BACKGROUND_DECODED_PATH)
+        image.load()
+        return image
+    
+    # Скачиваем файл если его нет
+    if not os.path.exists(BACKGROUND_PATH):
+        request = lazy_import('urllib.request')
+        with request.urlopen(BACKGROUND_URL, timeout=BACKGROUND_TIMEOUT) as response:
+            data = response.read()
+        with open(BACKGROUND_PATH, 'wb') as f:
+            f.write(data)
+    
+    image = Image.open(BACKGROUND_PATH).convert('RGB')
+    # Сохраняем декодированную копию, чтобы следующий запуск не декодировал JPEG
+    try:
+        image.save(BACKGROUND_DECODED_PATH, 'PPM')
+    except OSError as e:
+        print(f"Не удалось сохранить кэш фона: {e}")
+    return image
+
+# Сколько найденных пациентов показывать в таблице
+SEARCH_LIMIT = 500
+
+# Как часто (мс) проверять изменения, сделанные на других рабочих местах
+CHANGE_POLL_INTERVAL = 2000
+
+# Как часто (мс) проверять, не завис ли цикл событий (только при включенных замерах)
+STALL_CHECK_INTERVAL = 50
+
+# Куда F12 сохраняет замеры
+METRICS_FILES = ('emias_metrics.json', 'emias_metrics.prom')
+
+# Фон: сколько масштабированных копий хранить и через сколько мс после
+# последнего изменения размера окна делать качественное масштабирование
+BACKGROUND_CACHE_SIZE = 8
+BACKGROUND_IDLE_DELAY = 200
 
 class MainApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Обкуренный ЕМИАС")
-        self.manager = PatientManager()
+        self.manager = create_manager(background=True)
         
         # Настройка цветовой палитры в стиле фона
         self.colors = {
@@ -124,6 +311,98 @@ class MainApp:
         
         self.setup_ui()
         self.update_table()
+        
+        # Пациенты подгружаются пачками, таблица доступна с первой страницы
+        if hasattr(self.manager, 'start_background_load'):
+            self.manager.start_background_load()
+            self.progress.grid()
+            self.root.after(50, self.poll_loading)
+        else:
+            self.root.after(CHANGE_POLL_INTERVAL, self.poll_changes)
+        
+        self.root.bind("<F12>", self.dump_metrics)
+        if METRICS.enabled:
+            self._stall_check_due = time.perf_counter()
+            self.watch_stalls()
+    
+    def watch_stalls(self):
+        """Опоздание очередного срабатывания таймера - время, пока цикл событий был занят"""
+        now = time.perf_counter()
+        lag = now - self._stall_check_due
+        if lag >= METRICS.stall_threshold:
+            METRICS.record_stall('event_loop', lag)
+        self._stall_check_due = now + STALL_CHECK_INTERVAL / 1000
+        self.root.after(STALL_CHECK_INTERVAL, self.watch_stalls)
+    
+    def dump_metrics(self, event=None):
+        """Сохранение замеров в JSON и формате Prometheus по F12"""
+        if not METRICS.enabled:
+            messagebox.showinfo("Замеры", "Замеры выключены: запустите программу с флагом --metrics "
+                                "или с переменной окружения EMIAS_METRICS=1")
+            return
+        try:
+            for filename in METRICS_FILES:
+                METRICS.dump(filename)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить замеры: {e}")
+            return
+        snapshot = METRICS.snapshot()
+        slowest = sorted(snapshot['operations'].items(), key=lambda item: -item[1]['p95_ms'])[:5]
+        lines = [f"{name}: p95 {stats['p95_ms']:.0f} мс, макс {stats['max_ms']:.0f} мс, "
+                 f"вызовов {stats['count']}" for name, stats in slowest]
+        stalls = sum(snapshot['ui_stalls'].values())
+        messagebox.showinfo("Замеры", f"Сохранено: {', '.join(METRICS_FILES)}\n\n"
+                            + '\n'.join(lines) + f"\n\nЗависаний интерфейса: {stalls}, "
+                            f"медленных операций в журнале: {len(snapshot['slow_log'])}")
+    
+    def poll_loading(self):
+        """Прием загруженных пачек пациентов и обновление индикатора"""
+        progress = self.manager.poll_background_load()
+        if progress is not None:
+            self.progress['value'] = progress * 100
+            self.update_table()
+        if self.manager.loading:
+            self.root.after(50, self.poll_loading)
+        else:
+            STARTUP.mark('пациенты загружены')
+            self.progress.grid_remove()
+            if self.search_var.get().strip():
+                self.apply_search()
+            self.root.after(CHANGE_POLL_INTERVAL, self.poll_changes)
+    
+    def poll_changes(self):
+        """Периодическая проверка хранилища на изменения с других рабочих мест"""
+        self.apply_changes(self.manager.poll_changes())
+        self.root.after(CHANGE_POLL_INTERVAL, self.poll_changes)
+    
+    def apply_changes(self, changes):
+        """Обновление таблицы по списку изменений (op, ID): перерисовываются только нужные строки"""
+        if not changes:
+            return
+        if self.refresh_cohort():
+            return
+        if any(op == 'reload' for op, _ in changes):
+            # Хранилище перечитано целиком: строим представление заново
+            if self.search_keys is not None:
+                self.apply_search()
+            else:
+                self.table.set_view(self.current_view())
+        elif self.search_keys is not None:
+            deleted = {key for op, key in changes if op == 'delete'}
+            if deleted:
+                self.search_keys[:] = [key for key in self.search_keys if key not in deleted]
+            self.table.refresh()
+        elif self.sort_field is not None or any(op != 'update' for op, _ in changes):
+            self.table.refresh()
+        else:
+            for _, key in changes:
+                self.table.key_changed(key)
+    
+    def is_loading(self):
+        if getattr(self.manager, 'loading', False):
+            messagebox.showinfo("Подождите", "Данные пациентов еще загружаются")
+            return True
+        return False
     
     def setup_styles(self):
         """Настройка цветовых стилей для виджетов"""
@@ -155,6 +434,11 @@ class MainApp:
                       foreground=self.colors['text'],  # #34495e
                       font=('Arial', 14, 'bold'))
         
+        # Стиль для подписей на карточке
+        style.configure('Card.TLabel',
+                      background=self.colors['light'],
+                      foreground=self.colors['text'])
+        
         # Стиль для таблицы - изменен цвет текста заголовков на #34495e
         style.configure('Treeview',
                        background=self.colors['light'],
@@ -171,28 +455,43 @@ class MainApp:
                  background=[('selected', self.colors['accent'])])
     
     def load_background_image(self):
-        """Загрузка и настройка фонового изображения"""
+        """Загрузка и настройка фонового изображения.
+        
+        Окно сразу показывается со сплошным фоном, а скачивание и декодирование
+        картинки идут в рабочем потоке; готовое изображение забирает poll_background.
+        """
+        self._bg_cache = OrderedDict()
+        self._bg_size = None
+        self._bg_high_quality = False
+        self._bg_job = None
+        self.bg_image = None
+        self._bg_queue = queue.Queue()
+        worker = threading.Thread(target=self._background_worker, daemon=True)
+        worker.start()
+        self.root.after(100, self.poll_background)
+        
+        # Привязываем изменение размера окна к обновлению фона
+        self.root.bind("<Configure>", self.on_resize)
+    
+    def _background_worker(self):
         try:
-            # Скачиваем изображение по URL
-            url = "https://i.pinimg.com/736x/25/ae/54/25ae54efbed9fd04e426a9baccb3bdb9.jpg"
-            image_path = "background.jpg"
-            
-            # Скачиваем файл если его нет
-            if not os.path.exists(image_path):
-                urllib.request.urlretrieve(url, image_path)
-            
-            # Открываем и обрабатываем изображение
-            self.original_image = Image.open(image_path)
-            self.update_background()
-            
-            # Привязываем изменение размера окна к обновлению фона
-            self.root.bind("<Configure>", self.on_resize)
-            
+            self._bg_queue.put(read_background_image())
         except Exception as e:
             print(f"Ошибка загрузки фона: {e}")
-            self.bg_image = None
+            self._bg_queue.put(None)
     
-    def update_background(self):
+    def poll_background(self):
+        try:
+            image = self._bg_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(100, self.poll_background)
+            return
+        if image is not None:
+            self.original_image = image
+            self.update_background()
+    
+    @METRICS.timed()
+    def update_background(self, high_quality=True):
         """Обновление фонового изображения при изменении размера окна"""
         if hasattr(self, 'original_image'):
             # Получаем текущий размер окна
@@ -203,29 +502,59 @@ class MainApp:
             if width < 10 or height < 10:
                 width = 1000
                 height = 700
+            size = (width, height)
+            Image = lazy_import('PIL.Image')
+            ImageTk = lazy_import('PIL.ImageTk')
             
-            # Масштабируем изображение под размер окна
-            resized_image = self.original_image.resize((width, height), Image.Resampling.LANCZOS)
-            self.bg_image = ImageTk.PhotoImage(resized_image)
+            # Уже масштабированные размеры (развернуть/восстановить) берем из кэша
+            cached = self._bg_cache.get(size)
+            if cached is not None:
+                self._bg_cache.move_to_end(size)
+                self.bg_image = cached
+            elif high_quality:
+                resized_image = self.original_image.resize(size, Image.Resampling.LANCZOS)
+                self.bg_image = ImageTk.PhotoImage(resized_image)
+                self._bg_cache[size] = self.bg_image
+                if len(self._bg_cache) > BACKGROUND_CACHE_SIZE:
+                    self._bg_cache.popitem(last=False)
+            else:
+                # Во время перетаскивания - быстрый, но грубый фильтр
+                resized_image = self.original_image.resize(size, Image.Resampling.NEAREST)
+                self.bg_image = ImageTk.PhotoImage(resized_image)
+            self._bg_size = size
+            self._bg_high_quality = high_quality or cached is not None
             
             # Обновляем изображение на Canvas
             if hasattr(self, 'canvas'):
-                self.canvas.delete("background")
-                self.canvas.create_image(0, 0, image=self.bg_image, anchor="nw", tags="background")
-                self.canvas.lower("background")
+                if self.canvas.find_withtag("background"):
+                    self.canvas.itemconfigure("background", image=self.bg_image)
+                else:
+                    self.canvas.create_image(0, 0, image=self.bg_image, anchor="nw", tags="background")
+                    self.canvas.lower("background")
     
     def on_resize(self, event):
         """Обработчик изменения размера окна"""
-        if event.widget == self.root:
+        # <Configure> приходит и при перемещении дочерних виджетов - реагируем только на смену размера
+        if event.widget != self.root or (event.width, event.height) == self._bg_size:
+            return
+        self.update_background(high_quality=False)
+        # Качественное масштабирование - когда размер перестанет меняться
+        if self._bg_job is not None:
+            self.root.after_cancel(self._bg_job)
+        self._bg_job = self.root.after(BACKGROUND_IDLE_DELAY, self.finish_resize)
+    
+    def finish_resize(self):
+        self._bg_job = None
+        if not self._bg_high_quality:
             self.update_background()
     
     def setup_ui(self):
-        # Создаем Canvas как основной контейнер 
-        self.canvas = tk.Canvas(self.root, highlightthickness=0)
+        # Создаем Canvas как основной контейнер; пока фон не загружен - сплошной цвет
+        self.canvas = tk.Canvas(self.root, highlightthickness=0, background=self.colors['primary'])
         self.canvas.pack(fill="both", expand=True)
         
         # Устанавливаем фоновое изображение
-        if hasattr(self, 'bg_image'):
+        if self.bg_image is not None:
             self.canvas.create_image(0, 0, image=self.bg_image, anchor="nw", tags="background")
         
         # Убираем полупрозрачный оверлей для устранения белого прямоугольника
@@ -233,32 +562,64 @@ class MainApp:
         
         # Основной фрейм для содержимого (уменьшенный размер)
         main_frame = ttk.Frame(self.canvas, style="Card.TFrame")
-        main_frame.place(relx=0.5, rely=0.5, anchor="center", width=650, height=450)
+        main_frame.place(relx=0.5, rely=0.5, anchor="center", width=650, height=490)
         
         # Заголовок
         title_label = ttk.Label(main_frame, text="Управление пациентами", style="Title.TLabel")
-        title_label.grid(row=0, column=0, columnspan=5, pady=(10, 15))
+        title_label.grid(row=0, column=0, columnspan=3, padx=10, pady=(10, 15), sticky=tk.W)
+        
+        # Поиск по ФИО
+        search_frame = ttk.Frame(main_frame, style="Card.TFrame")
+        search_frame.grid(row=0, column=3, columnspan=3, padx=10, pady=(10, 15), sticky=tk.E)
+        ttk.Label(search_frame, text="Поиск:", style="Card.TLabel").pack(side=tk.LEFT, padx=(0, 5))
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=25)
+        search_entry.pack(side=tk.LEFT)
+        search_entry.bind("<KeyRelease>", self.on_search_changed)
+        self._search_job = None
+        self.search_keys = None
         
         # Таблица пациентов (уменьшенная)
         columns = ("ФИО", "Возраст", "Пол", "Рост", "Вес", "ИМТ")
         self.tree = ttk.Treeview(main_frame, columns=columns, show="headings", height=8)
         
-        # Настройка столбцов (уменьшенные ширины)
+        # Настройка столбцов (уменьшенные ширины); щелчок по заголовку сортирует таблицу
         column_widths = [150, 60, 50, 60, 60, 60]
+        self.sort_columns = dict(zip(columns, SORT_FIELDS))
+        self.sort_field = None
+        self.sort_descending = False
         for col, width in zip(columns, column_widths):
-            self.tree.heading(col, text=col)
+            self.tree.heading(col, text=col, command=lambda col=col: self.sort_by(col))
             self.tree.column(col, width=width, anchor="center")
         
         self.tree.grid(row=1, column=0, columnspan=5, padx=10, pady=5, sticky=(tk.W, tk.E, tk.N, tk.S))
         
-        # Полоса прокрутки для таблицы
-        scrollbar = ttk.Scrollbar(main_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
+        # Полоса прокрутки для таблицы: прокручивает виртуальное окно, а не Treeview
+        scrollbar = ttk.Scrollbar(main_frame, orient=tk.VERTICAL)
         scrollbar.grid(row=1, column=5, sticky=(tk.N, tk.S))
+        self.table = VirtualTable(self.tree, scrollbar, self.manager.count, self.manager.get_page,
+                                  self.format_row, self.manager.get_patient, visible_rows=8)
+        
+        # Когорта: отбор по выражению вроде "пол=Ж возраст=40..60 имт>=30", применяется по Enter
+        cohort_frame = ttk.Frame(main_frame, style="Card.TFrame")
+        cohort_frame.grid(row=2, column=0, columnspan=6, padx=10, pady=(10, 0), sticky=(tk.W, tk.E))
+        ttk.Label(cohort_frame, text="Когорта:", style="Card.TLabel").pack(side=tk.LEFT, padx=(0, 5))
+        self.cohort_var = tk.StringVar()
+        cohort_entry = ttk.Entry(cohort_frame, textvariable=self.cohort_var, width=40)
+        cohort_entry.pack(side=tk.LEFT)
+        cohort_entry.bind("<Return>", self.apply_cohort)
+        self.cohort_label = ttk.Label(cohort_frame, text="", style="Card.TLabel")
+        self.cohort_label.pack(side=tk.LEFT, padx=10)
+        self.cohort = None
+        
+        # Индикатор фоновой загрузки пациентов
+        self.progress = ttk.Progressbar(main_frame, orient=tk.HORIZONTAL, mode='determinate', maximum=100)
+        self.progress.grid(row=4, column=0, columnspan=6, padx=10, sticky=(tk.W, tk.E))
+        self.progress.grid_remove()
         
         # Кнопки управления с новой цветовой схемой
         button_frame = ttk.Frame(main_frame, style="Card.TFrame")
-        button_frame.grid(row=2, column=0, columnspan=6, pady=15)
+        button_frame.grid(row=3, column=0, columnspan=6, pady=15)
         
         ttk.Button(button_frame, text="Добавить пациента", 
                   command=self.add_patient, style="Primary.TButton").pack(side=tk.LEFT, padx=5)
@@ -282,90 +643,231 @@ class MainApp:
     
     def generate_test_data(self):
         """Генерация дополнительных тестовых данных"""
+        if self.is_loading():
+            return
         if not FAKER_AVAILABLE:
             messagebox.showwarning("Предупреждение", "Библиотека Faker не установлена")
             return
             
-        fake = Faker('ru_RU')
+        fake = load_faker()
         
-        for _ in range(15):  # Добавляем 15 новых пациентов
-            gender = fake.random_element(elements=('М', 'Ж'))
-            if gender == 'М':
-                first_name = fake.first_name_male()
-                last_name = fake.last_name_male()
-            else:
-                first_name = fake.first_name_female()
-                last_name = fake.last_name_female()
-                
-            full_name = f"{last_name} {first_name} {fake.middle_name()}"
-            age = fake.random_int(min=18, max=80)
-            height = fake.random_int(min=150, max=190)
-            weight = fake.random_int(min=50, max=100)
-            
-            patient = Patient(full_name, age, gender, height, weight)
-            self.manager.add_patient(patient)
+        # Добавляем 15 новых пациентов одной пачкой
+        try:
+            self.manager.add_patients([fake_patient(fake) for _ in range(15)])
+        except StorageError as e:
+            messagebox.showerror("Ошибка", str(e))
+            self.on_patient_saved()
+            return
         
-        self.update_table()
+        if not self.refresh_cohort():
+            self.update_table()
         messagebox.showinfo("Юпи!", "Добавлено 5 тестовых пациентов")
     
+    def format_row(self, patient):
+        return (
+            patient.full_name,
+            patient.age,
+            patient.gender,
+            f"{patient.height} см",
+            f"{patient.weight} кг",
+            patient.bmi
+        )
+    
+    @METRICS.timed()
     def update_table(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        for patient in self.manager.patients:
-            self.tree.insert("", tk.END, values=(
-                patient.full_name,
-                patient.age,
-                patient.gender,
-                f"{patient.height} см",
-                f"{patient.weight} кг",
-                patient.bmi
-            ))
+        self.table.refresh()
+    
+    def on_search_changed(self, event=None):
+        # Ищем после короткой паузы в наборе, а не на каждую клавишу
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(150, self.apply_search)
+    
+    def apply_search(self, keep=False):
+        self._search_job = None
+        if getattr(self.manager, 'loading', False):
+            return
+        query = self.search_var.get().strip()
+        if not query and self.search_keys is None:
+            return
+        self.search_keys = self.manager.search(query, limit=SEARCH_LIMIT) if query else None
+        if self.search_keys is not None and self.cohort is not None:
+            # Поиск внутри когорты
+            self.search_keys = [key for key in self.search_keys if key in self.cohort]
+        if keep:
+            self.table.replace_view(self.current_view())
+        else:
+            self.table.set_view(self.current_view())
+    
+    def apply_cohort(self, event=None):
+        if self.is_loading():
+            return
+        text = self.cohort_var.get().strip()
+        try:
+            self.cohort = self.manager.query(text) if text else None
+        except ValueError as e:
+            messagebox.showwarning("Когорта", str(e))
+            return
+        self.update_view()
+    
+    def refresh_cohort(self):
+        """Пересчет когорты после изменения данных; False, если когорта не задана"""
+        if self.cohort is None:
+            return False
+        self.cohort = self.manager.query(self.cohort.query)
+        # Та же когорта после правки: прокрутка и выбранный пациент остаются на месте
+        self.update_view(keep=True)
+        return True
+    
+    def update_view(self, keep=False):
+        """Перестроение таблицы под текущие когорту, поиск и сортировку"""
+        self.cohort_label.config(text="" if self.cohort is None else f"Пациентов: {len(self.cohort)}")
+        if self.search_var.get().strip():
+            self.apply_search(keep)
+        elif keep:
+            self.search_keys = None
+            self.table.replace_view(self.current_view())
+        else:
+            self.search_keys = None
+            self.table.set_view(self.current_view())
+    
+    def current_view(self):
+        """Строки таблицы: результаты поиска или когорта и порядок сортировки, None - все по порядку"""
+        if self.search_keys is not None:
+            if self.sort_field is not None:
+                # Результатов поиска немного - сортируем их на месте
+                get_patient = self.manager.get_patient
+                self.search_keys.sort(key=lambda key: (getattr(get_patient(key), self.sort_field), key),
+                                      reverse=self.sort_descending)
+            return self.search_keys
+        if self.cohort is not None:
+            if self.sort_field is not None:
+                return self.cohort.sorted_view(self.sort_field, self.sort_descending)
+            return self.cohort
+        if self.sort_field is not None:
+            return self.manager.sorted_view(self.sort_field, self.sort_descending)
+        return None
+    
+    def sort_by(self, column):
+        """Сортировка по столбцу; повторный щелчок меняет направление"""
+        if self.is_loading():
+            return
+        field = self.sort_columns[column]
+        if self.sort_field == field:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_field, self.sort_descending = field, False
+        for col, col_field in self.sort_columns.items():
+            arrow = (" ▼" if self.sort_descending else " ▲") if col_field == field else ""
+            self.tree.heading(col, text=col + arrow)
+        self.table.set_view(self.current_view())
+    
+    def on_patient_saved(self, key=None, added=False):
+        """Точечное обновление таблицы после сохранения в редакторе.
+        
+        key None - ничего не сохранено (конфликт), подхватываем только чужие изменения.
+        """
+        changes = self.manager.poll_changes()
+        if self.refresh_cohort():
+            return
+        if self.search_keys is not None:
+            self.apply_search()
+        elif changes:
+            own = [] if key is None else [('add' if added else 'update', key)]
+            self.apply_changes(changes + own)
+        elif key is None:
+            return
+        elif self.sort_field is not None:
+            # Индекс сортировки уже обновлен, строка могла сменить место
+            self.table.refresh()
+        elif added:
+            self.table.row_inserted(self.manager.position_of(key))
+        else:
+            self.table.key_changed(key)
     
     def add_patient(self):
+        if self.is_loading():
+            return
         self.open_editor()
     
     def edit_patient(self):
-        selected = self.tree.selection()
-        if not selected:
+        if self.is_loading():
+            return
+        key = self.table.selected_key()
+        if key is None:
             messagebox.showwarning("Предупреждение", "Выберите пациента для редактирования")
             return
-        index = self.tree.index(selected[0])
-        self.open_editor(index)
+        self.open_editor(key)
     
     def delete_patient(self):
-        selected = self.tree.selection()
-        if not selected:
+        if self.is_loading():
+            return
+        key = self.table.selected_key()
+        if key is None:
             return
+        version = self.manager.get_patient(key).version
         if messagebox.askyesno("Подтверждение", "Удалить выбранного пациента?"):
-            index = self.tree.index(selected[0])
-            del self.manager.patients[index]
-            self.manager.save_data()
-            self.update_table()
+            index = self.table.selected_index
+            try:
+                self.manager.delete_patient(key, version)
+            except ConflictError as e:
+                messagebox.showwarning("Конфликт", f"{e}. Пациент не удален, таблица обновлена")
+                self.on_patient_saved()
+                return
+            except StorageError as e:
+                messagebox.showerror("Ошибка", f"{e}. Пациент не удален")
+                self.on_patient_saved()
+                return
+            changes = self.manager.poll_changes()
+            if changes:
+                self.apply_changes(changes + [('delete', key)])
+                return
+            if self.refresh_cohort():
+                return
+            # Индекс сортировки обновляет менеджер, список результатов поиска - мы
+            if self.search_keys is not None:
+                self.search_keys.remove(key)
+            self.table.row_deleted(index)
     
-    def open_editor(self, index=None):
-        EditorWindow(self.root, self.manager, index, self.update_table, self.colors)
+    def open_editor(self, key=None):
+        EditorWindow(self.root, self.manager, key, self.on_patient_saved, self.colors)
     
     def show_stats(self):
+        if self.is_loading():
+            return
         if not MATPLOTLIB_AVAILABLE:
             messagebox.showerror("Упс!", "Для отображения статистики установите matplotlib")
             return
-        StatsWindow(self.root, self.manager.patients)
+        load_matplotlib()
+        if self.cohort is not None and not len(self.cohort):
+            messagebox.showinfo("Статистика", "В когорте нет пациентов")
+            return
+        if self.cohort is not None:
+            # Статистика только по отобранной когорте
+            StatsWindow(self.root, self.cohort, self.cohort.aggregates())
+        elif not isinstance(self.manager.patients, PatientStore):
+            # В SQLite столбцы всех пациентов берутся запросом, а не перебором записей
+            cohort = self.manager.query('')
+            StatsWindow(self.root, cohort, cohort.aggregates())
+        else:
+            StatsWindow(self.root, self.manager.patients, self.manager.aggregates())
 
 class EditorWindow(tk.Toplevel):
-    def __init__(self, parent, manager, index, callback, colors):
+    def __init__(self, parent, manager, key, callback, colors):
         super().__init__(parent)
         self.manager = manager
-        self.index = index
+        self.key = key
+        self.version = None
         self.callback = callback
         self.colors = colors
         
-        self.title("Редактор пациентов" if index is not None else "Добавление пациента")
+        self.title("Редактор пациентов" if key is not None else "Добавление пациента")
         self.geometry("300x250")
         self.resizable(False, False)
         self.configure(bg=colors['light'])
         
         self.create_widgets()
-        if index is not None:
+        if key is not None:
             self.load_data()
     
     def create_widgets(self):
@@ -410,148 +912,156 @@ class EditorWindow(tk.Toplevel):
         ttk.Button(btn_frame, text="Отмена", command=self.destroy, style='Editor.TButton').pack(side=tk.LEFT, padx=5)
     
     def load_data(self):
-        patient = self.manager.patients[self.index]
+        patient = self.manager.get_patient(self.key)
+        # Версия, с которой начато редактирование: сохранение проверит, что ее никто не сменил
+        self.version = patient.version
+        for entry in (self.name_entry, self.age_entry, self.height_entry, self.weight_entry):
+            entry.delete(0, tk.END)
         self.name_entry.insert(0, patient.full_name)
         self.age_entry.insert(0, str(patient.age))
         self.gender_combo.set(patient.gender)
         self.height_entry.insert(0, str(patient.height))
         self.weight_entry.insert(0, str(patient.weight))
     
+    @METRICS.timed()
     def save(self):
+        # Проверяем, что все поля заполнены
+        if not all([self.name_entry.get(), self.age_entry.get(), 
+                   self.gender_combo.get(), self.height_entry.get(), 
+                   self.weight_entry.get()]):
+            messagebox.showerror("Упс!", "Все поля должны быть заполнены")
+            return
         try:
-            # Проверяем, что все поля заполнены
-            if not all([self.name_entry.get(), self.age_entry.get(), 
-                       self.gender_combo.get(), self.height_entry.get(), 
-                       self.weight_entry.get()]):
-                messagebox.showerror("Упс!", "Все поля должны быть заполнены")
-                return
-                
-            patient = Patient(
-                self.name_entry.get(),
-                int(self.age_entry.get()),
-                self.gender_combo.get(),
-                float(self.height_entry.get()),
-                float(self.weight_entry.get())
-            )
+            # Те же проверки и диапазоны, что при импорте и в HTTP-сервисе
+            record = normalize_record({'full_name': self.name_entry.get(), 'age': self.age_entry.get(),
+                                       'gender': self.gender_combo.get(),
+                                       'height': self.height_entry.get(),
+                                       'weight': self.weight_entry.get()})
         except ValueError as e:
-            messagebox.showerror("Упс!", "Некорректные данные. Проверьте возраст, рост и вес")
+            messagebox.showerror("Упс!", f"Некорректные данные. Проверьте возраст, рост и вес\n{e}")
             return
+        patient = Patient(record['full_name'], record['age'], record['gender'],
+                          record['height'], record['weight'])
         
-        if self.index is None:
-            self.manager.add_patient(patient)
-        else:
-            self.manager.update_patient(self.index, patient)
+        try:
+            if self.key is None:
+                key = self.manager.add_patient(patient)
+            else:
+                self.manager.update_patient(self.key, patient, self.version)
+                key = self.key
+        except ConflictError as e:
+            self.callback()
+            try:
+                self.load_data()
+            except KeyError:
+                messagebox.showwarning("Конфликт", f"{e}. Изменения не сохранены", parent=self)
+                self.destroy()
+                return
+            messagebox.showwarning("Конфликт", f"{e}. В форму загружены актуальные данные, "
+                                   "повторите правку и сохраните", parent=self)
+            return
+        except Exception as e:
+            # Ошибка записи или хранилища: форма остается открытой, данные в ней не теряются
+            self.callback()
+            messagebox.showerror("Ошибка", f"Пациент не сохранен: {e}", parent=self)
+            return
+        self.callback(key, self.key is None)
         
-        self.callback()
         self.destroy()
 
 class StatsWindow(tk.Toplevel):
-    def __init__(self, parent, patients):
+    # Выше этого числа точек ИМТ vs Возраст рисуется как карта плотности
+    SCATTER_LIMIT = SCATTER_LIMIT
+    
+    def __init__(self, parent, patients, aggregates=None, scatter_limit=None):
         super().__init__(parent)
         self.patients = patients
+        self.aggregates = aggregates or PatientAggregates.from_patients(patients)
+        self.scatter_limit = scatter_limit or self.SCATTER_LIMIT
         self.title("Медицинская статистика")
         self.geometry("800x600")
         
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        self.create_gender_tab()
-        self.create_age_tab()
-        self.create_bmi_gender_tab()
-        self.create_bmi_age_tab()
+        # Вкладки создаются пустыми, график строится при первом открытии вкладки
+        self._builders = {}
+        builders = (self.create_gender_tab, self.create_age_tab, self.create_bmi_gender_tab,
+                    self.create_bmi_age_tab)
+        for (_, text), builder in zip(CHARTS, builders):
+            frame = ttk.Frame(self.notebook)
+            self.notebook.add(frame, text=text)
+            self._builders[str(frame)] = (builder, frame)
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        self.on_tab_changed()
     
-    def create_gender_tab(self):
-        frame = ttk.Frame(self.notebook)
-        self.notebook.add(frame, text="Распределение по полу")
-        
-        genders = [p.gender for p in self.patients]
-        male_count = genders.count('М')
-        female_count = genders.count('Ж')
-        
-        fig = Figure(figsize=(6, 4), dpi=100)
-        ax = fig.add_subplot(111)
-        colors = ['#3498db', '#e74c3c']  # Синий и красный
-        ax.pie([male_count, female_count], labels=['Мужчины', 'Женщины'], autopct='%1.1f%%', colors=colors)
-        ax.set_title('Распределение пациентов по полу')
-        
-        canvas = FigureCanvasTkAgg(fig, frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    def on_tab_changed(self, event=None):
+        pending = self._builders.pop(self.notebook.select(), None)
+        if pending is not None:
+            builder, frame = pending
+            builder(frame)
     
-    def create_age_tab(self):
-        frame = ttk.Frame(self.notebook)
-        self.notebook.add(frame, text="Распределение по возрасту")
-        
-        ages = [p.age for p in self.patients]
-        
-        fig = Figure(figsize=(6, 4), dpi=100)
-        ax = fig.add_subplot(111)
-        ax.hist(ages, bins=10, edgecolor='black', color='#3498db')
-        ax.set_xlabel('Возраст')
-        ax.set_ylabel('Количество пациентов')
-        ax.set_title('Распределение пациентов по возрасту')
-        
+    def show_figure(self, fig, frame):
         canvas = FigureCanvasTkAgg(fig, frame)
         canvas.draw()
         canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
     
-    def create_bmi_gender_tab(self):
-        frame = ttk.Frame(self.notebook)
-        self.notebook.add(frame, text="ИМТ по полу")
-        
-        male_bmi = [p.bmi for p in self.patients if p.gender == 'М']
-        female_bmi = [p.bmi for p in self.patients if p.gender == 'Ж']
-        
-        fig = Figure(figsize=(6, 4), dpi=100)
-        ax = fig.add_subplot(111)
-        
-        data = [male_bmi, female_bmi]
-        labels = ['Мужчины', 'Женщины']
-        colors = ['#3498db', '#e74c3c']
-        
-        box_plot = ax.boxplot(data, labels=labels, patch_artist=True)
-        for patch, color in zip(box_plot['boxes'], colors):
-            patch.set_facecolor(color)
-            patch.set_alpha(0.7)
-            
-        ax.set_ylabel('ИМТ')
-        ax.set_title('Распределение ИМТ по полу')
-        
-        canvas = FigureCanvasTkAgg(fig, frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    def column(self, name, gender=None):
+        """Значения показателя для всех пациентов или только для одного пола"""
+        return patient_column(self.patients, name, gender)
     
-    def create_bmi_age_tab(self):
-        frame = ttk.Frame(self.notebook)
-        self.notebook.add(frame, text="ИМТ vs Возраст")
-        
-        ages = [p.age for p in self.patients]
-        bmis = [p.bmi for p in self.patients]
-        genders = [p.gender for p in self.patients]
-        
-        fig = Figure(figsize=(6, 4), dpi=100)
-        ax = fig.add_subplot(111)
-        
-        # Разделяем точки по полу для разного цвета
-        male_ages = [age for age, gender in zip(ages, genders) if gender == 'М']
-        male_bmis = [bmi for bmi, gender in zip(bmis, genders) if gender == 'М']
-        female_ages = [age for age, gender in zip(ages, genders) if gender == 'Ж']
-        female_bmis = [bmi for bmi, gender in zip(bmis, genders) if gender == 'Ж']
-        
-        ax.scatter(male_ages, male_bmis, alpha=0.7, color='#3498db', label='Мужчины')
-        ax.scatter(female_ages, female_bmis, alpha=0.7, color='#e74c3c', label='Женщины')
-        ax.set_xlabel('Возраст')
-        ax.set_ylabel('ИМТ')
-        ax.set_title('Зависимость ИМТ от возраста')
-        ax.legend()
-        
-        canvas = FigureCanvasTkAgg(fig, frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    # Графики строит emias_charts - те же, что в пакетных отчетах
+    
+    @METRICS.timed()
+    def create_gender_tab(self, frame):
+        self.show_figure(gender_figure(self.aggregates.gender_counts), frame)
+    
+    @METRICS.timed()
+    def create_age_tab(self, frame):
+        self.show_figure(age_figure(*self.aggregates.age_histogram()), frame)
+    
+    @METRICS.timed()
+    def create_bmi_gender_tab(self, frame):
+        stats = [self.aggregates.bmi_box_stats('М', 'Мужчины'),
+                 self.aggregates.bmi_box_stats('Ж', 'Женщины')]
+        self.show_figure(bmi_gender_figure(stats), frame)
+    
+    @METRICS.timed()
+    def create_bmi_age_tab(self, frame):
+        points = BmiAgePoints.collect(self.column, self.scatter_limit)
+        self.show_figure(bmi_age_figure(points), frame)
+
+def report_startup(root):
+    STARTUP.mark('первое окно')
+    STARTUP.report()
+    # Загрузка пациентов идет в фоне - допечатываем, когда она закончится
+    def wait_loaded():
+        if 'пациенты загружены' in dict(STARTUP.events):
+            name, moment = STARTUP.events[-1]
+            print(f"  {moment * 1000:8.1f} мс  {name}", file=sys.stderr)
+        else:
+            root.after(100, wait_loaded)
+    wait_loaded()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обкуренный ЕМИАС")
+    parser.add_argument('--startup-report', action='store_true',
+                        help='вывести время этапов запуска и отложенных импортов')
+    parser.add_argument('--metrics', action='store_true',
+                        help='замерять операции и зависания интерфейса (F12 - сохранить замеры)')
+    args = parser.parse_args()
+    if args.metrics:
+        METRICS.enabled = True
+    if METRICS.enabled:
+        METRICS.slow_log_file = 'emias_slow.log'
+    
     root = tk.Tk()
+    STARTUP.mark('создание Tk')
     root.geometry("1000x700")
     root.title("Обкуренный ЕМИАС")
     app = MainApp(root)
+    STARTUP.mark('интерфейс построен')
+    if args.startup_report:
+        # after_idle срабатывает, когда окно уже отрисовано
+        root.after_idle(report_startup, root)
     root.mainloop()
@@ -0,0 +1,305 @@
+"""Воспроизводимые замеры производительности ЕМИАС.
+
+Замеряются загрузка и сохранение хранилища, обновление таблицы, поиск и
+построение вкладок статистики на синтетических наборах из 1k, 10k, 100k и 1M
+пациентов. Tk не нужен: Treeview подменяется заглушкой, графики рисуются
+бэкендом Agg. Результаты сохраняются в JSON и сравниваются между версиями:
+
+    python benchmarks/run_benchmarks.py -o before.json
+    python benchmarks/run_benchmarks.py -o after.json
+    python benchmarks/run_benchmarks.py --compare before.json after.json
+
+С --warmup N перед каждым замером делается N прогонов без замера; число
+записывается в meta, и --compare предупреждает, если у прогонов оно разное.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import emias_core  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data')
+# Незамеряемых прогонов перед замером (--warmup); 0 - как в первых прогонах, с холодными кэшами
+WARMUP = 0
+
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов',
+              'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев']
+FIRST_NAMES = {'М': ['Александр', 'Сергей', 'Иван', 'Дмитрий', 'Андрей', 'Максим', 'Павел'],
+               'Ж': ['Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Татьяна', 'Ирина']}
+MIDDLE_NAMES = {'М': ['Иванович', 'Петрович', 'Сергеевич', 'Андреевич', 'Олегович'],
+                'Ж': ['Ивановна', 'Петровна', 'Сергеевна', 'Андреевна', 'Олеговна']}
+
+def synthetic_records(count, seed):
+    """Быстрый воспроизводимый генератор без Faker (Faker на 1M записей слишком медленный)"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        gender = rng.choice('МЖ')
+        suffix = 'а' if gender == 'Ж' else ''
+        yield {
+            'full_name': f"{rng.choice(LAST_NAMES)}{suffix} {rng.choice(FIRST_NAMES[gender])} "
+                         f"{rng.choice(MIDDLE_NAMES[gender])}",
+            'age': rng.randint(18, 90),
+            'gender': gender,
+            'height': rng.randint(150, 200),
+            'weight': rng.randint(45, 130)
+        }
+
+def dataset(size, seed):
+    """Путь к снимку patients.json нужного размера; файлы кэшируются между запусками"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f'patients_{size}_{seed}.json')
+    if not os.path.exists(path):
+        emias_core.write_json_store(path + '.tmp', synthetic_records(size, seed))
+        os.replace(path + '.tmp', path)
+    return path
+
+def load_gui():
+    """Модуль интерфейса (имя файла с точками, поэтому импорт по пути)"""
+    spec = importlib.util.spec_from_file_location('emias_gui', os.path.join(ROOT, 'EMIAS_version_4.20.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FakeTree:
+    """Заглушка ttk.Treeview: хранит значения строк без Tk"""
+    
+    def __init__(self):
+        self.items = {}
+        self.selected = ()
+    
+    def bind(self, *args):
+        pass
+    
+    def insert(self, parent, index, iid=None, values=()):
+        self.items[iid] = values
+        return iid
+    
+    def delete(self, iid):
+        del self.items[iid]
+    
+    def item(self, iid, values=None):
+        self.items[iid] = values
+    
+    def move(self, iid, parent, index):
+        pass
+    
+    def selection(self):
+        return self.selected
+    
+    def selection_set(self, items):
+        self.selected = (items,) if isinstance(items, str) else tuple(items)
+
+class FakeScrollbar:
+    def configure(self, **options):
+        pass
+    
+    def set(self, first, last):
+        pass
+
+def measure(func, repeat, setup=None):
+    """Времена repeat запусков func; setup готовит свежее состояние и в замер не входит.
+    
+    С --warmup первые WARMUP запусков не замеряются: в них строятся ленивые
+    кэши (ИМТ, страницы).
+    """
+    if not setup:
+        for _ in range(WARMUP):
+            func()
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        func(state) if setup else func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+def copy_store(path, workdir):
+    target = os.path.join(workdir, 'patients.json')
+    with open(path, 'rb') as src, open(target, 'wb') as dst:
+        dst.write(src.read())
+    for suffix in ('.wal', '.tmp'):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    return target
+
+def bench_storage(path, workdir, repeat):
+    results = {}
+    store = copy_store(path, workdir)
+    manager = emias_core.PatientManager(store, initial_data=False)
+    results['load_data'] = measure(manager.load_data, repeat)
+    results['save_data'] = measure(manager.save_data, repeat)
+    
+    def background_load():
+        loader = emias_core.PatientManager(store, background=True, initial_data=False)
+        loader.start_background_load()
+        while loader.loading:
+            if loader.poll_background_load() is None:
+                time.sleep(0.001)
+    results['background_load'] = measure(background_load, repeat)
+    
+    binary = emias_core.PatientManager(os.path.join(workdir, 'patients.bin'), initial_data=False)
+    binary.patients = manager.patients
+    results['save_binary'] = measure(binary.save_data, repeat)
+    results['load_binary'] = measure(binary.load_data, repeat)
+    
+    journal = emias_core.PatientManager(store, journal=True, initial_data=False)
+    patient = emias_core.Patient('Тестов Тест Тестович', 40, 'М', 180, 80)
+    results['journal_add_patient'] = measure(lambda: journal.add_patient(patient), repeat)
+    # Дальше работаем с журнальным менеджером, как приложение по умолчанию
+    return results, journal
+
+def bench_table(gui, manager, repeat):
+    results = {}
+    table = gui.VirtualTable(FakeTree(), FakeScrollbar(), manager.count, manager.get_page,
+                             lambda patient: (patient.full_name, patient.age, patient.gender,
+                                              patient.height, patient.weight, patient.bmi),
+                             manager.get_patient)
+    results['update_table'] = measure(table.refresh, repeat)
+    rng = random.Random(0)
+    
+    def scroll():
+        for _ in range(100):
+            table.set_offset(rng.randrange(max(1, table.total)))
+    results['scroll_100_pages'] = measure(scroll, repeat)
+    
+    def edit_row():
+        patient = manager.patients[rng.randrange(table.total)]
+        manager.update_patient(patient.key, patient)
+        table.key_changed(patient.key)
+    results['edit_row'] = measure(edit_row, repeat)
+    
+    for field in ('full_name', 'bmi'):
+        results[f'sort_build:{field}'] = measure(
+            lambda: (manager.invalidate_indexes(), manager.sorted_view(field)), 1)
+    state = {'descending': False}
+    
+    def toggle_sort():
+        state['descending'] = not state['descending']
+        table.set_view(manager.sorted_view('bmi', state['descending']))
+    results['sort_toggle'] = measure(toggle_sort, repeat)
+    results['edit_row_sorted'] = measure(edit_row, repeat)
+    table.set_view(None)
+    return results
+
+def bench_search(manager, repeat):
+    results = {'build_name_index': measure(lambda: (manager.invalidate_indexes(), manager.name_index()), 1)}
+    for query in ('иванов', 'смирнова анна', 'иванова анна', 'смирнова анна ивановна', 'кузнецв'):
+        results[f'search:{query}'] = measure(lambda: manager.search(query), repeat)
+    return results
+
+def bench_stats(gui, manager, repeat):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    results = {'aggregates': measure(lambda: emias_core.PatientAggregates.from_patients(manager.patients), repeat)}
+    window = gui.StatsWindow.__new__(gui.StatsWindow)
+    window.patients = manager.patients
+    window.aggregates = manager.aggregates()
+    window.scatter_limit = gui.StatsWindow.SCATTER_LIMIT
+    # Вместо FigureCanvasTkAgg рисуем тем же Agg, но без окна
+    window.show_figure = lambda fig, frame: FigureCanvasAgg(fig).draw()
+    for name in ('create_gender_tab', 'create_age_tab', 'create_bmi_gender_tab', 'create_bmi_age_tab'):
+        results[name] = measure(lambda: getattr(window, name)(None), repeat)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes, repeat, seed, groups, warmup=0):
+    import tempfile
+    
+    global WARMUP
+    WARMUP = warmup
+    gui = load_gui()
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seed': seed,
+            'repeat': repeat,
+            'warmup': warmup
+        },
+        'results': {}
+    }
+    for size in sizes:
+        path = dataset(size, seed)
+        print(f"== {size} пациентов", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as workdir:
+            results, manager = bench_storage(path, workdir, repeat)
+            if 'table' in groups:
+                results.update(bench_table(gui, manager, repeat))
+            if 'search' in groups:
+                results.update(bench_search(manager, repeat))
+            if 'stats' in groups and emias_core.load_numpy() is not None:
+                results.update(bench_stats(gui, manager, repeat))
+        for name, timing in results.items():
+            report['results'].setdefault(name, {})[str(size)] = timing
+            print(f"  {name:<28} {timing['median'] * 1000:10.2f} мс", file=sys.stderr)
+    return report
+
+def compare(before_path, after_path, threshold):
+    """Сравнение двух прогонов по медианам; код возврата 1 при замедлении выше порога"""
+    with open(before_path, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_path, encoding='utf-8') as f:
+        after = json.load(f)
+    # В старых прогонах warmup не записывался: они шли без прогрева
+    warmups = [report['meta'].get('warmup', 0) for report in (before, after)]
+    if warmups[0] != warmups[1]:
+        print(f"Внимание: прогоны с разным прогревом ({warmups[0]} и {warmups[1]}), "
+              "сравнение неточно", file=sys.stderr)
+    before, after = before['results'], after['results']
+    regressions = 0
+    print(f"{'замер':<28} {'размер':>8} {'было, мс':>10} {'стало, мс':>10} {'x':>6}")
+    for name in sorted(set(before) & set(after)):
+        for size in sorted(set(before[name]) & set(after[name]), key=int):
+            old, new = before[name][size]['median'], after[name][size]['median']
+            ratio = new / old if old else float('inf')
+            flag = ''
+            if ratio > threshold:
+                flag = '  ЗАМЕДЛЕНИЕ'
+                regressions += 1
+            print(f"{name:<28} {size:>8} {old * 1000:10.2f} {new * 1000:10.2f} {ratio:6.2f}{flag}")
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности ЕМИАС")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='размеры наборов')
+    parser.add_argument('--repeat', type=int, default=5, help='повторов каждого замера')
+    parser.add_argument('--seed', type=int, default=42, help='зерно синтетических данных')
+    parser.add_argument('--warmup', type=int, default=0,
+                        help='незамеряемых прогонов перед каждым замером (без setup)')
+    parser.add_argument('--only', nargs='+', choices=['table', 'search', 'stats'],
+                        default=['table', 'search', 'stats'], help='группы замеров кроме хранилища')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='файл результатов')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='сравнить два прогона')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='во сколько раз медиана может вырасти без сигнала о замедлении')
+    args = parser.parse_args(argv)
+    
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+    report = run(args.sizes, args.repeat, args.seed, args.only, args.warmup)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты: {args.output}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
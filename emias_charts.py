@@ -0,0 +1,264 @@
+"""Графики статистики ЕМИАС без интерфейса и пакетная отрисовка отчетов.
+
+Те же четыре графика, что в окне статистики, строятся здесь на Figure без
+pyplot и Tk. Окно статистики показывает их через FigureCanvasTkAgg, а
+отчеты рисуются через Agg в PNG/PDF пулом процессов:
+
+    python emias_cli.py report --cohort "Женщины 40-60: пол=Ж возраст=40..60" -o reports
+    python emias_cli.py report therapy.json surgery.bin --format png pdf -o reports
+"""
+import os
+import re
+
+from emias_core import Cohort, PatientAggregates, PatientStore, lazy_import, load_numpy, open_store
+
+# Выше этого числа точек ИМТ vs Возраст рисуется как карта плотности
+SCATTER_LIMIT = 20000
+
+# Графики отчета: имя для файлов и название вкладки окна статистики
+CHARTS = (('gender', 'Распределение по полу'),
+          ('age', 'Распределение по возрасту'),
+          ('bmi_gender', 'ИМТ по полу'),
+          ('bmi_age', 'ИМТ vs Возраст'))
+
+REPORT_FORMATS = ('png', 'pdf')
+
+def new_figure():
+    return lazy_import('matplotlib.figure').Figure(figsize=(6, 4), dpi=100)
+
+def patient_column(patients, name, gender=None):
+    """Значения показателя для всех пациентов или только для одного пола"""
+    if isinstance(patients, (PatientStore, Cohort)):
+        return patients.column(name, gender)
+    return [getattr(p, name) for p in patients if gender is None or p.gender == gender]
+
+class BmiAgePoints:
+    """Данные графика ИМТ vs Возраст: точки по полу или, если точек много, их двумерные гистограммы.
+    
+    groups - {пол: (возрасты, ИМТ)} для точек или {пол: counts} для карты
+    плотности, edges - общие корзины (возраст, ИМТ) карты плотности.
+    """
+    
+    def __init__(self, groups, edges=None):
+        self.groups = groups
+        self.edges = edges
+    
+    @classmethod
+    def collect(cls, column, scatter_limit=SCATTER_LIMIT):
+        """Сбор по функции column(name, gender), как у StatsWindow.column"""
+        groups = {gender: (column('age', gender), column('bmi', gender)) for gender in ('М', 'Ж')}
+        np = load_numpy()
+        if np is None or sum(len(ages) for ages, _ in groups.values()) <= scatter_limit:
+            return cls(groups)
+        # Двумерная гистограмма за один векторный проход; корзины общие, чтобы графики были сопоставимы
+        all_ages = np.concatenate([np.asarray(ages) for ages, _ in groups.values()])
+        all_bmis = np.concatenate([np.asarray(bmis) for _, bmis in groups.values()])
+        age_edges = np.arange(all_ages.min(), all_ages.max() + 2) - 0.5
+        bmi_edges = np.linspace(all_bmis.min(), all_bmis.max(), 61)
+        counts = {gender: np.histogram2d(ages, bmis, bins=(age_edges, bmi_edges))[0]
+                  for gender, (ages, bmis) in groups.items()}
+        return cls(counts, (age_edges, bmi_edges))
+
+class ChartData:
+    """Все, что нужно для четырех графиков: сводки и данные ИМТ vs Возраст.
+    
+    Объект небольшой и не зависит от числа пациентов сверх SCATTER_LIMIT,
+    поэтому в рабочие процессы передается он, а не списки пациентов.
+    """
+    
+    def __init__(self, title, count, gender_counts, ages, age_counts, bmi_stats, bmi_age):
+        self.title = title
+        self.count = count
+        self.gender_counts = gender_counts
+        self.ages = ages
+        self.age_counts = age_counts
+        self.bmi_stats = bmi_stats
+        self.bmi_age = bmi_age
+    
+    @classmethod
+    def collect(cls, title, patients, aggregates=None, scatter_limit=SCATTER_LIMIT):
+        aggregates = aggregates or PatientAggregates.from_patients(patients)
+        ages, age_counts = aggregates.age_histogram()
+        return cls(title, sum(aggregates.gender_counts.values()), dict(aggregates.gender_counts),
+                   ages, age_counts,
+                   [aggregates.bmi_box_stats('М', 'Мужчины'), aggregates.bmi_box_stats('Ж', 'Женщины')],
+                   BmiAgePoints.collect(lambda name, gender: patient_column(patients, name, gender),
+                                        scatter_limit))
+    
+    def figures(self):
+        """Пары (имя графика, Figure) в порядке CHARTS"""
+        if not self.count:
+            return [(name, empty_figure(title)) for name, title in CHARTS]
+        return [('gender', gender_figure(self.gender_counts)),
+                ('age', age_figure(self.ages, self.age_counts)),
+                ('bmi_gender', bmi_gender_figure(self.bmi_stats)),
+                ('bmi_age', bmi_age_figure(self.bmi_age))]
+
+def empty_figure(title):
+    """Заглушка вместо графика, когда в когорте нет пациентов"""
+    fig = new_figure()
+    ax = fig.add_subplot(111)
+    ax.set_axis_off()
+    ax.set_title(title)
+    ax.text(0.5, 0.5, 'нет пациентов', ha='center', va='center', fontsize=14, color='gray')
+    return fig
+
+def gender_figure(gender_counts):
+    if not gender_counts.get('М') and not gender_counts.get('Ж'):
+        # pie не рисует одни нули
+        return empty_figure('Распределение пациентов по полу')
+    fig = new_figure()
+    ax = fig.add_subplot(111)
+    colors = ['#3498db', '#e74c3c']  # Синий и красный
+    ax.pie([gender_counts.get('М', 0), gender_counts.get('Ж', 0)], labels=['Мужчины', 'Женщины'],
+           autopct='%1.1f%%', colors=colors)
+    ax.set_title('Распределение пациентов по полу')
+    return fig
+
+def age_figure(ages, counts):
+    # Гистограмма строится по сводке "возраст - число пациентов"
+    fig = new_figure()
+    ax = fig.add_subplot(111)
+    ax.hist(ages, bins=10, weights=counts, edgecolor='black', color='#3498db')
+    ax.set_xlabel('Возраст')
+    ax.set_ylabel('Количество пациентов')
+    ax.set_title('Распределение пациентов по возрасту')
+    return fig
+
+def bmi_gender_figure(stats):
+    # Ящики строятся по квантилям из сводок ИМТ, а не по списку всех значений
+    fig = new_figure()
+    ax = fig.add_subplot(111)
+    colors = ['#3498db', '#e74c3c']
+    
+    box_plot = ax.bxp(stats, patch_artist=True)
+    for patch, color in zip(box_plot['boxes'], colors):
+        patch.set_facecolor(color)
+        patch.set_alpha(0.7)
+    
+    ax.set_ylabel('ИМТ')
+    ax.set_title('Распределение ИМТ по полу')
+    return fig
+
+def bmi_age_figure(points):
+    if points.edges is not None:
+        return bmi_age_density_figure(points)
+    fig = new_figure()
+    ax = fig.add_subplot(111)
+    
+    # Разделяем точки по полу для разного цвета
+    (male_ages, male_bmis), (female_ages, female_bmis) = points.groups['М'], points.groups['Ж']
+    ax.scatter(male_ages, male_bmis, alpha=0.7, color='#3498db', label='Мужчины')
+    ax.scatter(female_ages, female_bmis, alpha=0.7, color='#e74c3c', label='Женщины')
+    ax.set_xlabel('Возраст')
+    ax.set_ylabel('ИМТ')
+    ax.set_title('Зависимость ИМТ от возраста')
+    ax.legend()
+    return fig
+
+def bmi_age_density_figure(points):
+    """Карта плотности ИМТ vs Возраст по готовым двумерным гистограммам"""
+    np = load_numpy()
+    age_edges, bmi_edges = points.edges
+    
+    fig = new_figure()
+    axes = fig.subplots(1, 2, sharey=True)
+    groups = (('Мужчины', points.groups['М'], 'Blues'), ('Женщины', points.groups['Ж'], 'Reds'))
+    for ax, (label, counts, cmap) in zip(axes, groups):
+        mesh = ax.pcolormesh(age_edges, bmi_edges, np.ma.masked_equal(counts.T, 0), cmap=cmap)
+        fig.colorbar(mesh, ax=ax, label='Пациентов')
+        ax.set_title(label)
+        ax.set_xlabel('Возраст')
+    axes[0].set_ylabel('ИМТ')
+    fig.suptitle('Зависимость ИМТ от возраста (плотность)')
+    return fig
+
+# Пакетная отрисовка отчетов
+
+def collect_cohort(manager, title, expression=None, scatter_limit=SCATTER_LIMIT):
+    """ChartData по когорте менеджера или, без выражения, по всем пациентам"""
+    if expression or not isinstance(manager.patients, PatientStore):
+        # В SQLite столбцы всех пациентов тоже берутся запросом, а не перебором записей
+        cohort = manager.query(expression or '')
+        return ChartData.collect(title, cohort, cohort.aggregates(), scatter_limit)
+    return ChartData.collect(title, manager.patients, manager.aggregates(), scatter_limit)
+
+def report_filename(title):
+    """Имя файла отчета из названия когорты или отделения"""
+    return re.sub(r'[^\w.-]+', '_', title).strip('_') or 'report'
+
+def write_report(data, output_dir, formats=('png',)):
+    """Отрисовка четырех графиков через Agg: PNG на каждый график и/или один PDF на отчет.
+    
+    Возвращает пути записанных файлов.
+    """
+    FigureCanvasAgg = lazy_import('matplotlib.backends.backend_agg').FigureCanvasAgg
+    base = os.path.join(output_dir, report_filename(data.title))
+    figures = data.figures()
+    written = []
+    for name, fig in figures:
+        FigureCanvasAgg(fig)
+        fig.text(0.99, 0.01, f"{data.title}: пациентов {data.count}", ha='right', va='bottom',
+                 fontsize=7, color='gray')
+    if 'png' in formats:
+        for name, fig in figures:
+            fig.savefig(f"{base}_{name}.png")
+            written.append(f"{base}_{name}.png")
+    if 'pdf' in formats:
+        PdfPages = lazy_import('matplotlib.backends.backend_pdf').PdfPages
+        with PdfPages(base + '.pdf', metadata={'Title': data.title}) as pdf:
+            for name, fig in figures:
+                pdf.savefig(fig)
+        written.append(base + '.pdf')
+    return written
+
+def render_job(job):
+    """Один отчет в рабочем процессе; возвращает записанные файлы и ошибки [(название, текст)].
+    
+    job - ('data', ChartData, ...) с уже собранными сводками или ('file', путь,
+    [(название, выражение), ...]): хранилище читает сам рабочий процесс, и
+    между процессами передаются только пути и имена файлов. Ошибка одного
+    отчета не останавливает остальные.
+    """
+    kind, source, extra, output_dir, formats, scatter_limit = job
+    written, errors = [], []
+    if kind == 'data':
+        try:
+            written.extend(write_report(source, output_dir, formats))
+        except Exception as e:
+            errors.append((source.title, f"{type(e).__name__}: {e}"))
+        return written, errors
+    try:
+        manager = open_store(source)
+    except Exception as e:
+        return written, [(source, f"{type(e).__name__}: {e}")]
+    for title, expression in extra:
+        try:
+            written.extend(write_report(collect_cohort(manager, title, expression, scatter_limit),
+                                        output_dir, formats))
+        except Exception as e:
+            errors.append((title, f"{type(e).__name__}: {e}"))
+    return written, errors
+
+def render_reports(jobs, output_dir, formats=('png',), workers=None, scatter_limit=SCATTER_LIMIT,
+                   progress=None):
+    """Отрисовка отчетов пулом процессов; возвращает пути записанных файлов и ошибки отчетов.
+    
+    jobs - ChartData (сводки уже собраны, например по когортам одного
+    хранилища) или пары (путь к хранилищу, [(название, выражение), ...]):
+    такие хранилища читаются и сводятся прямо в рабочих процессах.
+    """
+    import multiprocessing
+    
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [('data', job, None, output_dir, formats, scatter_limit) if isinstance(job, ChartData)
+             else ('file', job[0], job[1], output_dir, formats, scatter_limit) for job in jobs]
+    written, errors = [], []
+    # Отчеты независимы - порядок готовности не важен
+    with multiprocessing.Pool(min(workers or os.cpu_count() or 1, len(tasks) or 1)) as pool:
+        for done, (files, failed) in enumerate(pool.imap_unordered(render_job, tasks), 1):
+            written.extend(files)
+            errors.extend(failed)
+            if progress is not None:
+                progress(done, len(tasks))
+    return written, errors
@@ -0,0 +1,363 @@
+"""Командная строка ЕМИАС: импорт, экспорт, фильтрация и ИМТ без интерфейса.
+
+Все команды обрабатывают пациентов потоком, по одной записи, поэтому
+подходят для выгрузок регистра, которые не помещаются в память.
+
+    python emias_cli.py export -o patients.csv
+    python emias_cli.py import dump.jsonl
+    python emias_cli.py filter dump.csv --gender Ж --min-age 40 --max-age 60 -o cohort.jsonl
+    python emias_cli.py bmi patients.json --summary
+    python emias_cli.py convert patients.json patients.bin
+    python emias_cli.py cohort "пол=Ж возраст=40..60 имт>=30" --group-by category
+    python emias_cli.py report --cohort "Женщины 40-60: пол=Ж возраст=40..60" -o reports
+"""
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from emias_charts import REPORT_FORMATS, SCATTER_LIMIT, collect_cohort, render_reports
+from emias_core import (BINARY_SUFFIX, FAKER_AVAILABLE, GROUP_FIELDS, CohortQuery, PatientManager,
+                        append_to_store, calc_bmi, generate_dataset, iter_json_array,
+                        iter_store_records, normalize_record, open_store, write_binary_store,
+                        write_json_store)
+
+FIELDS = ['full_name', 'age', 'gender', 'height', 'weight']
+FORMATS = ('json', 'jsonl', 'csv')
+
+def detect_format(path, explicit=None):
+    if explicit:
+        return explicit
+    for fmt in FORMATS:
+        if path.endswith('.' + fmt):
+            return fmt
+    return 'jsonl' if path == '-' else 'json'
+
+def open_text(path, mode):
+    if path == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    return open(path, mode, encoding='utf-8', newline='' if path.endswith('.csv') else None)
+
+def read_records(path, fmt=None, chunk_size=1 << 16):
+    """Записи пациентов из JSON, JSONL или CSV по одной"""
+    fmt = detect_format(path, fmt)
+    f = open_text(path, 'r')
+    try:
+        if fmt == 'json':
+            yield from iter_json_array(iter(lambda: f.read(chunk_size), ''))
+        elif fmt == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+class RecordWriter:
+    """Потоковая запись пациентов в JSON, JSONL или CSV"""
+    
+    def __init__(self, path, fmt=None, fields=FIELDS):
+        self.fmt = detect_format(path, fmt)
+        self.fields = fields
+        self.count = 0
+        self.file = open_text(path, 'w')
+        if self.fmt == 'csv':
+            self.csv = csv.DictWriter(self.file, fieldnames=fields, extrasaction='ignore')
+            self.csv.writeheader()
+        elif self.fmt == 'json':
+            self.file.write('[')
+    
+    def write(self, record):
+        if self.fmt == 'csv':
+            self.csv.writerow(record)
+        else:
+            line = json.dumps(record, ensure_ascii=False)
+            if self.fmt == 'json':
+                line = (',\n' if self.count else '\n') + line
+            else:
+                line += '\n'
+            self.file.write(line)
+        self.count += 1
+    
+    def close(self):
+        if self.fmt == 'json':
+            self.file.write('\n]\n' if self.count else ']\n')
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+def clean_records(records, strict=False):
+    """Проверка и приведение записей; некорректные пропускаются с сообщением"""
+    skipped = 0
+    for number, item in enumerate(records, 1):
+        try:
+            yield normalize_record(item)
+        except ValueError as e:
+            if strict:
+                raise ValueError(f"Запись {number}: {e}") from None
+            skipped += 1
+            print(f"Пропущена запись {number}: {e}", file=sys.stderr)
+    if skipped:
+        print(f"Всего пропущено записей: {skipped}", file=sys.stderr)
+
+def filter_records(records, gender=None, min_age=None, max_age=None, name_prefix=None,
+                   min_bmi=None, max_bmi=None):
+    """Отбор записей по тем же условиям, что и PatientManager.filter_patients"""
+    need_bmi = min_bmi is not None or max_bmi is not None
+    for record in records:
+        if gender is not None and record['gender'] != gender:
+            continue
+        if min_age is not None and record['age'] < min_age:
+            continue
+        if max_age is not None and record['age'] > max_age:
+            continue
+        if name_prefix and not record['full_name'].startswith(name_prefix):
+            continue
+        if need_bmi:
+            bmi = calc_bmi(record['height'], record['weight'])
+            if min_bmi is not None and bmi < min_bmi:
+                continue
+            if max_bmi is not None and bmi > max_bmi:
+                continue
+        yield record
+
+def filter_options(args):
+    return {name: getattr(args, name) for name in
+            ('gender', 'min_age', 'max_age', 'name_prefix', 'min_bmi', 'max_bmi')}
+
+def cmd_import(args):
+    records = clean_records(read_records(args.source, args.format), args.strict)
+    added = append_to_store(args.store, records)
+    print(f"Импортировано пациентов: {added}", file=sys.stderr)
+
+def cmd_export(args):
+    records = filter_records(iter_store_records(args.store), **filter_options(args))
+    with RecordWriter(args.output, args.format) as writer:
+        for record in records:
+            writer.write(record)
+    print(f"Выгружено пациентов: {writer.count}", file=sys.stderr)
+
+def cmd_filter(args):
+    records = clean_records(read_records(args.source, args.format), args.strict)
+    with RecordWriter(args.output, args.output_format) as writer:
+        for record in filter_records(records, **filter_options(args)):
+            writer.write(record)
+    print(f"Подходит пациентов: {writer.count}", file=sys.stderr)
+
+def cmd_bmi(args):
+    """ИМТ для каждой записи и/или сводка по полу с постоянным расходом памяти"""
+    records = clean_records(read_records(args.source, args.format), args.strict)
+    counts, totals, minimum, maximum = Counter(), Counter(), {}, {}
+    writer = None if args.summary and args.output is None else \
+        RecordWriter(args.output or '-', args.output_format, fields=FIELDS + ['bmi'])
+    for record in records:
+        bmi = calc_bmi(record['height'], record['weight'])
+        gender = record['gender']
+        counts[gender] += 1
+        totals[gender] += bmi
+        minimum[gender] = min(bmi, minimum.get(gender, bmi))
+        maximum[gender] = max(bmi, maximum.get(gender, bmi))
+        if writer is not None:
+            record['bmi'] = bmi
+            writer.write(record)
+    if writer is not None:
+        writer.close()
+    if args.summary:
+        print("Пол  Пациентов  ИМТ средний  мин    макс", file=sys.stderr)
+        for gender in sorted(counts):
+            print(f"{gender:<4} {counts[gender]:>9}  {totals[gender] / counts[gender]:>11.2f}  "
+                  f"{minimum[gender]:<6} {maximum[gender]}", file=sys.stderr)
+
+def cmd_generate(args):
+    if not FAKER_AVAILABLE:
+        sys.exit("Библиотека Faker не установлена")
+    started = time.perf_counter()
+    total = generate_dataset(
+        args.output, args.count, seed=args.seed, workers=args.workers, jsonl=args.jsonl,
+        progress=lambda done, count: print(f"\r{done}/{count}", end='', file=sys.stderr))
+    print(f"\nСгенерировано {total} пациентов за {time.perf_counter() - started:.1f} с: {args.output}",
+          file=sys.stderr)
+
+def cmd_compact(args):
+    # Свертка применяет журнал к снимку и требует загрузки хранилища в память
+    manager = PatientManager(args.store, journal=True, initial_data=False)
+    manager.compact()
+    print(f"Журнал свернут, пациентов: {len(manager.patients)}", file=sys.stderr)
+
+def cmd_convert(args):
+    """Перенос хранилища (снимок и журнал) в JSON или бинарный снимок, по расширению результата"""
+    records = iter_store_records(args.source)
+    if args.output.endswith(BINARY_SUFFIX):
+        count = write_binary_store(args.output, records)
+    else:
+        count = write_json_store(args.output, records)
+    print(f"Перенесено пациентов: {count}", file=sys.stderr)
+
+def cmd_cohort(args):
+    """Когорта хранилища по выражению: выгрузка пациентов или сводка по группам"""
+    # Условия вычисляются по столбцам (или запросом к SQLite), хранилище загружается в память
+    manager = open_store(args.store)
+    cohort = manager.query(args.expression)
+    if args.group_by:
+        print(f"{'Группа':<10} {'Пациентов':>9}  {'Возраст':>7}  {'ИМТ':>6}")
+        for label, group in cohort.group_by(args.group_by).items():
+            print(f"{label:<10} {group['count']:>9}  {group['age']:>7.1f}  {group['bmi']:>6.2f}")
+    else:
+        with RecordWriter(args.output, args.format) as writer:
+            for key in cohort:
+                writer.write(PatientManager.patient_to_dict(manager.get_patient(key)))
+    print(f"Пациентов в когорте: {len(cohort)}", file=sys.stderr)
+
+def read_cohorts(args):
+    """Когорты отчета "название: выражение" из --cohort и файла --cohorts"""
+    specs = list(args.cohort or [])
+    if args.cohorts:
+        with open(args.cohorts, encoding='utf-8') as f:
+            specs.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    cohorts = []
+    for spec in specs:
+        title, separator, expression = spec.partition(':')
+        if not separator:
+            title = expression = spec
+        # Ошибка в выражении видна сразу, а не в рабочем процессе
+        CohortQuery.parse(expression)
+        cohorts.append((title.strip(), expression.strip()))
+    return cohorts
+
+def cmd_report(args):
+    """Графики статистики в PNG/PDF по когортам хранилища или по нескольким хранилищам"""
+    if importlib.util.find_spec('matplotlib') is None:
+        sys.exit("Библиотека matplotlib не установлена")
+    started = time.perf_counter()
+    cohorts = read_cohorts(args)
+    if args.sources:
+        # Хранилища читаются и сводятся в рабочих процессах, по одному на процесс
+        jobs = []
+        for source in args.sources:
+            # Имя с расширением: patients.json и patients.db дают разные отчеты
+            name = os.path.basename(source)
+            jobs.append((source, [(f"{name} {title}", expression) for title, expression in cohorts]
+                         or [(name, None)]))
+    else:
+        # Когорты одного хранилища сводятся здесь, в процессы уходят только сводки
+        manager = open_store(args.store)
+        jobs = [collect_cohort(manager, title, expression, args.scatter_limit)
+                for title, expression in cohorts or [('Все пациенты', None)]]
+    written, errors = render_reports(
+        jobs, args.output, args.format, args.workers, args.scatter_limit,
+        progress=lambda done, count: print(f"\r{done}/{count}", end='', file=sys.stderr))
+    print(f"\nЗаписано файлов: {len(written)} за {time.perf_counter() - started:.1f} с: {args.output}",
+          file=sys.stderr)
+    for title, message in errors:
+        print(f"Отчет {title} не построен: {message}", file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+def add_filter_arguments(parser):
+    parser.add_argument('--gender', choices=['М', 'Ж'], help='пол')
+    parser.add_argument('--min-age', type=int, help='возраст от')
+    parser.add_argument('--max-age', type=int, help='возраст до')
+    parser.add_argument('--name-prefix', help='начало ФИО')
+    parser.add_argument('--min-bmi', type=float, help='ИМТ от')
+    parser.add_argument('--max-bmi', type=float, help='ИМТ до')
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ЕМИАС без интерфейса: потоковая обработка пациентов")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    command = commands.add_parser('import', help='добавить пациентов из JSON/JSONL/CSV в хранилище')
+    command.add_argument('source', help="файл или '-' для stdin")
+    command.add_argument('--format', choices=FORMATS, help='формат источника (по расширению)')
+    command.add_argument('--store', default='patients.json', help='хранилище JSON')
+    command.add_argument('--strict', action='store_true', help='остановиться на первой ошибке')
+    command.set_defaults(handler=cmd_import)
+    
+    command = commands.add_parser('export', help='выгрузить пациентов хранилища')
+    command.add_argument('-o', '--output', default='-', help="файл или '-' для stdout")
+    command.add_argument('--format', choices=FORMATS, help='формат выгрузки (по расширению)')
+    command.add_argument('--store', default='patients.json', help='хранилище JSON')
+    add_filter_arguments(command)
+    command.set_defaults(handler=cmd_export)
+    
+    command = commands.add_parser('filter', help='отобрать пациентов из файла')
+    command.add_argument('source', help="файл или '-' для stdin")
+    command.add_argument('-o', '--output', default='-', help="файл или '-' для stdout")
+    command.add_argument('--format', choices=FORMATS, help='формат источника')
+    command.add_argument('--output-format', choices=FORMATS, help='формат результата')
+    command.add_argument('--strict', action='store_true', help='остановиться на первой ошибке')
+    add_filter_arguments(command)
+    command.set_defaults(handler=cmd_filter)
+    
+    command = commands.add_parser('bmi', help='рассчитать ИМТ для пациентов из файла')
+    command.add_argument('source', help="файл или '-' для stdin")
+    command.add_argument('-o', '--output', help="файл или '-' для stdout")
+    command.add_argument('--format', choices=FORMATS, help='формат источника')
+    command.add_argument('--output-format', choices=FORMATS, help='формат результата')
+    command.add_argument('--summary', action='store_true', help='сводка ИМТ по полу')
+    command.add_argument('--strict', action='store_true', help='остановиться на первой ошибке')
+    command.set_defaults(handler=cmd_bmi)
+    
+    command = commands.add_parser('generate', help='сгенерировать тестовых пациентов')
+    command.add_argument('count', type=int, help='число пациентов')
+    command.add_argument('-o', '--output', default='patients.json', help='файл для записи')
+    command.add_argument('--seed', type=int, default=0, help='зерно генератора')
+    command.add_argument('--workers', type=int, default=None, help='число процессов (по умолчанию - все ядра)')
+    command.add_argument('--jsonl', action='store_true', help='по одному пациенту в строке (JSON Lines)')
+    command.set_defaults(handler=cmd_generate)
+    
+    command = commands.add_parser('compact', help='свернуть журнал изменений в снимок')
+    command.add_argument('--store', default='patients.json', help='хранилище JSON')
+    command.set_defaults(handler=cmd_compact)
+    
+    command = commands.add_parser('convert', help='перенести хранилище в JSON или бинарный снимок (.bin)')
+    command.add_argument('source', help='хранилище JSON или .bin')
+    command.add_argument('output', help='новое хранилище')
+    command.set_defaults(handler=cmd_convert)
+    
+    command = commands.add_parser('cohort', help='отобрать когорту хранилища по выражению')
+    command.add_argument('expression', help='условия, например "пол=Ж возраст=40..60 имт>=30"')
+    command.add_argument('--store', default='patients.json', help='хранилище JSON, .bin или .db')
+    command.add_argument('--group-by', choices=GROUP_FIELDS, help='сводка по группам вместо выгрузки')
+    command.add_argument('-o', '--output', default='-', help="файл или '-' для stdout")
+    command.add_argument('--format', choices=FORMATS, help='формат выгрузки (по расширению)')
+    command.set_defaults(handler=cmd_cohort)
+    
+    command = commands.add_parser('report', help='нарисовать графики статистики в PNG/PDF без интерфейса')
+    command.add_argument('sources', nargs='*', help='хранилища, по отчету на каждое (по умолчанию --store)')
+    command.add_argument('--store', default='patients.json', help='хранилище JSON, .bin или .db')
+    command.add_argument('--cohort', action='append', help='когорта "название: выражение", можно несколько')
+    command.add_argument('--cohorts', help='файл когорт, по одной "название: выражение" в строке')
+    command.add_argument('-o', '--output', default='reports', help='каталог отчетов')
+    command.add_argument('--format', nargs='+', choices=REPORT_FORMATS, default=['png'],
+                         help='PNG на каждый график и/или PDF на отчет')
+    command.add_argument('--workers', type=int, default=None, help='число процессов (по умолчанию - все ядра)')
+    command.add_argument('--scatter-limit', type=int, default=SCATTER_LIMIT,
+                         help='больше точек ИМТ vs Возраст - карта плотности')
+    command.set_defaults(handler=cmd_report)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        args.handler(args)
+    except BrokenPipeError:
+        # Вывод оборван (например, "| head") - это не ошибка
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except (OSError, ValueError) as e:
+        sys.exit(f"Ошибка: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2909 @@
+"""Ядро ЕМИАС без интерфейса: пациенты, хранилища, индексы и сводки.
+
+Модуль не импортирует tkinter и подходит для серверов и пакетных заданий.
+"""
+import time
+import json
+import os
+import sys
+import codecs
+import functools
+import heapq
+import importlib
+import importlib.util
+import itertools
+import mmap
+import operator
+import queue
+import re
+import sqlite3
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировка через msvcrt
+    fcntl = None
+    import msvcrt
+
+class StartupReport:
+    """Замеры холодного старта: этапы запуска и время отложенных импортов"""
+    
+    def __init__(self, t0):
+        self.t0 = t0
+        self.events = []
+        self.imports = []
+    
+    def mark(self, name):
+        self.events.append((name, time.perf_counter() - self.t0))
+    
+    def record_import(self, name, seconds):
+        self.imports.append((name, seconds, time.perf_counter() - self.t0))
+    
+    def report(self, file=None, target=0.3):
+        file = file or sys.stderr
+        print("Время запуска (с начала импорта модуля):", file=file)
+        for name, moment in self.events:
+            print(f"  {moment * 1000:8.1f} мс  {name}", file=file)
+        if self.imports:
+            print("Отложенные импорты (собственное время | момент):", file=file)
+            for name, seconds, moment in self.imports:
+                print(f"  {seconds * 1000:8.1f} мс | {moment * 1000:8.1f} мс  {name}", file=file)
+        first_window = dict(self.events).get('первое окно')
+        if first_window is not None:
+            verdict = "в норме" if first_window <= target else "ПРЕВЫШЕНО"
+            print(f"До первого окна: {first_window * 1000:.0f} мс "
+                  f"(цель {target * 1000:.0f} мс - {verdict})", file=file)
+        print("Подробно по модулям: python -X importtime EMIAS_version_4.20.py", file=file)
+
+# Интерфейс переставляет t0 на момент своего запуска
+STARTUP = StartupReport(time.perf_counter())
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными границами корзин (секунды), как в Prometheus"""
+    
+    BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self):
+        # Последняя корзина - все, что дольше BOUNDS[-1]
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def add(self, seconds):
+        self.buckets[bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+    
+    def quantile(self, q):
+        """Оценка квантиля с интерполяцией внутри корзины, как histogram_quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = self.BOUNDS[i - 1] if i else 0.0
+                upper = self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+class Metrics:
+    """Замеры операций: гистограммы длительностей, зависания интерфейса, журнал медленных операций.
+    
+    Выключенный слой стоит одной проверки флага на вызов. Зависанием
+    считается операция в главном потоке (потоке интерфейса) дольше
+    stall_threshold секунд; операции дольше slow_threshold попадают в журнал.
+    """
+    
+    def __init__(self, enabled=False, stall_threshold=0.1, slow_threshold=0.25, slow_log_size=500,
+                 slow_log_file=None):
+        self.enabled = enabled
+        self.stall_threshold = stall_threshold
+        self.slow_threshold = slow_threshold
+        # Файл, в который медленные операции дописываются строками JSON по мере появления
+        self.slow_log_file = slow_log_file
+        self.histograms = {}
+        self.stalls = Counter()
+        self.slow_log = deque(maxlen=slow_log_size)
+        # Замеры приходят и из рабочих потоков (фоновая загрузка, сервер)
+        self._lock = threading.Lock()
+    
+    def record(self, name, seconds):
+        ui_thread = threading.current_thread() is threading.main_thread()
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+            if ui_thread and seconds >= self.stall_threshold:
+                self.stalls[name] += 1
+        if seconds >= self.slow_threshold:
+            self.log_slow(name, seconds)
+    
+    def record_stall(self, name, seconds):
+        """Зависание, замеченное не по операции, а по опозданию цикла событий"""
+        with self._lock:
+            self.stalls[name] += 1
+        if seconds >= self.slow_threshold:
+            self.log_slow(name, seconds)
+    
+    def log_slow(self, name, seconds):
+        entry = {'time': round(time.time(), 3), 'operation': name, 'ms': round(seconds * 1000, 1),
+                 'thread': threading.current_thread().name}
+        self.slow_log.append(entry)
+        if self.slow_log_file:
+            try:
+                with open(self.slow_log_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            except OSError:
+                pass
+    
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+    
+    def timed(self, name=None):
+        """Декоратор замера функции; имя по умолчанию - Класс.метод"""
+        def decorate(func):
+            label = name or func.__qualname__
+            
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(label, time.perf_counter() - start)
+            return wrapper
+        return decorate
+    
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.stalls.clear()
+            self.slow_log.clear()
+    
+    def snapshot(self):
+        """Все замеры словарем для JSON; длительности в миллисекундах"""
+        with self._lock:
+            operations = {
+                name: {'count': h.count, 'total_ms': round(h.total * 1000, 3),
+                       'mean_ms': round(h.total / h.count * 1000, 3),
+                       'p50_ms': round(h.quantile(0.5) * 1000, 3),
+                       'p95_ms': round(h.quantile(0.95) * 1000, 3),
+                       'p99_ms': round(h.quantile(0.99) * 1000, 3),
+                       'max_ms': round(h.max * 1000, 3)}
+                for name, h in sorted(self.histograms.items())}
+            return {'stall_threshold_ms': self.stall_threshold * 1000,
+                    'slow_threshold_ms': self.slow_threshold * 1000,
+                    'operations': operations, 'ui_stalls': dict(self.stalls),
+                    'slow_log': list(self.slow_log)}
+    
+    def to_prometheus(self):
+        """Замеры в текстовом формате Prometheus"""
+        def label(name):
+            return name.replace('\\', '\\\\').replace('"', '\\"')
+        
+        lines = ['# HELP emias_operation_seconds Длительность операций',
+                 '# TYPE emias_operation_seconds histogram']
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(Histogram.BOUNDS + ('+Inf',), h.buckets):
+                    cumulative += count
+                    lines.append(f'emias_operation_seconds_bucket{{operation="{label(name)}",'
+                                 f'le="{bound}"}} {cumulative}')
+                lines.append(f'emias_operation_seconds_sum{{operation="{label(name)}"}} {h.total}')
+                lines.append(f'emias_operation_seconds_count{{operation="{label(name)}"}} {h.count}')
+            lines += ['# HELP emias_ui_stalls_total Зависания потока интерфейса дольше порога',
+                      '# TYPE emias_ui_stalls_total counter']
+            lines += [f'emias_ui_stalls_total{{operation="{label(name)}"}} {count}'
+                      for name, count in sorted(self.stalls.items())]
+        return '\n'.join(lines) + '\n'
+    
+    def dump(self, filename):
+        """Запись замеров: .prom/.txt - формат Prometheus, иначе JSON"""
+        if filename.endswith(('.prom', '.txt')):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+# Замеры включаются переменной EMIAS_METRICS=1 или флагом --metrics интерфейса и сервера
+METRICS = Metrics(enabled=os.environ.get('EMIAS_METRICS', '') not in ('', '0'))
+
+def lazy_import(name):
+    """Импорт тяжелого модуля при первом обращении с замером времени"""
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        STARTUP.record_import(name, time.perf_counter() - start)
+    return module
+
+# Тяжелые библиотеки (NumPy, Faker) импортируются при первом использовании,
+# при запуске только проверяем, что они установлены
+FAKER_AVAILABLE = importlib.util.find_spec('faker') is not None
+np = None
+
+def load_numpy():
+    """NumPy для расчетов по столбцам или None, если он не установлен"""
+    global np
+    if np is None:
+        try:
+            np = lazy_import('numpy')
+        except ImportError:
+            np = False
+    return np or None
+
+def load_faker():
+    return lazy_import('faker').Faker('ru_RU')
+
+def iter_json_array(chunks):
+    """Потоковый разбор JSON-массива объектов из последовательности текстовых кусков"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+    for chunk in chunks:
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Ожидался JSON-массив')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Объект обрезан границей куска - дочитываем следующий
+                break
+            yield item
+    if buffer[pos:].strip():
+        raise ValueError('Некорректный JSON: неожиданный конец файла')
+
+def iter_json_file(filename, chunk_size=1 << 16):
+    """Потоковое чтение JSON-массива объектов из файла"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        yield from iter_json_array(iter(lambda: f.read(chunk_size), ''))
+
+def file_crc32(filename, chunk_size=1 << 20):
+    crc = 0
+    with open(filename, 'rb') as f:
+        for raw in iter(lambda: f.read(chunk_size), b''):
+            crc = zlib.crc32(raw, crc)
+    return crc
+
+class ConflictError(Exception):
+    """Запись изменена или удалена на другом рабочем месте после того, как ее прочитали"""
+
+class StorageError(Exception):
+    """Изменение не удалось записать на диск; в памяти оно отменено"""
+
+class StoreLock:
+    """Межпроцессная блокировка хранилища через файл <хранилище>.lock.
+    
+    Повторно входимая внутри процесса: вложенные операции (сохранение внутри
+    изменения) не блокируют сами себя.
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+        self._depth = 0
+    
+    def acquire(self, blocking=True):
+        if self._depth == 0:
+            try:
+                f = open(self.filename, 'a+b')
+            except OSError:
+                # Хранилище только для чтения: писать все равно некому
+                self._depth += 1
+                return True
+            try:
+                if not _lock_file(f, blocking):
+                    f.close()
+                    return False
+            except BaseException:
+                f.close()
+                raise
+            self._file = f
+        self._depth += 1
+        return True
+    
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            _unlock_file(self._file)
+            self._file.close()
+            self._file = None
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc):
+        self.release()
+
+def _lock_file(f, blocking):
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.05)
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def atomic_write(filename, data):
+    """Запись файла целиком: во временный файл, на диск и атомарная подмена.
+    
+    При сбое на диске остается либо старая, либо новая версия, но не обрезанная.
+    """
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+def file_stamp(*filenames):
+    """Дешевый отпечаток файлов (inode, время изменения, размер) для обнаружения изменений"""
+    stamps = []
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+            stamps.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+class Patient:
+    __slots__ = ('full_name', 'age', 'gender', 'height', 'weight', 'key', 'version')
+    
+    def __init__(self, full_name, age, gender, height, weight, key=None, version=None):
+        self.full_name = full_name
+        self.age = age
+        self.gender = gender
+        self.height = height
+        self.weight = weight
+        # Постоянный идентификатор пациента (поле id в patients.json), None - еще не сохранен
+        self.key = key
+        # Номер версии записи для оптимистической блокировки
+        self.version = version
+    
+    @property
+    def bmi(self):
+        return calc_bmi(self.height, self.weight)
+
+def calc_bmi(height, weight):
+    return round(weight / ((height / 100) ** 2), 2)
+
+def _number(value):
+    # Целые значения роста и веса храним как float, но отдаем как int
+    return int(value) if value.is_integer() else value
+
+def typecode(column):
+    """Код типа элементов столбца: array или memoryview над бинарным снимком"""
+    return column.format if isinstance(column, memoryview) else column.typecode
+
+class PatientView:
+    """Пациент из колоночного хранилища: легкий объект с тем же API, что и Patient"""
+    __slots__ = ('_store', '_row')
+    
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+    
+    @property
+    def key(self):
+        return self._store.keys[self._row]
+    
+    @property
+    def version(self):
+        return self._store.versions[self._row]
+    
+    @property
+    def full_name(self):
+        return self._store.names[self._row]
+    
+    @property
+    def age(self):
+        return self._store.ages[self._row]
+    
+    @property
+    def gender(self):
+        return self._store.gender_values[self._store.genders[self._row]]
+    
+    @property
+    def height(self):
+        return _number(self._store.heights[self._row])
+    
+    @property
+    def weight(self):
+        return _number(self._store.weights[self._row])
+    
+    @property
+    def bmi(self):
+        return self._store.bmi_column()[self._row]
+
+class PatientStore:
+    """Колоночное хранилище пациентов: числа в массивах array, пол кодами, ФИО в пуле строк.
+    
+    Ведет себя как список пациентов, но индексация возвращает PatientView.
+    Удаленные строки остаются на месте как надгробия до вызова purge, поэтому
+    удаление не сдвигает столбцы, а строки адресуются постоянными ID (keys).
+    """
+    
+    def __init__(self, patients=()):
+        self.names = []
+        self.ages = array('h')
+        self.genders = array('B')
+        self.heights = array('d')
+        self.weights = array('d')
+        # Справочник кодов пола: 0 - 'М', 1 - 'Ж', прочие значения добавляются по мере появления
+        self.gender_values = ['М', 'Ж']
+        self._gender_codes = {'М': 0, 'Ж': 1}
+        self._names_pool = {}
+        # ID пациентов: растут в порядке строк и не меняются ни при удалении, ни при сжатии
+        self.keys = array('q')
+        self._next_key = 0
+        # Версии записей: растут при каждом изменении пациента
+        self.versions = array('q')
+        # Отсортированные номера строк удаленных пациентов (надгробия)
+        self.deleted = []
+        self._bmi = None
+        # Отображенный в память бинарный снимок, из которого читаются столбцы (см. thaw)
+        self._mapped = None
+        self.extend(patients)
+    
+    def gender_code(self, gender):
+        code = self._gender_codes.get(gender)
+        if code is None:
+            code = len(self.gender_values)
+            self.gender_values.append(gender)
+            self._gender_codes[gender] = code
+        return code
+    
+    def _intern_name(self, full_name):
+        return self._names_pool.setdefault(full_name, full_name)
+    
+    def _cells(self, age, gender, height, weight):
+        """Значения, приведенные к типам столбцов.
+        
+        OverflowError или TypeError возникают здесь, до изменения первого
+        столбца, поэтому столбцы не расходятся по длине.
+        """
+        age = array(typecode(self.ages), [age])[0]
+        code = array(typecode(self.genders), [self.gender_code(gender)])[0]
+        height, weight = array('d', [height, weight])
+        bmi = calc_bmi(height, weight) if self._bmi is not None else None
+        return age, code, height, weight, bmi
+    
+    def append_values(self, full_name, age, gender, height, weight, key=None, version=1):
+        """Добавление строки; возвращает ID пациента.
+        
+        ID из файла сохраняется, если он больше предыдущего, иначе (нет ID
+        или повтор) выдается следующий свободный.
+        """
+        if self._mapped is not None:
+            self.thaw()
+        age, code, height, weight, bmi = self._cells(age, gender, height, weight)
+        if key is None or key < self._next_key:
+            key = self._next_key
+        self.keys.append(key)
+        self._next_key = key + 1
+        self.versions.append(version)
+        self.names.append(self._intern_name(full_name))
+        self.ages.append(age)
+        self.genders.append(code)
+        self.heights.append(height)
+        self.weights.append(weight)
+        if bmi is not None:
+            self._bmi.append(bmi)
+        return key
+    
+    def append(self, patient):
+        return self.append_values(patient.full_name, patient.age, patient.gender,
+                                  patient.height, patient.weight)
+    
+    def extend(self, patients):
+        for patient in patients:
+            self.append(patient)
+    
+    def extend_records(self, records):
+        """Добавление пациентов из словарей формата patients.json"""
+        for item in records:
+            self.append_values(item['full_name'], item['age'], item['gender'],
+                               item['height'], item['weight'], item.get('id'), item.get('version', 1))
+    
+    def __len__(self):
+        return len(self.ages) - len(self.deleted)
+    
+    def row_at(self, position):
+        """Номер строки по позиции среди неудаленных пациентов"""
+        row = position
+        while self.deleted:
+            shifted = position + bisect_right(self.deleted, row)
+            if shifted == row:
+                break
+            row = shifted
+        return row
+    
+    def position_of(self, row):
+        """Позиция строки среди неудаленных пациентов"""
+        return row - bisect_left(self.deleted, row)
+    
+    def is_deleted(self, row):
+        i = bisect_left(self.deleted, row)
+        return i < len(self.deleted) and self.deleted[i] == row
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [PatientView(self, self.row_at(position)) for position in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('patient index out of range')
+        return PatientView(self, self.row_at(index))
+    
+    def __setitem__(self, index, patient):
+        self.set_row(self.row_at(index), patient)
+    
+    def __delitem__(self, index):
+        self.delete_row(self.row_at(index))
+    
+    def set_row(self, row, patient):
+        if self._mapped is not None:
+            self.thaw()
+        age, code, height, weight, bmi = self._cells(patient.age, patient.gender,
+                                                     patient.height, patient.weight)
+        self.versions[row] += 1
+        self.names[row] = self._intern_name(patient.full_name)
+        self.ages[row] = age
+        self.genders[row] = code
+        self.heights[row] = height
+        self.weights[row] = weight
+        if bmi is not None:
+            self._bmi[row] = bmi
+    
+    def delete_row(self, row):
+        """Пометка строки удаленной: O(числа надгробий) вместо сдвига всех столбцов"""
+        insort(self.deleted, row)
+    
+    def purge(self):
+        """Физическое удаление надгробий; выполняется при сжатии журнала"""
+        if not self.deleted:
+            return
+        self.thaw()
+        bounds = [-1] + self.deleted + [len(self.ages)]
+        
+        def squeeze(column):
+            result = column[:0]
+            for start, stop in zip(bounds, bounds[1:]):
+                result += column[start + 1:stop]
+            return result
+        
+        for name in ('keys', 'versions', 'names', 'ages', 'genders', 'heights', 'weights'):
+            setattr(self, name, squeeze(getattr(self, name)))
+        if self._bmi is not None:
+            self._bmi = squeeze(self._bmi)
+        self.deleted = []
+    
+    def thaw(self):
+        """Копирование столбцов бинарного снимка в обычные массивы перед первым изменением.
+        
+        До этого столбцы - memoryview прямо над файлом. Копия - один memcpy на
+        столбец; ФИО и после нее декодируются при обращении.
+        """
+        if self._mapped is None:
+            return
+        for name in ('keys', 'versions', 'ages', 'genders', 'heights', 'weights'):
+            view = getattr(self, name)
+            if isinstance(view, memoryview):
+                column = array(view.format)
+                column.frombytes(view.cast('B'))
+                setattr(self, name, column)
+                view.release()
+        self.names.detach()
+        mapped, self._mapped = self._mapped, None
+        try:
+            mapped.close()
+        except BufferError:
+            # На файл еще ссылаются временные срезы - закроется сборщиком мусора
+            pass
+    
+    def live_rows(self):
+        """Номера строк неудаленных пациентов по порядку"""
+        if not self.deleted:
+            return range(len(self.ages))
+        deleted = set(self.deleted)
+        return (row for row in range(len(self.ages)) if row not in deleted)
+    
+    def __iter__(self):
+        for row in self.live_rows():
+            yield PatientView(self, row)
+    
+    def key_of(self, row):
+        return self.keys[row]
+    
+    def row_of(self, key):
+        """Строка по ID: ID отсортированы, поэтому хватает бинарного поиска"""
+        row = bisect_left(self.keys, key)
+        if row == len(self.keys) or self.keys[row] != key or self.is_deleted(row):
+            raise KeyError(key)
+        return row
+    
+    def get(self, key):
+        return PatientView(self, self.row_of(key))
+    
+    def bmi_column(self):
+        """ИМТ всех строк, рассчитанный одним векторным проходом и поддерживаемый при изменениях"""
+        if self._bmi is None:
+            np = load_numpy()
+            if np is not None:
+                heights = np.frombuffer(self.heights, dtype=np.float64) / 100
+                weights = np.frombuffer(self.weights, dtype=np.float64)
+                self._bmi = array('d', np.round(weights / (heights * heights), 2).tobytes())
+            else:
+                self._bmi = array('d', map(calc_bmi, self.heights, self.weights))
+        return self._bmi
+    
+    def column(self, name, gender=None):
+        """Столбец (age, height, weight, bmi) неудаленных пациентов, целиком или для одного пола"""
+        values = self.bmi_column() if name == 'bmi' else getattr(self, name + 's')
+        if gender is None and not self.deleted:
+            return values
+        code = self._gender_codes.get(gender)
+        np = load_numpy()
+        if np is not None:
+            mask = np.ones(len(values), dtype=bool)
+            mask[self.deleted] = False
+            if gender is not None:
+                mask &= np.frombuffer(self.genders, dtype=np.uint8) == code
+            return np.frombuffer(values, dtype=typecode(values))[mask]
+        return array(typecode(values), (values[row] for row in self.live_rows()
+                                        if gender is None or self.genders[row] == code))
+    
+    def sort_index(self, field):
+        """Индекс сортировки неудаленных пациентов по полю из SORT_FIELDS"""
+        if field == 'full_name':
+            values = [self.names[row] for row in self.live_rows()]
+        elif field == 'gender':
+            values = [self.gender_values[code] for code in self.column('gender')]
+        else:
+            values = self.column(field)
+        return SortIndex.build(self.column('key'), values)
+    
+    def gender_count(self, gender):
+        code = self._gender_codes.get(gender)
+        if code is None:
+            return 0
+        genders = self.genders
+        total = genders.count(code) if isinstance(genders, array) else genders.tobytes().count(code)
+        return total - sum(1 for row in self.deleted if self.genders[row] == code)
+
+# Бинарный снимок: заголовок, столбцы фиксированной ширины и таблица строк ФИО
+
+BINARY_MAGIC = b'EMIASBIN'
+# Расширение, по которому PatientManager и append_to_store выбирают бинарный формат
+BINARY_SUFFIX = '.bin'
+BINARY_VERSION = 1
+# Заголовок: метка, версия формата, порядок байт столбцов, CRC данных, число строк,
+# следующий ID, число различных ФИО, размер их таблицы и справочника полов
+_BINARY_HEADER = struct.Struct('<8sHHIQQQQQ')
+_BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+
+class StringTable:
+    """ФИО из бинарного снимка: номер строки таблицы на пациента, строки декодируются при обращении.
+    
+    Ведет себя как список ФИО: новые пациенты дописываются в extra, правки
+    хранятся в changed, поэтому изменения не требуют декодировать всю таблицу.
+    """
+    
+    def __init__(self, ids, offsets, blob):
+        self.ids = ids
+        self.offsets = offsets
+        self.blob = blob
+        self.extra = []
+        self.changed = {}
+    
+    def __len__(self):
+        return len(self.ids) + len(self.extra)
+    
+    def _string(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+    
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row >= len(self.ids):
+            return self.extra[row - len(self.ids)]
+        name = self.changed.get(row)
+        return self._string(self.ids[row]) if name is None else name
+    
+    def __setitem__(self, row, name):
+        if row >= len(self.ids):
+            self.extra[row - len(self.ids)] = name
+        else:
+            self.changed[row] = name
+    
+    def append(self, name):
+        self.extra.append(name)
+    
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+    
+    def detach(self):
+        """Копирование таблицы из отображенного файла, чтобы его можно было закрыть"""
+        for name, code in (('ids', 'I'), ('offsets', 'q')):
+            view = getattr(self, name)
+            column = array(code)
+            column.frombytes(view.cast('B'))
+            setattr(self, name, column)
+            view.release()
+        blob, self.blob = self.blob, bytes(self.blob)
+        blob.release()
+
+def _pad(data):
+    return data + bytes(-len(data) % 8)
+
+def encode_binary_snapshot(store):
+    """Бинарный снимок хранилища без надгробий; возвращает (данные, CRC)"""
+    if store.deleted:
+        raise ValueError("Перед записью снимка надгробия нужно удалить (purge)")
+    pool = {}
+    ids = array('I', (pool.setdefault(name, len(pool)) for name in store.names))
+    encoded = [name.encode('utf-8') for name in pool]
+    offsets = array('q', itertools.accumulate(map(len, encoded), initial=0))
+    names = b''.join(encoded)
+    genders = '\n'.join(store.gender_values).encode('utf-8')
+    body = b''.join(_pad(column.tobytes()) for column in (
+        store.keys, store.versions, store.heights, store.weights, ids, store.ages, store.genders,
+        offsets)) + _pad(names) + genders
+    crc = zlib.crc32(body)
+    header = _BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, _BYTE_ORDER, crc, len(ids),
+                                 store._next_key, len(pool), len(names), len(genders))
+    return header + body, crc
+
+def is_binary_snapshot(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    except OSError:
+        return False
+
+def load_binary_snapshot(filename):
+    """Хранилище из бинарного снимка и CRC его данных.
+    
+    Файл отображается в память, столбцы - memoryview над ним без копирования,
+    ФИО декодируются при обращении. Время открытия не зависит от числа пациентов.
+    """
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapped)
+    try:
+        (magic, version, byte_order, crc, rows, next_key, name_count, names_size,
+         genders_size) = _BINARY_HEADER.unpack_from(buffer)
+    except struct.error:
+        raise ValueError("Бинарный снимок поврежден") from None
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f"Неподдерживаемый бинарный снимок: {filename}")
+    offset = _BINARY_HEADER.size
+    
+    def section(code, count):
+        nonlocal offset
+        size = array(code).itemsize * count
+        if offset + size > len(buffer):
+            raise ValueError("Бинарный снимок поврежден")
+        view = buffer[offset:offset + size]
+        offset += size + (-size % 8)
+        if byte_order != _BYTE_ORDER:
+            # Снимок с машины с другим порядком байт: тут без копии не обойтись
+            column = array(code)
+            column.frombytes(view.cast('B'))
+            column.byteswap()
+            return column
+        return view.cast(code)
+    
+    store = PatientStore()
+    store.keys = section('q', rows)
+    store.versions = section('q', rows)
+    store.heights = section('d', rows)
+    store.weights = section('d', rows)
+    ids = section('I', rows)
+    store.ages = section('h', rows)
+    store.genders = section('B', rows)
+    offsets = section('q', name_count + 1)
+    names = buffer[offset:offset + names_size]
+    offset += names_size + (-names_size % 8)
+    store.names = StringTable(ids, offsets, names)
+    store.gender_values = bytes(buffer[offset:offset + genders_size]).decode('utf-8').split('\n')
+    store._gender_codes = {gender: code for code, gender in enumerate(store.gender_values)}
+    store._next_key = next_key
+    store._mapped = mapped
+    buffer.release()
+    return store, crc
+
+def write_binary_store(filename, records):
+    """Запись пациентов (словарей формата patients.json) бинарным снимком; возвращает их число"""
+    store = PatientStore()
+    store.extend_records(records)
+    atomic_write(filename, encode_binary_snapshot(store)[0])
+    return len(store)
+
+def snapshot_crc(filename):
+    """CRC снимка, на который ссылается заголовок журнала"""
+    if is_binary_snapshot(filename):
+        with open(filename, 'rb') as f:
+            return _BINARY_HEADER.unpack(f.read(_BINARY_HEADER.size))[3]
+    return file_crc32(filename)
+
+def iter_snapshot(filename):
+    """Записи снимка (JSON или бинарного) словарями, по одной"""
+    if not os.path.exists(filename):
+        return iter(())
+    if is_binary_snapshot(filename):
+        store, _ = load_binary_snapshot(filename)
+        return ({'id': p.key, 'version': p.version, **PatientManager.patient_to_dict(p)}
+                for p in store)
+    return iter_json_file(filename)
+
+def fake_patient(fake):
+    """Создание случайного пациента с помощью Faker"""
+    gender = fake.random_element(elements=('М', 'Ж'))
+    if gender == 'М':
+        first_name = fake.first_name_male()
+        last_name = fake.last_name_male()
+    else:
+        first_name = fake.first_name_female()
+        last_name = fake.last_name_female()
+        
+    full_name = f"{last_name} {first_name} {fake.middle_name()}"
+    age = fake.random_int(min=18, max=80)
+    height = fake.random_int(min=150, max=190)
+    weight = fake.random_int(min=50, max=100)
+    
+    return Patient(full_name, age, gender, height, weight)
+
+# Размер пачки генератора: от него не зависит результат, только распределение по процессам
+GENERATE_CHUNK_SIZE = 10000
+
+def generate_chunk(task):
+    """Генерация одной пачки пациентов в рабочем процессе.
+    
+    Каждая пачка получает собственное зерно, поэтому результат воспроизводим
+    при любом числе процессов. Возвращает готовые строки JSON, чтобы не
+    передавать между процессами объекты пациентов.
+    """
+    seed, chunk_index, count, jsonl = task
+    fake = load_faker()
+    fake.seed_instance(seed * 1000003 + chunk_index)
+    separator = '\n' if jsonl else ',\n'
+    return separator.join(
+        json.dumps(PatientManager.patient_to_dict(fake_patient(fake)), ensure_ascii=False)
+        for _ in range(count))
+
+def generate_dataset(filename, count, seed=0, workers=None, jsonl=False, progress=None):
+    """Потоковая генерация набора пациентов в файл пулом процессов.
+    
+    Пачки пишутся на диск по мере готовности в исходном порядке, в памяти
+    одновременно держится лишь несколько пачек. Без jsonl получается обычный
+    patients.json.
+    """
+    import multiprocessing
+    
+    tasks = [(seed, index, min(GENERATE_CHUNK_SIZE, count - start), jsonl)
+             for index, start in enumerate(range(0, count, GENERATE_CHUNK_SIZE))]
+    written = 0
+    with open(filename, 'w', encoding='utf-8') as f, \
+            multiprocessing.Pool(workers) as pool:
+        if not jsonl:
+            f.write('[\n')
+        for index, text in enumerate(pool.imap(generate_chunk, tasks)):
+            if index:
+                f.write('\n' if jsonl else ',\n')
+            f.write(text)
+            written += tasks[index][2]
+            if progress is not None:
+                progress(written, count)
+        f.write('\n' if jsonl else '\n]\n')
+    return written
+
+def normalize_name(text):
+    return text.lower().replace('ё', 'е')
+
+def trigrams(token):
+    padded = f"^{token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class NameIndex:
+    """Поисковый индекс по ФИО: префиксное дерево токенов и триграммы для поиска с опечатками.
+    
+    Хранит ключи пациентов, а не сами записи; name_of(key) возвращает текущее ФИО по ключу.
+    """
+    
+    def __init__(self, name_of, min_similarity=0.5):
+        self.name_of = name_of
+        self.min_similarity = min_similarity
+        self._trie = {}
+        self._postings = {}
+        self._trigrams = {}
+    
+    @staticmethod
+    def tokenize(full_name):
+        return normalize_name(full_name).split()
+    
+    def add(self, key, full_name):
+        for token in set(self.tokenize(full_name)):
+            keys = self._postings.get(token)
+            if keys is None:
+                keys = self._postings[token] = set()
+                self._add_token(token)
+            keys.add(key)
+    
+    def remove(self, key, full_name):
+        for token in set(self.tokenize(full_name)):
+            keys = self._postings.get(token)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._postings[token]
+                self._remove_token(token)
+    
+    def _add_token(self, token):
+        node = self._trie
+        for char in token:
+            node = node.setdefault(char, {})
+        node[''] = token
+        for trigram in trigrams(token):
+            self._trigrams.setdefault(trigram, set()).add(token)
+    
+    def _remove_token(self, token):
+        node = self._trie
+        for char in token:
+            node = node.get(char)
+            if node is None:
+                return
+        node.pop('', None)
+        for trigram in trigrams(token):
+            tokens = self._trigrams.get(trigram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._trigrams[trigram]
+    
+    def prefix_tokens(self, prefix):
+        node = self._trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char == '':
+                    found.append(child)
+                else:
+                    stack.append(child)
+        return found
+    
+    def similar_tokens(self, token):
+        """Токены, похожие на запрос по доле общих триграмм (опечатки)"""
+        query = trigrams(token)
+        shared = Counter()
+        for trigram in query:
+            shared.update(self._trigrams.get(trigram, ()))
+        found = []
+        for candidate, count in shared.items():
+            similarity = 2 * count / (len(query) + len(candidate))
+            if similarity >= self.min_similarity:
+                found.append(candidate)
+        return found
+    
+    def candidates(self, query_token):
+        tokens = set(self.prefix_tokens(query_token))
+        if not tokens and len(query_token) >= 3:
+            # Ничего не начинается с этого слова - вероятно, опечатка
+            tokens.update(self.similar_tokens(query_token))
+        return tokens
+    
+    def search(self, query, limit=100, materialize_limit=50000):
+        """Ключи пациентов, у которых каждому слову запроса соответствует токен ФИО.
+        
+        Результаты упорядочены по числу слов запроса, совпавших с токеном не
+        целиком (префиксом или с опечаткой), затем по ключу. Точные совпадения
+        всех слов всегда попадают в limit первыми.
+        """
+        query_tokens = self.tokenize(query)
+        if not query_tokens:
+            return []
+        candidates = [self.candidates(token) for token in query_tokens]
+        sizes = [sum(len(self._postings[t]) for t in tokens) for tokens in candidates]
+        order = sorted(range(len(query_tokens)), key=sizes.__getitem__)
+        rarest = order[0]
+        exact = [self._postings.get(token, ()) for token in query_tokens]
+        
+        def rank(key):
+            # Число слов запроса, совпавших не целиком
+            return sum(key not in keys for keys in exact), key
+        
+        # Сначала пациенты, у которых все слова совпали целиком, - это пересечение
+        # точных списков; если их хватает на limit, остальные кандидаты не нужны
+        matched = set.intersection(*sorted(exact, key=len)) if all(exact) else set()
+        if len(matched) >= limit:
+            return heapq.nsmallest(limit, matched)
+        
+        if len(order) > 1 and sizes[rarest] <= materialize_limit:
+            # Редкое слово: пересекаем множества ключей целиком
+            keys = set().union(*(self._postings[t] for t in candidates[rarest]))
+            for i in order[1:]:
+                if not keys:
+                    break
+                if sizes[i] <= len(keys) * 8:
+                    keys = set().union(*(keys & self._postings[t] for t in candidates[i]))
+                else:
+                    keys = {key for key in keys
+                            if set(self.tokenize(self.name_of(key))) & candidates[i]}
+            keys -= matched
+            return sorted(matched) + heapq.nsmallest(limit - len(matched), keys, key=rank)
+        
+        # Частое слово: перебор записей до limit после точных совпадений
+        matched = sorted(matched)
+        others = [candidates[i] for i in order[1:]]
+        found = []
+        seen = set(matched)
+        prefix = query_tokens[rarest]
+        for token in sorted(candidates[rarest], key=lambda t: (not t.startswith(prefix), t)):
+            for key in self._postings[token]:
+                if key in seen:
+                    continue
+                seen.add(key)
+                if others:
+                    tokens = set(self.tokenize(self.name_of(key)))
+                    if not all(tokens & other for other in others):
+                        continue
+                found.append(key)
+                if len(matched) + len(found) >= limit:
+                    return matched + sorted(found, key=rank)
+        return matched + sorted(found, key=rank)
+
+# Поля, по которым можно сортировать таблицу
+SORT_FIELDS = ('full_name', 'age', 'gender', 'height', 'weight', 'bmi')
+
+class SortIndex:
+    """Порядок пациентов по одному полю: пары (значение, ID) по возрастанию.
+    
+    Хранится двумя параллельными массивами и поддерживается вставкой и
+    удалением через bisect, поэтому смена столбца или направления сортировки
+    не требует пересортировки. При равных значениях порядок - по ID.
+    """
+    
+    def __init__(self, values, keys):
+        self.values = values
+        self.keys = keys
+    
+    @classmethod
+    def build(cls, keys, values):
+        """Индекс по столбцам ID и значений; ID должны идти по возрастанию"""
+        np = load_numpy()
+        if np is not None and not isinstance(values, list):
+            # Устойчивая сортировка сохраняет порядок ID внутри равных значений
+            values = np.asarray(values)
+            order = np.argsort(values, kind='stable')
+            return cls(array(values.dtype.char, values[order].tobytes()),
+                       array('q', np.asarray(keys, dtype=np.int64)[order].tobytes()))
+        order = sorted(range(len(values)), key=values.__getitem__)
+        sorted_values = [values[i] for i in order]
+        if not isinstance(values, list):
+            sorted_values = array(typecode(values), sorted_values)
+        return cls(sorted_values, array('q', (keys[i] for i in order)))
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    def _find(self, key, value):
+        lo = bisect_left(self.values, value)
+        hi = bisect_right(self.values, value, lo)
+        return bisect_left(self.keys, key, lo, hi), hi
+    
+    def add(self, key, value):
+        i, _ = self._find(key, value)
+        self.values.insert(i, value)
+        self.keys.insert(i, key)
+    
+    def remove(self, key, value):
+        i, hi = self._find(key, value)
+        if i == hi or self.keys[i] != key:
+            # Значение не совпало до последнего знака - ищем по ID
+            i = self.keys.index(key)
+        del self.values[i]
+        del self.keys[i]
+
+class SortedView:
+    """ID пациентов в порядке индекса сортировки, по возрастанию или убыванию, без копирования"""
+    
+    def __init__(self, index, descending=False):
+        self.index = index
+        self.descending = descending
+    
+    def __len__(self):
+        return len(self.index.keys)
+    
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self.index.keys[-1 - i if self.descending else i]
+    
+    def __iter__(self):
+        return reversed(self.index.keys) if self.descending else iter(self.index.keys)
+
+class BmiSketch:
+    """Сжатая гистограмма ИМТ с шагом 0.01.
+    
+    ИМТ и так округляется до сотых, поэтому квантили по ней точные, а размер
+    зависит от числа различных значений, а не от числа пациентов. В отличие от
+    обычных потоковых скетчей поддерживает удаление значений.
+    """
+    
+    def __init__(self):
+        self.bins = Counter()
+        self.count = 0
+        self.total = 0.0
+    
+    def add(self, bmi, count=1):
+        self.bins[round(bmi * 100)] += count
+        self.count += count
+        self.total += bmi * count
+    
+    def remove(self, bmi):
+        key = round(bmi * 100)
+        self.bins[key] -= 1
+        if self.bins[key] <= 0:
+            del self.bins[key]
+        self.count -= 1
+        self.total -= bmi
+    
+    def sorted_bins(self):
+        return sorted(self.bins.items())
+    
+    def quantile(self, q, bins=None):
+        """Квантиль с линейной интерполяцией, как в numpy.percentile"""
+        bins = bins or self.sorted_bins()
+        rank = (self.count - 1) * q
+        lower, fraction = int(rank), rank - int(rank)
+        values = []
+        seen = 0
+        for key, count in bins:
+            seen += count
+            while len(values) < 2 and seen > lower + len(values):
+                values.append(key / 100)
+            if len(values) == 2:
+                break
+        if len(values) == 1:
+            return values[0]
+        return values[0] + (values[1] - values[0]) * fraction
+    
+    def box_stats(self, label, whis=1.5):
+        """Статистика для Axes.bxp, совпадающая с тем, что считает Axes.boxplot"""
+        bins = self.sorted_bins()
+        if not bins:
+            return {'label': label, 'med': float('nan'), 'q1': float('nan'), 'q3': float('nan'),
+                    'whislo': float('nan'), 'whishi': float('nan'), 'fliers': []}
+        q1 = self.quantile(0.25, bins)
+        q3 = self.quantile(0.75, bins)
+        low, high = q1 - whis * (q3 - q1), q3 + whis * (q3 - q1)
+        inside = [key / 100 for key, _ in bins if low <= key / 100 <= high]
+        # Выбросы рисуем по одной точке на значение: O(корзин), а не O(пациентов)
+        fliers = [key / 100 for key, _ in bins if not low <= key / 100 <= high]
+        return {
+            'label': label,
+            'med': self.quantile(0.5, bins),
+            'q1': q1,
+            'q3': q3,
+            # Как boxplot_stats: усы не заходят внутрь ящика, даже если квантиль интерполирован
+            'whislo': min(min(inside, default=q1), q1),
+            'whishi': max(max(inside, default=q3), q3),
+            'fliers': fliers,
+            'mean': self.total / self.count
+        }
+
+class PatientAggregates:
+    """Сводные показатели для статистики, обновляемые при каждом изменении"""
+    
+    def __init__(self):
+        self.gender_counts = Counter()
+        # Гистограмма возраста с корзинами в один год
+        self.age_counts = Counter()
+        self.bmi_by_gender = {}
+    
+    @classmethod
+    def from_patients(cls, patients):
+        aggregates = cls()
+        if isinstance(patients, (PatientStore, Cohort)):
+            # Колоночное хранилище или когорта: считаем по столбцам, без объектов пациентов
+            aggregates.age_counts.update(patients.column('age').tolist())
+            for gender in patients.gender_values:
+                count = patients.gender_count(gender)
+                if not count:
+                    continue
+                aggregates.gender_counts[gender] = count
+                sketch = aggregates.bmi_by_gender[gender] = BmiSketch()
+                values = patients.column('bmi', gender)
+                np = load_numpy()
+                if np is not None:
+                    keys, counts = np.unique(values, return_counts=True)
+                    for bmi, bmi_count in zip(keys.tolist(), counts.tolist()):
+                        sketch.add(bmi, bmi_count)
+                else:
+                    for bmi, bmi_count in Counter(values).items():
+                        sketch.add(bmi, bmi_count)
+        else:
+            for patient in patients:
+                aggregates.add(patient.age, patient.gender, patient.bmi)
+        return aggregates
+    
+    def add(self, age, gender, bmi):
+        self.gender_counts[gender] += 1
+        self.age_counts[age] += 1
+        self.bmi_by_gender.setdefault(gender, BmiSketch()).add(bmi)
+    
+    def remove(self, age, gender, bmi):
+        self.gender_counts[gender] -= 1
+        self.age_counts[age] -= 1
+        if self.age_counts[age] <= 0:
+            del self.age_counts[age]
+        self.bmi_by_gender[gender].remove(bmi)
+    
+    def age_histogram(self):
+        """Возрасты и число пациентов каждого возраста"""
+        items = sorted(self.age_counts.items())
+        return [age for age, _ in items], [count for _, count in items]
+    
+    def bmi_box_stats(self, gender, label):
+        return self.bmi_by_gender.get(gender, BmiSketch()).box_stats(label)
+
+# Когорты: отбор пациентов по выражению с векторным вычислением условий
+
+# Категории ИМТ по ВОЗ: название и нижняя граница (верхняя - граница следующей)
+BMI_CATEGORIES = ('дефицит', 'норма', 'избыток', 'ожирение')
+BMI_CATEGORY_BOUNDS = (18.5, 25.0, 30.0)
+_CATEGORY_ALIASES = {'underweight': 'дефицит', 'normal': 'норма', 'overweight': 'избыток',
+                     'obese': 'ожирение', 'obesity': 'ожирение'}
+
+def bmi_category(bmi):
+    return BMI_CATEGORIES[bisect_right(BMI_CATEGORY_BOUNDS, bmi)]
+
+# Поля выражения (русские и английские названия) и поля группировки
+QUERY_FIELDS = {'age': 'age', 'возраст': 'age', 'gender': 'gender', 'пол': 'gender',
+                'height': 'height', 'рост': 'height', 'weight': 'weight', 'вес': 'weight',
+                'bmi': 'bmi', 'имт': 'bmi', 'category': 'category', 'категория': 'category'}
+GROUP_FIELDS = ('gender', 'category', 'age_group')
+
+_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+              '==': operator.eq, '!=': operator.ne}
+_CONDITION = re.compile(r'([^\W\d]\w*)\s*(<=|>=|==|!=|=|<|>)\s*([\w.|]+)')
+_SEPARATOR = re.compile(r'(?:[\s,;]|\b(?:и|and)\b)*')
+
+class CohortQuery:
+    """Разобранное выражение когорты, например "пол=Ж возраст=40..60 имт>=30".
+    
+    Условия (поле, операция, значение) приводятся к каноническому виду, поэтому
+    одинаковые по смыслу выражения дают равные запросы и один элемент кэша.
+    Диапазон "a..b" включает обе границы, перечисление - через "|".
+    """
+    
+    def __init__(self, conditions=()):
+        self.conditions = tuple(sorted(set(conditions), key=repr))
+    
+    @classmethod
+    def parse(cls, text):
+        """Запрос из выражения; ValueError с понятным сообщением, если оно некорректно"""
+        conditions = []
+        position = _SEPARATOR.match(text).end()
+        while position < len(text):
+            match = _CONDITION.match(text, position)
+            if match is None:
+                raise ValueError(f"Не понимаю условие: {text[position:].split()[0]}")
+            name, op, value = match.groups()
+            field = QUERY_FIELDS.get(name.lower())
+            if field is None:
+                raise ValueError(f"Неизвестное поле {name}: можно {', '.join(sorted(set(QUERY_FIELDS)))}")
+            conditions.extend(cls._conditions(field, '==' if op == '=' else op, value, name))
+            position = _SEPARATOR.match(text, match.end()).end()
+        return cls(conditions)
+    
+    @staticmethod
+    def _conditions(field, op, value, name):
+        if field in ('gender', 'category'):
+            if op not in ('==', '!='):
+                raise ValueError(f"Для поля {name} можно только = и !=")
+            values = [item.strip() for item in value.split('|') if item.strip()]
+            if field == 'gender':
+                values = [item.upper() for item in values]
+            else:
+                values = [_CATEGORY_ALIASES.get(item.lower(), item.lower()) for item in values]
+                unknown = set(values) - set(BMI_CATEGORIES)
+                if unknown:
+                    raise ValueError(f"Неизвестная категория ИМТ {', '.join(sorted(unknown))}: "
+                                     f"можно {', '.join(BMI_CATEGORIES)}")
+            return [(field, 'in' if op == '==' else 'not in', tuple(sorted(set(values))))]
+        low, dots, high = value.partition('..')
+        try:
+            if dots:
+                if op != '==':
+                    raise ValueError
+                return [(field, '>=', float(low)), (field, '<=', float(high))]
+            return [(field, op, float(value))]
+        except ValueError:
+            raise ValueError(f"Некорректное значение {value} для поля {name}") from None
+    
+    def __eq__(self, other):
+        return isinstance(other, CohortQuery) and self.conditions == other.conditions
+    
+    def __hash__(self):
+        return hash(self.conditions)
+    
+    def __str__(self):
+        parts = []
+        for field, op, value in self.conditions:
+            if op in ('in', 'not in'):
+                parts.append(f"{field}{'=' if op == 'in' else '!='}{'|'.join(value)}")
+            else:
+                parts.append(f"{field}{op}{_number(value)}")
+        return ' '.join(parts)
+    
+    def mask(self, store):
+        """Векторная маска подходящих строк хранилища (NumPy), надгробия исключены"""
+        np = load_numpy()
+        mask = np.ones(len(store.keys), dtype=bool)
+        mask[store.deleted] = False
+        bmi = None
+        for field, op, value in self.conditions:
+            if field == 'gender':
+                codes = [store._gender_codes[g] for g in value if g in store._gender_codes]
+                hit = np.isin(np.frombuffer(store.genders, dtype=np.uint8), codes)
+            elif field == 'category':
+                if bmi is None:
+                    bmi = np.frombuffer(store.bmi_column(), dtype=np.float64)
+                codes = [BMI_CATEGORIES.index(category) for category in value]
+                hit = np.isin(np.digitize(bmi, BMI_CATEGORY_BOUNDS), codes)
+            else:
+                column = store.bmi_column() if field == 'bmi' else getattr(store, field + 's')
+                hit = _OPERATORS[op](np.frombuffer(column, dtype=typecode(column)), value)
+            mask &= ~hit if op == 'not in' else hit
+        return mask
+    
+    def matches(self, store, row):
+        """Проверка одной строки - запасной путь без NumPy"""
+        for field, op, value in self.conditions:
+            if field == 'gender':
+                hit = store.gender_values[store.genders[row]] in value
+            elif field == 'category':
+                hit = bmi_category(store.bmi_column()[row]) in value
+            else:
+                column = store.bmi_column() if field == 'bmi' else getattr(store, field + 's')
+                hit = _OPERATORS[op](column[row], value)
+            if hit == (op == 'not in'):
+                return False
+        return True
+    
+    def sql(self):
+        """Условие WHERE и параметры для SQLite"""
+        clauses, params = [], []
+        for field, op, value in self.conditions:
+            if op in ('in', 'not in'):
+                if field == 'category':
+                    column = _SQL_CATEGORY
+                else:
+                    column = field
+                clauses.append(f"{column} {op.upper()} ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{field} {op} ?")
+                params.append(value)
+        return ' AND '.join(clauses) or '1', params
+
+# Категория ИМТ и десятилетие возраста в SQL, с теми же границами, что и выше
+_SQL_CATEGORY = ('CASE ' + ' '.join(f"WHEN bmi < {bound} THEN '{category}'" for bound, category
+                                    in zip(BMI_CATEGORY_BOUNDS, BMI_CATEGORIES))
+                 + f" ELSE '{BMI_CATEGORIES[-1]}' END")
+_SQL_AGE_GROUP = "(age / 10 * 10) || '-' || (age / 10 * 10 + 9)"
+
+class Cohort:
+    """Когорта - пациенты, подходящие под запрос: их ID по возрастанию.
+    
+    Ведет себя как последовательность ID, поэтому годится представлением для
+    таблицы, а столбцы, сводки и группировки считает по столбцам хранилища,
+    не создавая объектов пациентов.
+    """
+    
+    def __init__(self, manager, query, keys):
+        self.manager = manager
+        self._store = manager.patients
+        self.query = query
+        self._keys = keys
+        self._revision = manager.revision
+        self._aggregates = None
+        self._sorted = {}
+    
+    @classmethod
+    def evaluate(cls, manager, query):
+        store = manager.patients
+        np = load_numpy()
+        if np is not None:
+            keys = np.frombuffer(store.keys, dtype=np.int64)[query.mask(store)]
+            return cls(manager, query, array('q', keys.tobytes()))
+        return cls(manager, query, array('q', (store.keys[row] for row in store.live_rows()
+                                               if query.matches(store, row))))
+    
+    def _sync(self):
+        """После изменения данных: удаленные пациенты выбрасываются, сводки пересчитываются"""
+        if self.manager.revision != self._revision:
+            self._revision = self.manager.revision
+            self._store = self.manager.patients
+            self._aggregates = None
+            self._sorted = {}
+            self._keys = self._existing(self._keys)
+    
+    @property
+    def keys(self):
+        self._sync()
+        return self._keys
+    
+    @property
+    def store(self):
+        self._sync()
+        return self._store
+    
+    def _existing(self, keys):
+        """Те из keys, что еще есть в хранилище (ID могли удалить или хранилище - перечитать)"""
+        store = self._store
+        np = load_numpy()
+        if np is None:
+            live = []
+            for key in keys:
+                try:
+                    store.row_of(key)
+                except KeyError:
+                    continue
+                live.append(key)
+            return array('q', live)
+        store_keys = np.frombuffer(store.keys, dtype=np.int64)
+        keys = np.frombuffer(keys, dtype=np.int64)
+        rows = np.searchsorted(store_keys, keys)
+        found = rows < len(store_keys)
+        found[found] = store_keys[rows[found]] == keys[found]
+        if store.deleted:
+            found &= ~np.isin(rows, store.deleted)
+        return array('q', keys[found].tobytes())
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    def __getitem__(self, i):
+        return self.keys[i]
+    
+    def __iter__(self):
+        return iter(self.keys)
+    
+    def __contains__(self, key):
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+    
+    def _rows(self, gender=None):
+        """Строки хранилища пациентов когорты (NumPy), при необходимости одного пола"""
+        np = load_numpy()
+        # keys раньше store: обращение к ним выбрасывает удаленных и берет текущее хранилище
+        keys = np.frombuffer(self.keys, dtype=np.int64)
+        rows = np.searchsorted(np.frombuffer(self.store.keys, dtype=np.int64), keys)
+        if gender is not None:
+            code = self.store._gender_codes.get(gender)
+            rows = rows[np.frombuffer(self.store.genders, dtype=np.uint8)[rows] == code]
+        return rows
+    
+    @property
+    def gender_values(self):
+        return self.store.gender_values
+    
+    def column(self, name, gender=None):
+        """Столбец (key, age, height, weight, bmi) пациентов когорты, целиком или для одного пола"""
+        store = self.store
+        values = store.bmi_column() if name == 'bmi' else getattr(store, name + 's')
+        np = load_numpy()
+        if np is not None:
+            return np.frombuffer(values, dtype=typecode(values))[self._rows(gender)]
+        code = store._gender_codes.get(gender)
+        rows = (store.row_of(key) for key in self.keys)
+        return array(typecode(values), (values[row] for row in rows
+                                        if gender is None or store.genders[row] == code))
+    
+    def gender_count(self, gender):
+        return len(self.column('key', gender))
+    
+    def aggregates(self):
+        """Сводки для окна статистики по пациентам когорты"""
+        if self._aggregates is None:
+            self._aggregates = PatientAggregates.from_patients(self)
+        return self._aggregates
+    
+    def group_by(self, field, values=('age', 'bmi')):
+        """Число пациентов и средние значения полей в группах: {группа: {'count': n, поле: среднее}}"""
+        if field not in GROUP_FIELDS:
+            raise ValueError(f"Группировать можно по {', '.join(GROUP_FIELDS)}")
+        store = self.store
+        np = load_numpy()
+        if np is None:
+            return self._group_by_rows(field, values)
+        rows = self._rows()
+        if field == 'gender':
+            codes = np.frombuffer(store.genders, dtype=np.uint8)[rows].astype(np.intp)
+            labels = store.gender_values
+        elif field == 'category':
+            codes = np.digitize(self.column('bmi'), BMI_CATEGORY_BOUNDS)
+            labels = BMI_CATEGORIES
+        else:
+            codes = self.column('age').astype(np.intp) // 10
+            labels = [f"{decade * 10}-{decade * 10 + 9}" for decade in range(codes.max(initial=0) + 1)]
+        counts = np.bincount(codes, minlength=len(labels))
+        sums = {name: np.bincount(codes, weights=self.column(name), minlength=len(labels))
+                for name in values}
+        return {label: {'count': int(counts[i]),
+                        **{name: round(float(sums[name][i] / counts[i]), 2) for name in values}}
+                for i, label in enumerate(labels) if counts[i]}
+    
+    def _group_by_rows(self, field, values):
+        groups = {}
+        for patient in map(self.store.get, self.keys):
+            if field == 'gender':
+                label = patient.gender
+            elif field == 'category':
+                label = bmi_category(patient.bmi)
+            else:
+                label = f"{patient.age // 10 * 10}-{patient.age // 10 * 10 + 9}"
+            group = groups.setdefault(label, dict.fromkeys(('count',) + tuple(values), 0))
+            group['count'] += 1
+            for name in values:
+                group[name] += getattr(patient, name)
+        for group in groups.values():
+            for name in values:
+                group[name] = round(group[name] / group['count'], 2)
+        # Порядок групп как у векторного варианта
+        order = {'gender': list(self.store.gender_values).index, 'category': BMI_CATEGORIES.index,
+                 'age_group': lambda label: int(label.split('-')[0])}[field]
+        return {label: groups[label] for label in sorted(groups, key=order)}
+    
+    def sorted_view(self, field, descending=False):
+        """ID когорты в порядке индекса сортировки менеджера"""
+        ordered = self._sorted.get(field)
+        if ordered is None:
+            index_keys = self.manager.sorted_view(field).index.keys
+            np = load_numpy()
+            if np is not None:
+                index_keys = np.frombuffer(index_keys, dtype=np.int64)
+                selected = index_keys[np.isin(index_keys, np.frombuffer(self.keys, dtype=np.int64),
+                                              assume_unique=True)]
+                ordered = array('q', selected.tobytes())
+            else:
+                ordered = array('q', (key for key in index_keys if key in self))
+            self._sorted[field] = ordered
+        return SortedView(SortIndex(None, ordered), descending)
+
+class CohortCache:
+    """LRU-кэш когорт менеджера; сбрасывается при любом изменении данных (manager.revision)"""
+    
+    def __init__(self, manager, size=32):
+        self.manager = manager
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._revision = None
+    
+    def get(self, query, build):
+        if self.manager.revision != self._revision:
+            self._items.clear()
+            self._revision = self.manager.revision
+        cohort = self._items.get(query)
+        if cohort is not None:
+            self._items.move_to_end(query)
+            self.hits += 1
+            return cohort
+        self.misses += 1
+        cohort = self._items[query] = build(query)
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+        return cohort
+
+class PatientManager:
+    def __init__(self, filename='patients.json', journal=False, compact_every=1000,
+                 background=False, initial_data=True, binary=None):
+        self.filename = filename
+        # Формат снимка: бинарный для файлов .bin, если не задан явно; при чтении определяется по файлу
+        self.binary = filename.endswith(BINARY_SUFFIX) if binary is None else binary
+        # Журнальный режим: изменения дописываются в лог, снимок пересобирается периодически
+        self.journal = journal
+        self.journal_filename = filename + '.wal'
+        self.compact_every = compact_every
+        self._journal_records = 0
+        self._snapshot_crc = None
+        # Общая для всех рабочих мест блокировка хранилища и номер последней примененной записи
+        self.lock = StoreLock(filename + '.lock')
+        self.version = 0
+        self._journal_offset = 0
+        self._stamp = None
+        self._changes = []
+        # Записи журнала, отложенные до конца batch()
+        self._batch = None
+        self.loading = False
+        self._load_queue = None
+        self._name_index = None
+        self._aggregates = None
+        self._sort_indexes = {}
+        # Номер изменения данных: по нему сбрасывается кэш когорт
+        self.revision = 0
+        self._cohorts = CohortCache(self)
+        
+        if background:
+            # Данные подгружаются потоком, см. start_background_load
+            self.patients = PatientStore()
+            return
+        self.patients = self.load_data()
+        
+        # Если данных нет, генерируем тестовые данные
+        if not self.patients and FAKER_AVAILABLE and initial_data:
+            self.generate_initial_data()
+    
+    def generate_initial_data(self):
+        """Генерация начальных тестовых данных с помощью Faker"""
+        fake = load_faker()
+        
+        for _ in range(10):
+            self.patients.append(fake_patient(fake))
+        
+        try:
+            self.save_data()
+        except StorageError as e:
+            # Тестовые данные не обязательны: работаем с ними только в памяти
+            print(e)
+    
+    @staticmethod
+    def patient_to_dict(patient):
+        return {
+            'full_name': patient.full_name,
+            'age': patient.age,
+            'gender': patient.gender,
+            'height': patient.height,
+            'weight': patient.weight
+        }
+    
+    @METRICS.timed()
+    def load_data(self):
+        with self.lock:
+            self._stamp = file_stamp(self.filename, self.journal_filename)
+            patients = PatientStore()
+            if os.path.exists(self.filename):
+                try:
+                    if is_binary_snapshot(self.filename):
+                        patients, self._snapshot_crc = load_binary_snapshot(self.filename)
+                    else:
+                        with open(self.filename, 'rb') as f:
+                            raw = f.read()
+                        self._snapshot_crc = zlib.crc32(raw)
+                        patients = PatientStore()
+                        patients.extend_records(json.loads(raw.decode('utf-8')))
+                except Exception as e:
+                    print(f"Ошибка загрузки данных: {e}")
+                    return PatientStore()
+            if self.journal:
+                self.replay_journal(patients)
+            return patients
+    
+    def start_background_load(self, batch_size=2000, chunk_size=1 << 16):
+        """Потоковая загрузка patients.json в рабочем потоке.
+        
+        Поток только разбирает файл и складывает пачки записей в очередь,
+        а добавляет их в хранилище poll_background_load в потоке интерфейса.
+        """
+        if is_binary_snapshot(self.filename):
+            # Бинарный снимок открывается за миллисекунды, поток не нужен
+            self.patients = self.load_data()
+            self.invalidate_indexes()
+            return
+        self.loading = True
+        self._stamp = file_stamp(self.filename, self.journal_filename)
+        self._load_queue = queue.Queue()
+        worker = threading.Thread(target=self._load_worker, args=(batch_size, chunk_size),
+                                  daemon=True)
+        worker.start()
+    
+    def _load_worker(self, batch_size, chunk_size):
+        try:
+            if not os.path.exists(self.filename):
+                self._load_queue.put(('done', None, None))
+                return
+            total = os.path.getsize(self.filename) or 1
+            state = {'read': 0, 'crc': 0}
+            
+            def chunks():
+                decoder = codecs.getincrementaldecoder('utf-8')()
+                with open(self.filename, 'rb') as f:
+                    while True:
+                        raw = f.read(chunk_size)
+                        if not raw:
+                            break
+                        state['read'] += len(raw)
+                        state['crc'] = zlib.crc32(raw, state['crc'])
+                        yield decoder.decode(raw)
+                yield decoder.decode(b'', final=True)
+            
+            batch = []
+            for item in iter_json_array(chunks()):
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    self._load_queue.put(('batch', batch, state['read'] / total))
+                    batch = []
+            self._load_queue.put(('batch', batch, 1.0))
+            self._load_queue.put(('done', None, state['crc']))
+        except Exception as e:
+            self._load_queue.put(('error', e, None))
+    
+    def poll_background_load(self, max_batches=10):
+        """Перенос готовых пачек в хранилище; возвращает долю загруженного файла"""
+        if self._load_queue is None:
+            return 1.0
+        progress = None
+        for _ in range(max_batches):
+            try:
+                kind, payload, value = self._load_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'batch':
+                self.patients.extend_records(payload)
+                self.invalidate_indexes()
+                progress = value
+            elif kind == 'done':
+                self._snapshot_crc = value
+                self._finish_background_load()
+                return 1.0
+            else:
+                print(f"Ошибка загрузки данных: {payload}")
+                self.patients = PatientStore()
+                self._finish_background_load()
+                return 1.0
+        return progress
+    
+    def _finish_background_load(self):
+        self.loading = False
+        self._load_queue = None
+        with self.lock:
+            if file_stamp(self.filename)[0] != self._stamp[0]:
+                # Снимок заменили, пока мы его читали: перечитываем под блокировкой
+                self.patients = self.load_data()
+            else:
+                if self.journal:
+                    self.replay_journal(self.patients)
+                self._stamp = file_stamp(self.filename, self.journal_filename)
+        self.invalidate_indexes()
+        if not self.patients and FAKER_AVAILABLE:
+            self.generate_initial_data()
+    
+    @staticmethod
+    def _read_journal_header(f):
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None
+        return header if isinstance(header, dict) and header.get('op') == 'base' else None
+    
+    def replay_journal(self, patients):
+        """Применение записей журнала поверх загруженного снимка (под блокировкой)"""
+        self._journal_records = 0
+        self._journal_offset = 0
+        self.version = 0
+        if not os.path.exists(self.journal_filename):
+            return
+        try:
+            with open(self.journal_filename, 'rb') as f:
+                header = self._read_journal_header(f)
+                if header is None or header.get('crc') != self._snapshot_crc:
+                    # Журнал относится к другому снимку (сбой при свертке) - он уже свернут
+                    self.version = header.get('seq', 0) if header else 0
+                    self._write_journal_header(patients._next_key)
+                    return
+                self.version = header.get('seq', 0)
+                offset = f.tell()
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Недописанная при сбое строка - дальше данных нет
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    op = record.get('op')
+                    if op == 'add':
+                        patients.append_values(key=record.get('id'), **record['patient'])
+                    elif 'id' not in record:
+                        # Журнал старого формата: записи адресованы позициями
+                        if op == 'update':
+                            patients[record['index']] = Patient(**record['patient'])
+                        elif op == 'delete':
+                            del patients[record['index']]
+                    elif op == 'update':
+                        patients.set_row(patients.row_of(record['id']), Patient(**record['patient']))
+                    elif op == 'delete':
+                        patients.delete_row(patients.row_of(record['id']))
+                    offset += len(line)
+                    self._journal_records += 1
+                    self.version += 1
+                self._journal_offset = offset
+                # ID удаленных до свертки пациентов не выдаются повторно
+                patients._next_key = max(patients._next_key, header.get('next_id', 0))
+            if os.path.getsize(self.journal_filename) > self._journal_offset:
+                # Хвост после последней целой записи - след сбоя; без обрезки
+                # следующая запись склеилась бы с ним и тоже потерялась
+                os.truncate(self.journal_filename, self._journal_offset)
+        except Exception as e:
+            print(f"Ошибка чтения журнала: {e}")
+    
+    def append_journal(self, *records):
+        """Дописывание компактных записей в журнал одной операцией записи.
+        
+        StorageError, если записать не удалось; недописанный хвост журнала
+        при этом обрезается, чтобы следующие записи не оказались за ним.
+        """
+        with self.lock:
+            size = None
+            try:
+                if not os.path.exists(self.journal_filename):
+                    self._write_journal_header()
+                with open(self.journal_filename, 'ab') as f:
+                    size = f.tell()
+                    f.write(''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+                                    for record in records).encode('utf-8'))
+                    f.flush()
+                    self._journal_offset = f.tell()
+            except Exception as e:
+                if size is not None:
+                    try:
+                        os.truncate(self.journal_filename, size)
+                    except OSError:
+                        pass
+                raise StorageError(f"Ошибка записи журнала: {e}") from e
+            self._journal_records += len(records)
+            self.version += len(records)
+            self._stamp = file_stamp(self.filename, self.journal_filename)
+            if self._journal_records >= self.compact_every:
+                try:
+                    self.compact()
+                except StorageError as e:
+                    # Записи уже в журнале, свертка повторится при следующем изменении
+                    print(e)
+    
+    def _write_journal_header(self, next_id=None):
+        """Новый журнал для текущего снимка: его CRC, номер версии и следующий свободный ID"""
+        header = json.dumps({'op': 'base', 'crc': self._snapshot_crc, 'seq': self.version,
+                             'next_id': self.patients._next_key if next_id is None else next_id})
+        atomic_write(self.journal_filename, (header + '\n').encode('utf-8'))
+        self._journal_records = 0
+        self._journal_offset = len(header) + 1
+    
+    def compact(self):
+        """Сворачивание журнала в новый снимок patients.json"""
+        with self.lock:
+            self.sync()
+            self.save_data()
+    
+    @METRICS.timed()
+    def save_data(self):
+        with self.lock:
+            try:
+                # Новый снимок не содержит удаленных пациентов - надгробия больше не нужны
+                self.patients.purge()
+                if self.binary:
+                    # Заменяемый файл не должен оставаться отображенным в память (Windows)
+                    self.patients.thaw()
+                    raw, self._snapshot_crc = encode_binary_snapshot(self.patients)
+                else:
+                    raw = json.dumps([{'id': p.key, 'version': p.version, **self.patient_to_dict(p)}
+                                      for p in self.patients], indent=2, ensure_ascii=False).encode('utf-8')
+                    self._snapshot_crc = zlib.crc32(raw)
+                atomic_write(self.filename, raw)
+                if self.journal:
+                    self._write_journal_header()
+                self._stamp = file_stamp(self.filename, self.journal_filename)
+            except Exception as e:
+                raise StorageError(f"Ошибка сохранения данных: {e}") from e
+    
+    def sync(self):
+        """Подхват изменений других рабочих мест; вызывается под блокировкой.
+        
+        Новые записи журнала применяются по одной вместе с индексами. Если
+        снимок заменен так, что записи не сходятся, хранилище перечитывается
+        целиком. Примененные изменения копятся до poll_changes.
+        """
+        if self.loading:
+            return
+        stamp = file_stamp(self.filename, self.journal_filename)
+        if stamp == self._stamp:
+            return
+        changes = self._read_journal_tail() if self.journal else None
+        if changes is None:
+            self.patients = self.load_data()
+            self.invalidate_indexes()
+            # Перезагрузка перекрывает все накопленные до нее изменения
+            self._changes = [('reload', None)]
+            return
+        self._stamp = stamp
+        self._changes.extend(changes)
+    
+    def _read_journal_tail(self):
+        """Применение записей, дописанных в журнал после нашей последней; None - нужна полная перезагрузка"""
+        try:
+            f = open(self.journal_filename, 'rb')
+        except FileNotFoundError:
+            # Журнала нет: изменения не сходятся только если заменен снимок
+            return [] if file_stamp(self.filename)[0] == self._stamp[0] else None
+        with f:
+            header = self._read_journal_header(f)
+            if header is None:
+                return None
+            if header.get('crc') != self._snapshot_crc:
+                if header.get('seq') != self.version:
+                    return None
+                # Другое рабочее место свернуло журнал, все его записи у нас уже есть
+                self._snapshot_crc = header['crc']
+                self._journal_offset = 0
+                self._journal_records = 0
+            offset = max(self._journal_offset, f.tell())
+            f.seek(offset)
+            data = f.read()
+        changes = []
+        for line in data[:data.rfind(b'\n') + 1].splitlines(keepends=True):
+            try:
+                change = self._apply_record(json.loads(line))
+            except ValueError:
+                change = None
+            if change is None:
+                return None
+            changes.append(change)
+            offset += len(line)
+            self._journal_records += 1
+            self.version += 1
+        self._journal_offset = offset
+        return changes
+    
+    def _apply_record(self, record):
+        """Применение чужой записи журнала с обновлением индексов; (op, ID) или None"""
+        op, key = record.get('op'), record.get('id')
+        if key is None:
+            return None
+        try:
+            if op == 'add':
+                if self._insert(Patient(**record['patient']), key) != key:
+                    return None
+            elif op == 'update':
+                self._replace(key, Patient(**record['patient']))
+            elif op == 'delete':
+                self._remove(key)
+            else:
+                return None
+        except KeyError:
+            return None
+        return op, key
+    
+    def poll_changes(self):
+        """Изменения с других рабочих мест: список (op, ID); ('reload', None) - данные перечитаны.
+        
+        Без изменений проверка стоит пары stat. Если хранилище сейчас занято
+        другим рабочим местом, она откладывается до следующего вызова.
+        """
+        if not self.loading and file_stamp(self.filename, self.journal_filename) != self._stamp:
+            if self.lock.acquire(blocking=False):
+                try:
+                    self.sync()
+                finally:
+                    self.lock.release()
+        changes, self._changes = self._changes, []
+        return changes
+    
+    def invalidate_indexes(self):
+        """Сброс индексов и сводок после массовых изменений: они пересоберутся при обращении"""
+        self._name_index = None
+        self._aggregates = None
+        self._sort_indexes = {}
+        self.revision += 1
+    
+    def _index_patient(self, key, patient):
+        for field, index in self._sort_indexes.items():
+            index.add(key, getattr(patient, field))
+    
+    def _unindex_patient(self, key, patient):
+        for field, index in self._sort_indexes.items():
+            index.remove(key, getattr(patient, field))
+    
+    def _insert(self, patient, key=None):
+        """Добавление в хранилище и индексы, без записи на диск; возвращает ID"""
+        key = self.patients.append_values(patient.full_name, patient.age, patient.gender,
+                                          patient.height, patient.weight, key)
+        if self._name_index is not None:
+            self._name_index.add(key, patient.full_name)
+        if self._aggregates is not None:
+            self._aggregates.add(patient.age, patient.gender, patient.bmi)
+        self._index_patient(key, patient)
+        self.revision += 1
+        return key
+    
+    def _replace(self, key, patient):
+        row = self.patients.row_of(key)
+        # Проверка значений до правки индексов: set_row не должна упасть на полпути
+        self.patients._cells(patient.age, patient.gender, patient.height, patient.weight)
+        old = PatientView(self.patients, row)
+        if self._name_index is not None:
+            self._name_index.remove(key, old.full_name)
+            self._name_index.add(key, patient.full_name)
+        if self._aggregates is not None:
+            self._aggregates.remove(old.age, old.gender, old.bmi)
+            self._aggregates.add(patient.age, patient.gender, patient.bmi)
+        self._unindex_patient(key, old)
+        self._index_patient(key, patient)
+        self.patients.set_row(row, patient)
+        self.revision += 1
+    
+    def _remove(self, key):
+        row = self.patients.row_of(key)
+        old = PatientView(self.patients, row)
+        if self._name_index is not None:
+            self._name_index.remove(key, old.full_name)
+        if self._aggregates is not None:
+            self._aggregates.remove(old.age, old.gender, old.bmi)
+        self._unindex_patient(key, old)
+        self.patients.delete_row(row)
+        self.revision += 1
+    
+    def _check_version(self, key, version):
+        """Оптимистическая блокировка: запись не должна была измениться с момента чтения"""
+        if version is None:
+            return
+        try:
+            row = self.patients.row_of(key)
+        except KeyError:
+            raise ConflictError("Пациент удален на другом рабочем месте") from None
+        if self.patients.versions[row] != version:
+            raise ConflictError("Пациент изменен на другом рабочем месте")
+    
+    @contextmanager
+    def batch(self):
+        """Группа изменений с одной записью на диск в конце.
+        
+        Блокировка хранилища держится на всю группу, записи журнала копятся
+        и дописываются одной операцией (или пишется снимок, если их много).
+        """
+        with self.lock:
+            if self._batch is not None:
+                # Вложенная группа сохраняется вместе с внешней
+                yield
+                return
+            self._batch = []
+            try:
+                yield
+            finally:
+                records, self._batch = self._batch, None
+                if records:
+                    self._write(records)
+    
+    def _commit(self, *records):
+        if self._batch is not None:
+            self._batch.extend(records)
+        else:
+            self._write(records)
+    
+    def _journaled(self, count):
+        """Пишутся ли count изменений журналом; иначе - сразу снимком"""
+        return self.journal and count < self.compact_every
+    
+    def _write(self, records):
+        """Запись изменений на диск: журналом или, если их много (или records None), снимком.
+        
+        Если запись не удалась, память возвращается к состоянию на диске,
+        а StorageError уходит вызывающему - изменение не должно выглядеть
+        сохраненным.
+        """
+        try:
+            if records is not None and self._journaled(len(records)):
+                self.append_journal(*records)
+            else:
+                self.save_data()
+        except StorageError:
+            self.patients = self.load_data()
+            self.invalidate_indexes()
+            self._changes = [('reload', None)]
+            raise
+    
+    def add_patient(self, patient):
+        """Добавление пациента; возвращает его ID"""
+        with self.lock:
+            self.sync()
+            key = self._insert(patient)
+            self._commit({'op': 'add', 'id': key, 'patient': self.patient_to_dict(patient)})
+        return key
+    
+    def add_patients(self, patients):
+        """Массовое добавление: данные сохраняются один раз на всю пачку"""
+        with self.lock:
+            self.sync()
+            keys = [self._insert(patient) for patient in patients]
+            if self._batch is None and not self._journaled(len(keys)):
+                # Большая пачка - сразу пишем снимок, записи журнала для нее не нужны
+                self._write(None)
+            else:
+                self._commit(*({'op': 'add', 'id': key, 'patient': self.patient_to_dict(p)}
+                               for key, p in zip(keys, map(self.patients.get, keys))))
+        return len(keys)
+    
+    def get_patient(self, key):
+        """Пациент по ID; KeyError, если такого нет"""
+        return self.patients.get(key)
+    
+    def position_of(self, key):
+        """Позиция пациента в порядке хранения"""
+        return self.patients.position_of(self.patients.row_of(key))
+    
+    def update_patient(self, key, patient, version=None):
+        """Изменение пациента; с version - только если запись не менялась с момента чтения"""
+        with self.lock:
+            self.sync()
+            self._check_version(key, version)
+            self._replace(key, patient)
+            self._commit({'op': 'update', 'id': key, 'patient': self.patient_to_dict(patient)})
+    
+    def delete_patient(self, key, version=None):
+        """Удаление по ID: строка помечается надгробием, столбцы не сдвигаются"""
+        with self.lock:
+            self.sync()
+            self._check_version(key, version)
+            self._remove(key)
+            self._commit({'op': 'delete', 'id': key})
+    
+    def count(self):
+        return len(self.patients)
+    
+    def get_page(self, offset, limit):
+        """Страница пациентов для отображения"""
+        return self.patients[offset:offset + limit]
+    
+    def name_index(self):
+        """Индекс по ФИО; строится при первом поиске и дальше обновляется при изменениях"""
+        if self._name_index is None:
+            store = self.patients
+            index = NameIndex(lambda key: store.names[store.row_of(key)])
+            for row in store.live_rows():
+                index.add(store.keys[row], store.names[row])
+            self._name_index = index
+        return self._name_index
+    
+    def search(self, query, limit=100):
+        """ID пациентов, ФИО которых подходит под запрос"""
+        return self.name_index().search(query, limit)
+    
+    def aggregates(self):
+        """Сводки для статистики; считаются один раз и дальше обновляются при изменениях"""
+        if self._aggregates is None:
+            self._aggregates = PatientAggregates.from_patients(self.patients)
+        return self._aggregates
+    
+    def sorted_view(self, field, descending=False):
+        """ID пациентов, упорядоченные по полю; индекс строится при первом запросе"""
+        index = self._sort_indexes.get(field)
+        if index is None:
+            if field not in SORT_FIELDS:
+                raise ValueError(f"Нельзя сортировать по полю {field}")
+            index = self._sort_indexes[field] = self.patients.sort_index(field)
+        return SortedView(index, descending)
+    
+    def query(self, expression):
+        """Когорта по выражению или CohortQuery; повторные запросы берутся из кэша"""
+        if not isinstance(expression, CohortQuery):
+            expression = CohortQuery.parse(expression)
+        return self._cohorts.get(expression, lambda query: Cohort.evaluate(self, query))
+    
+    def filter_patients(self, gender=None, min_age=None, max_age=None, name_prefix=None,
+                        min_bmi=None, max_bmi=None):
+        """Пациенты, подходящие под фильтр (генератор)"""
+        for patient in self.patients:
+            if gender is not None and patient.gender != gender:
+                continue
+            if min_age is not None and patient.age < min_age:
+                continue
+            if max_age is not None and patient.age > max_age:
+                continue
+            if name_prefix and not patient.full_name.startswith(name_prefix):
+                continue
+            if min_bmi is not None and patient.bmi < min_bmi:
+                continue
+            if max_bmi is not None and patient.bmi > max_bmi:
+                continue
+            yield patient
+
+# Потоковая работа с хранилищем JSON без загрузки всех пациентов в память
+
+# Допустимые значения возраста (лет), роста (см) и веса (кг)
+AGE_RANGE = (0, 150)
+HEIGHT_RANGE = (20, 300)
+WEIGHT_RANGE = (0.5, 700)
+
+def normalize_record(item):
+    """Запись пациента в формате patients.json; ValueError, если поля некорректны"""
+    try:
+        height = float(item['height'])
+        weight = float(item['weight'])
+        record = {
+            'full_name': str(item['full_name']).strip(),
+            'age': int(item['age']),
+            'gender': str(item['gender']).strip(),
+            'height': int(height) if height.is_integer() else height,
+            'weight': int(weight) if weight.is_integer() else weight
+        }
+    except (KeyError, TypeError, OverflowError) as e:
+        raise ValueError(f"Некорректная запись пациента: {e}") from None
+    if not record['full_name'] or not record['gender']:
+        raise ValueError("Некорректная запись пациента: пустое ФИО или пол")
+    for name, label, (low, high) in (('age', 'возраст', AGE_RANGE), ('height', 'рост', HEIGHT_RANGE),
+                                     ('weight', 'вес', WEIGHT_RANGE)):
+        # Проверка "не в диапазоне" отсеивает и NaN
+        if not low <= record[name] <= high:
+            raise ValueError(f"Некорректная запись пациента: {label} {record[name]} "
+                             f"вне диапазона {low}..{high}")
+    return record
+
+def read_journal(filename):
+    """Заголовок и еще не свернутые записи журнала, относящиеся к текущему снимку.
+    
+    Заголовок None, если журнала нет или он относится к другому снимку.
+    """
+    journal_filename = filename + '.wal'
+    if not os.path.exists(journal_filename):
+        return None, []
+    records = []
+    with open(journal_filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Недописанная при сбое строка - дальше данных нет
+                break
+    if records and records[0].get('op') == 'base':
+        crc = snapshot_crc(filename) if os.path.exists(filename) else None
+        return (records[0], records[1:]) if records[0].get('crc') == crc else (None, [])
+    return None, records
+
+def pending_journal_records(filename):
+    """Число еще не свернутых записей журнала, относящихся к текущему снимку"""
+    return len(read_journal(filename)[1])
+
+def iter_keyed(records, next_key=0):
+    """Пары (ID, запись) с теми же ID, что выдаст PatientStore при загрузке"""
+    for item in records:
+        key = item.get('id')
+        if key is None or key < next_key:
+            key = next_key
+        next_key = key + 1
+        yield key, item
+
+def keyed_record(key, item):
+    """Запись формата patients.json с полем id первым"""
+    record = {'id': key}
+    record.update((field, value) for field, value in item.items() if field != 'id')
+    return record
+
+def iter_store_records(filename='patients.json'):
+    """Пациенты хранилища (снимок и журнал) словарями с полем id, по одному.
+    
+    Журнал короткий (не длиннее compact_every записей) и держится в памяти,
+    снимок читается потоком.
+    """
+    _, journal = read_journal(filename)
+    if any('id' not in record for record in journal):
+        # Журнал старого формата с позициями применяется к снимку целиком, в памяти
+        manager = PatientManager(filename, journal=True, initial_data=False)
+        for patient in manager.patients:
+            yield {'id': patient.key, **PatientManager.patient_to_dict(patient)}
+        return
+    changes, added = {}, {}
+    for record in journal:
+        key = record['id']
+        if record['op'] == 'add':
+            added[key] = record['patient']
+        elif record['op'] == 'update':
+            (added if key in added else changes)[key] = record['patient']
+        elif record['op'] == 'delete':
+            if key in added:
+                del added[key]
+            else:
+                changes[key] = None
+    for key, item in iter_keyed(iter_snapshot(filename)):
+        item = changes.get(key, item)
+        if item is not None:
+            record = keyed_record(key, item)
+            # Версия записи нужна только рабочим местам, в выгрузку не идет
+            record.pop('version', None)
+            yield record
+    for key, item in added.items():
+        yield keyed_record(key, item)
+
+def write_json_store(filename, records):
+    """Потоковая запись пациентов в формате save_data; возвращает число записей"""
+    count = 0
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for record in records:
+            item = json.dumps(record, indent=2, ensure_ascii=False).replace('\n', '\n  ')
+            f.write((',\n  ' if count else '\n  ') + item)
+            count += 1
+        f.write('\n]' if count else ']')
+    return count
+
+def append_to_store(filename, records):
+    """Потоковое добавление пациентов в хранилище; возвращает число записей.
+    
+    Если в журнале нет несвернутых записей, снимок переписывается потоком
+    через временный файл. Иначе новые пациенты дописываются в журнал.
+    В обоих случаях новые пациенты сразу получают ID. Хранилище на время
+    записи блокируется, как и в PatientManager.
+    """
+    journal_filename = filename + '.wal'
+    added = 0
+    
+    def counted():
+        nonlocal added
+        for record in records:
+            added += 1
+            yield record
+    
+    with StoreLock(filename + '.lock'):
+        existing = iter_snapshot(filename)
+        header, journal = read_journal(filename)
+        next_id = header.get('next_id', 0) if header else 0
+        if journal:
+            # Следующий свободный ID: после снимка и добавленных журналом пациентов
+            for key, _ in iter_keyed(itertools.chain(
+                    existing, ({'id': r.get('id')} for r in journal if r.get('op') == 'add'))):
+                next_id = max(next_id, key + 1)
+            with open(journal_filename, 'a', encoding='utf-8') as f:
+                for key, record in enumerate(counted(), next_id):
+                    f.write(json.dumps({'op': 'add', 'id': key, 'patient': record}, ensure_ascii=False,
+                                       separators=(',', ':')) + '\n')
+            return added
+        
+        def keyed():
+            nonlocal next_id
+            last = -1
+            for key, item in iter_keyed(existing):
+                last = key
+                yield keyed_record(key, item)
+            for key, item in iter_keyed(counted(), max(last + 1, next_id)):
+                next_id = key + 1
+                yield keyed_record(key, item)
+            next_id = max(next_id, last + 1)
+        
+        if is_binary_snapshot(filename) or filename.endswith(BINARY_SUFFIX):
+            # Бинарный снимок пишется целиком: столбцы нужно собрать до записи заголовка
+            write_binary_store(filename, keyed())
+        else:
+            write_json_store(filename + '.tmp', keyed())
+            os.replace(filename + '.tmp', filename)
+        if header is not None:
+            # Новый заголовок со сдвинутой версией: рабочие места перечитают снимок
+            atomic_write(journal_filename, (json.dumps({
+                'op': 'base', 'crc': snapshot_crc(filename), 'seq': header.get('seq', 0) + added,
+                'next_id': next_id}) + '\n').encode('utf-8'))
+        elif os.path.exists(journal_filename):
+            # Журнал от другого снимка - он уже свернут
+            os.remove(journal_filename)
+    return added
+
+class SQLitePatientList:
+    """Ленивый список пациентов из SQLite: записи читаются страницами по мере обращения"""
+    
+    def __init__(self, manager, page_size=500):
+        self.manager = manager
+        self.page_size = page_size
+        self._page_offset = None
+        self._page = []
+        self._revision = None
+    
+    def __len__(self):
+        return self.manager.count()
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self.manager.get_page(start, stop - start)
+        if index < 0:
+            index += len(self)
+        offset = index - index % self.page_size
+        if self._page_offset != offset or self.manager.revision != self._revision:
+            self._page = self.manager.get_page(offset, self.page_size)
+            self._page_offset = offset
+            self._revision = self.manager.revision
+        try:
+            return self._page[index - offset]
+        except IndexError:
+            raise IndexError('patient index out of range') from None
+    
+    def __iter__(self):
+        return self.manager.filter_patients()
+
+class SQLiteSortedView:
+    """ID пациентов из SQLite в порядке поля; читаются страницами по индексу столбца"""
+    
+    def __init__(self, manager, field, descending=False, page_size=500):
+        if field not in SORT_FIELDS:
+            raise ValueError(f"Нельзя сортировать по полю {field}")
+        self.manager = manager
+        order = 'DESC' if descending else 'ASC'
+        self.query = f'SELECT id FROM patients ORDER BY {field} {order}, id {order} LIMIT ? OFFSET ?'
+        self.page_size = page_size
+        self._page_offset = None
+        self._page = []
+        self._revision = None
+    
+    def __len__(self):
+        return self.manager.count()
+    
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        offset = i - i % self.page_size
+        if self._page_offset != offset or self.manager.revision != self._revision:
+            self._page = [row[0] for row in self.manager.conn.execute(self.query, (self.page_size, offset))]
+            self._page_offset = offset
+            self._revision = self.manager.revision
+        try:
+            return self._page[i - offset]
+        except IndexError:
+            raise IndexError('patient index out of range') from None
+
+class SQLiteCohort(Cohort):
+    """Когорта из SQLite: отбор, столбцы и группировки выполняет сама база"""
+    
+    @classmethod
+    def evaluate(cls, manager, query):
+        where, params = query.sql()
+        rows = manager.conn.execute(f'SELECT id FROM patients WHERE {where} ORDER BY id', params)
+        return cls(manager, query, array('q', (row[0] for row in rows)))
+    
+    def _select(self, columns, gender=None, tail=''):
+        where, params = self.query.sql()
+        if gender is not None:
+            where += ' AND gender = ?'
+            params.append(gender)
+        return self.manager.conn.execute(f'SELECT {columns} FROM patients WHERE {where} {tail}',
+                                         params)
+    
+    def _existing(self, keys):
+        # Столбцы и так выбираются запросом по текущим данным; ID берутся так же
+        return array('q', (row[0] for row in self._select('id', tail='ORDER BY id')))
+    
+    @property
+    def gender_values(self):
+        return [row[0] for row in self._select('DISTINCT gender', tail='ORDER BY gender')]
+    
+    def column(self, name, gender=None):
+        rows = self._select('id' if name == 'key' else name, gender, 'ORDER BY id')
+        return array('q' if name in ('key', 'age') else 'd', (row[0] for row in rows))
+    
+    def aggregates(self):
+        if self._aggregates is None:
+            aggregates = PatientAggregates()
+            for gender, age, bmi, count in self._select('gender, age, bmi, COUNT(*)',
+                                                        tail='GROUP BY gender, age, bmi'):
+                aggregates.gender_counts[gender] += count
+                aggregates.age_counts[age] += count
+                aggregates.bmi_by_gender.setdefault(gender, BmiSketch()).add(bmi, count)
+            self._aggregates = aggregates
+        return self._aggregates
+    
+    def group_by(self, field, values=('age', 'bmi')):
+        if field not in GROUP_FIELDS:
+            raise ValueError(f"Группировать можно по {', '.join(GROUP_FIELDS)}")
+        label = {'gender': 'gender', 'category': _SQL_CATEGORY, 'age_group': _SQL_AGE_GROUP}[field]
+        columns = ', '.join(f'ROUND(AVG({name}), 2)' for name in values)
+        rows = self._select(f"{label} AS label, COUNT(*){', ' if values else ''}{columns}",
+                            tail='GROUP BY label ORDER BY MIN(age)' if field == 'age_group'
+                            else 'GROUP BY label')
+        groups = {row[0]: {'count': row[1], **dict(zip(values, row[2:]))} for row in rows}
+        if field == 'category':
+            groups = {category: groups[category] for category in BMI_CATEGORIES if category in groups}
+        return groups
+    
+    def sorted_view(self, field, descending=False):
+        ordered = self._sorted.get(field)
+        if ordered is None:
+            if field not in SORT_FIELDS:
+                raise ValueError(f"Нельзя сортировать по полю {field}")
+            ordered = self._sorted[field] = array('q', (row[0] for row in self._select(
+                'id', tail=f'ORDER BY {field}, id')))
+        return SortedView(SortIndex(None, ordered), descending)
+
+class SQLitePatientManager:
+    """Хранение пациентов в локальной базе SQLite с индексами по ФИО, возрасту и полу"""
+    
+    COLUMNS = 'full_name, age, gender, height, weight'
+    # Поля для чтения: id и version идут последними, как параметры Patient
+    SELECT_COLUMNS = COLUMNS + ', id, version'
+    
+    def __init__(self, filename='patients.db', import_filename='patients.json', initial_data=True):
+        self.filename = filename
+        self.revision = 0
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS patients (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                full_name TEXT NOT NULL,
+                age INTEGER NOT NULL,
+                gender TEXT NOT NULL,
+                height REAL NOT NULL,
+                weight REAL NOT NULL,
+                bmi REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_patients_full_name ON patients(full_name);
+            CREATE INDEX IF NOT EXISTS idx_patients_age ON patients(age);
+            CREATE INDEX IF NOT EXISTS idx_patients_gender ON patients(gender);
+            CREATE INDEX IF NOT EXISTS idx_patients_height ON patients(height);
+            CREATE INDEX IF NOT EXISTS idx_patients_weight ON patients(weight);
+            CREATE INDEX IF NOT EXISTS idx_patients_bmi ON patients(bmi);
+        ''')
+        # Базы прежних версий: добавляем номер версии записи
+        if 'version' not in {row[1] for row in self.conn.execute('PRAGMA table_info(patients)')}:
+            with self.conn:
+                self.conn.execute('ALTER TABLE patients ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+        self._data_version = self._read_data_version()
+        self._in_batch = False
+        self.patients = SQLitePatientList(self)
+        self._name_index = None
+        self._aggregates = None
+        self._cohorts = CohortCache(self)
+        
+        # Новая база: переносим данные из JSON или генерируем тестовые
+        if not self.count():
+            if import_filename and os.path.exists(import_filename):
+                self.import_json(import_filename)
+            elif FAKER_AVAILABLE and initial_data:
+                self.generate_initial_data()
+    
+    def generate_initial_data(self):
+        """Генерация начальных тестовых данных с помощью Faker"""
+        fake = load_faker()
+        self._insert_many(fake_patient(fake) for _ in range(10))
+    
+    def import_json(self, filename):
+        """Перенос пациентов из patients.json в базу"""
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                self._insert_many(Patient(item['full_name'], item['age'], item['gender'],
+                                          item['height'], item['weight'], item.get('id'))
+                                  for item in json.load(f))
+        except Exception as e:
+            print(f"Ошибка загрузки данных: {e}")
+    
+    @staticmethod
+    def _row_values(patient):
+        return (patient.full_name, patient.age, patient.gender,
+                patient.height, patient.weight, patient.bmi)
+    
+    def _insert_many(self, patients):
+        # ID из patients.json сохраняется, у новых пациентов его назначает база
+        with self._transaction():
+            self.conn.executemany(
+                f'INSERT INTO patients (id, {self.COLUMNS}, bmi) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((getattr(p, 'key', None),) + self._row_values(p) for p in patients))
+        self._name_index = None
+        self._aggregates = None
+        self.revision += 1
+    
+    def load_data(self):
+        return self.patients
+    
+    def save_data(self):
+        # Изменения фиксируются сразу в каждой операции
+        self.conn.commit()
+    
+    def _name_of(self, row_id):
+        return self.conn.execute('SELECT full_name FROM patients WHERE id = ?',
+                                 (row_id,)).fetchone()[0]
+    
+    def _fetch(self, row_id):
+        row = self.conn.execute(f'SELECT {self.SELECT_COLUMNS} FROM patients WHERE id = ?',
+                                (row_id,)).fetchone()
+        if row is None:
+            raise KeyError(row_id)
+        return Patient(*row)
+    
+    def _forget(self, row_id):
+        """Удаление старой версии записи из индекса и сводок"""
+        if self._name_index is None and self._aggregates is None:
+            return
+        old = self._fetch(row_id)
+        if self._name_index is not None:
+            self._name_index.remove(row_id, old.full_name)
+        if self._aggregates is not None:
+            self._aggregates.remove(old.age, old.gender, old.bmi)
+    
+    def _remember(self, row_id, patient):
+        if self._name_index is not None:
+            self._name_index.add(row_id, patient.full_name)
+        if self._aggregates is not None:
+            self._aggregates.add(patient.age, patient.gender, patient.bmi)
+    
+    @contextmanager
+    def batch(self):
+        """Группа изменений одной транзакцией"""
+        if self._in_batch:
+            yield
+            return
+        self._in_batch = True
+        try:
+            with self.conn:
+                yield
+        finally:
+            self._in_batch = False
+    
+    def _transaction(self):
+        # Внутри batch() фиксирует транзакцию сама группа
+        return nullcontext() if self._in_batch else self.conn
+    
+    def add_patient(self, patient):
+        """Добавление пациента; возвращает его ID"""
+        with self._transaction():
+            cursor = self.conn.execute(
+                f'INSERT INTO patients ({self.COLUMNS}, bmi) VALUES (?, ?, ?, ?, ?, ?)',
+                self._row_values(patient))
+        self._remember(cursor.lastrowid, patient)
+        self.revision += 1
+        return cursor.lastrowid
+    
+    def add_patients(self, patients):
+        """Массовое добавление одной транзакцией"""
+        before = self.count()
+        self._insert_many(patients)
+        return self.count() - before
+    
+    def get_patient(self, key):
+        """Пациент по ID; KeyError, если такого нет"""
+        return self._fetch(key)
+    
+    def position_of(self, key):
+        """Позиция пациента в порядке хранения"""
+        return self.conn.execute('SELECT COUNT(*) FROM patients WHERE id < ?', (key,)).fetchone()[0]
+    
+    def _check_version(self, row_id, version):
+        """Оптимистическая блокировка: запись не должна была измениться с момента чтения"""
+        try:
+            current = self._fetch(row_id).version
+        except KeyError:
+            raise ConflictError("Пациент удален на другом рабочем месте") from None
+        if current != version:
+            raise ConflictError("Пациент изменен на другом рабочем месте")
+    
+    def update_patient(self, row_id, patient, version=None):
+        """Изменение пациента; с version - только если запись не менялась с момента чтения"""
+        if version is not None:
+            self._check_version(row_id, version)
+        self._forget(row_id)
+        with self._transaction():
+            cursor = self.conn.execute(
+                'UPDATE patients SET full_name = ?, age = ?, gender = ?, height = ?, '
+                'weight = ?, bmi = ?, version = version + 1 WHERE id = ?'
+                + ('' if version is None else ' AND version = ?'),
+                self._row_values(patient) + (row_id,) + (() if version is None else (version,)))
+        if cursor.rowcount == 0:
+            if version is None:
+                raise KeyError(row_id)
+            # Запись изменили между проверкой и обновлением
+            self.invalidate_indexes()
+            raise ConflictError("Пациент изменен на другом рабочем месте")
+        self._remember(row_id, patient)
+        self.revision += 1
+    
+    def delete_patient(self, row_id, version=None):
+        if version is not None:
+            self._check_version(row_id, version)
+        self._forget(row_id)
+        with self._transaction():
+            cursor = self.conn.execute(
+                'DELETE FROM patients WHERE id = ?' + ('' if version is None else ' AND version = ?'),
+                (row_id,) + (() if version is None else (version,)))
+        if cursor.rowcount == 0:
+            # Как в PatientManager: без версии - нет такого пациента, с версией - конфликт
+            if version is None:
+                raise KeyError(row_id)
+            self.invalidate_indexes()
+            raise ConflictError("Пациент изменен на другом рабочем месте")
+        self.revision += 1
+    
+    def _read_data_version(self):
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+    
+    def invalidate_indexes(self):
+        self._name_index = None
+        self._aggregates = None
+        self.revision += 1
+    
+    def poll_changes(self):
+        """Изменения с других рабочих мест: SQLite сообщает о чужих транзакциях через data_version"""
+        data_version = self._read_data_version()
+        if data_version == self._data_version:
+            return []
+        self._data_version = data_version
+        self.invalidate_indexes()
+        return [('reload', None)]
+    
+    def name_index(self):
+        """Индекс по ФИО; строится одним проходом по столбцу full_name"""
+        if self._name_index is None:
+            index = NameIndex(self._name_of)
+            for row_id, full_name in self.conn.execute('SELECT id, full_name FROM patients'):
+                index.add(row_id, full_name)
+            self._name_index = index
+        return self._name_index
+    
+    def search(self, query, limit=100):
+        """ID пациентов, ФИО которых подходит под запрос"""
+        return self.name_index().search(query, limit)
+    
+    def aggregates(self):
+        """Сводки для статистики: группировка выполняется самой базой"""
+        if self._aggregates is None:
+            aggregates = PatientAggregates()
+            rows = self.conn.execute(
+                'SELECT gender, age, bmi, COUNT(*) FROM patients GROUP BY gender, age, bmi')
+            for gender, age, bmi, count in rows:
+                aggregates.gender_counts[gender] += count
+                aggregates.age_counts[age] += count
+                aggregates.bmi_by_gender.setdefault(gender, BmiSketch()).add(bmi, count)
+            self._aggregates = aggregates
+        return self._aggregates
+    
+    def sorted_view(self, field, descending=False):
+        """ID пациентов, упорядоченные по полю с помощью индексов базы"""
+        return SQLiteSortedView(self, field, descending)
+    
+    def query(self, expression):
+        """Когорта по выражению: условие переводится в WHERE, результат кэшируется"""
+        if not isinstance(expression, CohortQuery):
+            expression = CohortQuery.parse(expression)
+        return self._cohorts.get(expression, lambda query: SQLiteCohort.evaluate(self, query))
+    
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
+    
+    def get_page(self, offset, limit):
+        """Страница пациентов для отображения"""
+        rows = self.conn.execute(
+            f'SELECT {self.SELECT_COLUMNS} FROM patients ORDER BY id LIMIT ? OFFSET ?',
+            (limit, offset))
+        return [Patient(*row) for row in rows]
+    
+    def filter_patients(self, gender=None, min_age=None, max_age=None, name_prefix=None,
+                        min_bmi=None, max_bmi=None):
+        """Пациенты, подходящие под фильтр (генератор, без загрузки всей базы)"""
+        conditions, params = [], []
+        if gender is not None:
+            conditions.append('gender = ?')
+            params.append(gender)
+        if min_age is not None:
+            conditions.append('age >= ?')
+            params.append(min_age)
+        if max_age is not None:
+            conditions.append('age <= ?')
+            params.append(max_age)
+        if name_prefix:
+            # Диапазон по индексу full_name вместо LIKE
+            conditions.append('full_name >= ? AND full_name < ?')
+            params.extend([name_prefix, name_prefix + '\U0010ffff'])
+        if min_bmi is not None:
+            conditions.append('bmi >= ?')
+            params.append(min_bmi)
+        if max_bmi is not None:
+            conditions.append('bmi <= ?')
+            params.append(max_bmi)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        cursor = self.conn.execute(
+            f'SELECT {self.SELECT_COLUMNS} FROM patients {where} ORDER BY id', params)
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            for row in rows:
+                yield Patient(*row)
+    
+    def close(self):
+        self.conn.close()
+
+# Способ хранения: journal (JSON + журнал), binary (бинарный снимок + журнал), json или sqlite
+STORAGE_BACKEND = os.environ.get('EMIAS_STORAGE', 'journal')
+
+# Расширения файлов базы SQLite
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+def backend_for(filename):
+    """Способ хранения по существующему файлу: sqlite, binary или journal"""
+    if filename.endswith(SQLITE_SUFFIXES):
+        return 'sqlite'
+    if filename.endswith(BINARY_SUFFIX) or is_binary_snapshot(filename):
+        return 'binary'
+    return 'journal'
+
+def open_store(filename):
+    """Менеджер готового хранилища для чтения без интерфейса; способ хранения - по файлу.
+    
+    В отличие от create_manager, не создает пустую базу и не переносит в нее
+    patients.json, если файла нет, - это ошибка.
+    """
+    if not os.path.exists(filename):
+        raise FileNotFoundError(f"Хранилище {filename} не найдено")
+    return create_manager(backend_for(filename), filename=filename, initial_data=False)
+
+def create_manager(backend=None, background=False, filename=None, initial_data=True):
+    """Создание менеджера пациентов для выбранного способа хранения"""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'sqlite':
+        return SQLitePatientManager(filename or 'patients.db', initial_data=initial_data)
+    if backend == 'binary':
+        filename = filename or 'patients.bin'
+        if not os.path.exists(filename) and os.path.exists('patients.json'):
+            # Первый запуск: переносим пациентов из JSON, как и для SQLite
+            write_binary_store(filename, iter_store_records('patients.json'))
+        return PatientManager(filename, journal=True, background=background,
+                              initial_data=initial_data, binary=True)
+    return PatientManager(filename or 'patients.json', journal=(backend == 'journal'),
+                          background=background, initial_data=initial_data)
@@ -0,0 +1,395 @@
+"""HTTP-сервис ЕМИАС: пациенты, поиск и статистика в JSON поверх PatientManager.
+
+Сервер работает на asyncio и не требует сторонних библиотек. Изменения от
+одновременных запросов собираются в пачку и сохраняются одной записью на
+диск, а большие списки отдаются потоком, без сборки всего ответа в памяти.
+
+    python emias_server.py --port 8080
+    curl 'http://127.0.0.1:8080/patients?offset=0&limit=50&sort=bmi&desc=1'
+    curl 'http://127.0.0.1:8080/search?q=иван&limit=20'
+    curl http://127.0.0.1:8080/stats
+    curl 'http://127.0.0.1:8080/cohort?q=пол=Ж возраст=40..60&group_by=category'
+    curl -X POST http://127.0.0.1:8080/patients \\
+         -d '{"full_name": "Иванов Иван", "age": 35, "gender": "М", "height": 180, "weight": 75}'
+    curl -X PUT http://127.0.0.1:8080/patients/7 -d '{"version": 1, "full_name": ...}'
+    curl -X DELETE 'http://127.0.0.1:8080/patients/7?version=2'
+    curl http://127.0.0.1:8080/metrics               # с --metrics: замеры для Prometheus
+"""
+import argparse
+import asyncio
+import json
+import sys
+import traceback
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from emias_core import (METRICS, ConflictError, Patient, StorageError, create_manager,
+                        normalize_record)
+
+# Сколько пациентов отдавать одним куском потокового ответа
+STREAM_CHUNK = 1000
+
+# Наибольший размер тела запроса
+MAX_BODY = 16 << 20
+
+# Как часто (с) подхватывать изменения, сделанные на других рабочих местах
+CHANGE_POLL_INTERVAL = 2.0
+
+REASONS = {
+    200: 'OK', 201: 'Created', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+    500: 'Internal Server Error', 503: 'Service Unavailable'
+}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def patient_record(patient):
+    """Пациент для ответа: с ID, версией и ИМТ"""
+    return {'id': patient.key, 'version': patient.version, 'full_name': patient.full_name,
+            'age': patient.age, 'gender': patient.gender, 'height': patient.height,
+            'weight': patient.weight, 'bmi': patient.bmi}
+
+def parse_patient(item):
+    if not isinstance(item, dict):
+        raise ValueError("Ожидается объект пациента")
+    return Patient(**normalize_record(item))
+
+class WriteBatcher:
+    """Сбор изменений от одновременных запросов в одну запись на диск.
+    
+    Операции, пришедшие за flush_delay секунд, выполняются подряд внутри
+    manager.batch(): журнал дописывается один раз на всю пачку. Ответы
+    отправляются только после записи.
+    """
+    
+    def __init__(self, manager, flush_delay=0.002):
+        self.manager = manager
+        self.flush_delay = flush_delay
+        self.flushes = 0
+        self._pending = []
+    
+    def submit(self, operation, *args):
+        """Постановка операции в пачку; возвращает future с ее результатом"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self._pending:
+            loop.call_later(self.flush_delay, self.flush)
+        self._pending.append((operation, args, future))
+        return future
+    
+    def flush(self):
+        pending, self._pending = self._pending, []
+        results = []
+        try:
+            with self.manager.batch():
+                for operation, args, future in pending:
+                    try:
+                        results.append((future, operation(*args), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            results = [(future, None, e) for _, _, future in pending]
+        self.flushes += 1
+        for future, result, error in results:
+            if future.cancelled():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+class PatientServer:
+    """Обработка запросов HTTP/1.1 с keep-alive поверх менеджера пациентов"""
+    
+    def __init__(self, manager, flush_delay=0.002):
+        self.manager = manager
+        self.writes = WriteBatcher(manager, flush_delay)
+        self.requests = 0
+    
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        poller = asyncio.create_task(self.poll_changes())
+        address = ', '.join(str(sock.getsockname()[:2]) for sock in server.sockets)
+        print(f"ЕМИАС слушает {address}, пациентов: {self.manager.count()}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            poller.cancel()
+    
+    async def poll_changes(self):
+        """Подхват изменений с других рабочих мест, чтобы чтение не отставало"""
+        while True:
+            await asyncio.sleep(CHANGE_POLL_INTERVAL)
+            self.manager.poll_changes()
+    
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('utf-8', 'replace').split()
+                except ValueError:
+                    await self.send(writer, 400, {'error': "Некорректная строка запроса"}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                http11 = version == 'HTTP/1.1'
+                keep_alive = connection != 'close' if http11 else connection == 'keep-alive'
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    await self.send(writer, 413, {'error': "Слишком большой запрос"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.dispatch(method, target, body)
+                if not await self.send(writer, status, payload, keep_alive, http11):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def send(self, writer, status, payload, keep_alive, http11=True):
+        """Ответ JSON; генератор строк отдается потоком по кускам.
+        
+        Возвращает, остается ли соединение открытым.
+        """
+        streamed = not (payload is None or isinstance(payload, (dict, list, str)))
+        # Без chunked (HTTP/1.0) конец потокового ответа обозначается закрытием соединения
+        keep_alive = keep_alive and (http11 or not streamed)
+        content_type = ('text/plain; version=0.0.4' if isinstance(payload, str)
+                        else 'application/json')
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+        if not streamed:
+            if payload is None:
+                body = b''
+            else:
+                body = (payload if isinstance(payload, str) else dumps(payload)).encode('utf-8')
+            writer.write(f"{head}Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+            return keep_alive
+        chunked = keep_alive
+        if chunked:
+            head += "Transfer-Encoding: chunked\r\n"
+        writer.write((head + "\r\n").encode('latin-1'))
+        for text in payload:
+            data = text.encode('utf-8')
+            writer.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+            await writer.drain()
+            # Даем обслужить остальные соединения между кусками
+            await asyncio.sleep(0)
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive
+    
+    async def dispatch(self, method, target, body):
+        self.requests += 1
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = dict(parse_qsl(url.query))
+        if not METRICS.enabled:
+            return await self.route(method, parts, query, body)
+        # Время запроса без отправки ответа; ресурс без ID, чтобы не плодить серии
+        with METRICS.timer(f"{method} /{parts[0]}"):
+            return await self.route(method, parts, query, body)
+    
+    async def route(self, method, parts, query, body):
+        try:
+            if parts == ['patients']:
+                if method == 'GET':
+                    return 200, self.list_patients(query)
+                if method == 'POST':
+                    return 201, await self.add_patients(self.parse_body(body))
+            elif len(parts) == 2 and parts[0] == 'patients':
+                try:
+                    key = int(parts[1])
+                except ValueError:
+                    raise HTTPError(404, "Пациент не найден") from None
+                if method == 'GET':
+                    return 200, patient_record(self.manager.get_patient(key))
+                if method == 'PUT':
+                    return 200, await self.update_patient(key, self.parse_body(body))
+                if method == 'DELETE':
+                    version = self.int_param(query, 'version', None)
+                    await self.writes.submit(self.manager.delete_patient, key, version)
+                    return 204, None
+            elif parts == ['search'] and method == 'GET':
+                return 200, self.search(query)
+            elif parts == ['stats'] and method == 'GET':
+                return 200, self.stats(query)
+            elif parts == ['cohort'] and method == 'GET':
+                return 200, self.cohort(query)
+            elif parts == ['metrics'] and method == 'GET':
+                if not METRICS.enabled:
+                    raise HTTPError(404, "Замеры выключены: запустите сервер с --metrics")
+                return 200, METRICS.snapshot() if query.get('format') == 'json' else METRICS.to_prometheus()
+            else:
+                raise HTTPError(404, "Нет такого ресурса")
+            raise HTTPError(405, "Метод не поддерживается")
+        except HTTPError as e:
+            return e.status, {'error': str(e)}
+        except KeyError:
+            return 404, {'error': "Пациент не найден"}
+        except ConflictError as e:
+            return 409, {'error': str(e)}
+        except StorageError as e:
+            # Изменение не записано и отменено - клиент может повторить запрос
+            return 503, {'error': str(e)}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            return 500, {'error': f"Внутренняя ошибка: {e}"}
+    
+    @staticmethod
+    def parse_body(body):
+        try:
+            return json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise HTTPError(400, "Тело запроса не JSON") from None
+    
+    @staticmethod
+    def int_param(query, name, default):
+        value = query.get(name)
+        if value is None or value == '':
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise HTTPError(400, f"Параметр {name} должен быть целым числом") from None
+    
+    def list_patients(self, query, cohort=None):
+        """Страница пациентов (всех или когорты) в порядке хранения или сортировки по полю"""
+        offset = max(0, self.int_param(query, 'offset', 0))
+        limit = max(0, self.int_param(query, 'limit', 100))
+        sort = query.get('sort')
+        descending = query.get('desc') in ('1', 'true')
+        if cohort is not None:
+            view = cohort.sorted_view(sort, descending) if sort else cohort
+            total = len(cohort)
+        else:
+            view = self.manager.sorted_view(sort, descending) if sort else None
+            total = self.manager.count()
+        limit = max(0, min(limit, total - offset))
+        if limit <= STREAM_CHUNK:
+            return {'total': total, 'offset': offset,
+                    'patients': [patient_record(p) for p in self.iter_page(view, offset, limit)]}
+        return self.stream_page(view, total, offset, limit)
+    
+    def iter_page(self, view, offset, limit):
+        if view is None:
+            yield from self.manager.get_page(offset, limit)
+            return
+        for i in range(offset, offset + limit):
+            if i >= len(view):
+                # Пока страница отдавалась, часть пациентов удалили
+                return
+            yield self.manager.get_patient(view[i])
+    
+    def stream_page(self, view, total, offset, limit):
+        """Большая страница кусками по STREAM_CHUNK пациентов.
+        
+        Каждый кусок читается целиком между переключениями на другие запросы,
+        поэтому отдельные записи всегда согласованы.
+        """
+        yield f'{{"total":{total},"offset":{offset},"patients":['
+        end = offset + limit
+        separator = ''
+        for start in range(offset, end, STREAM_CHUNK):
+            page = list(self.iter_page(view, start, min(STREAM_CHUNK, end - start)))
+            if not page:
+                break
+            yield separator + ','.join(dumps(patient_record(p)) for p in page)
+            separator = ','
+        yield ']}'
+    
+    def search(self, query):
+        limit = max(0, self.int_param(query, 'limit', 100))
+        keys = self.manager.search(query.get('q', ''), limit)
+        return {'patients': [patient_record(self.manager.get_patient(key)) for key in keys]}
+    
+    def stats(self, query):
+        """Те же сводки, что показывает окно статистики; с q - только по когорте"""
+        if query.get('q'):
+            cohort = self.manager.query(query['q'])
+            aggregates, total = cohort.aggregates(), len(cohort)
+        else:
+            aggregates, total = self.manager.aggregates(), self.manager.count()
+        ages, counts = aggregates.age_histogram()
+        genders = {gender: count for gender, count in aggregates.gender_counts.items() if count > 0}
+        return {
+            'count': total,
+            'gender_counts': genders,
+            'age_histogram': {'ages': ages, 'counts': counts},
+            'bmi': {gender: aggregates.bmi_box_stats(gender, gender) for gender in genders}
+        }
+    
+    def cohort(self, query):
+        """Когорта по выражению q: страница пациентов или сводка по группам group_by"""
+        cohort = self.manager.query(query.get('q', ''))
+        group_by = query.get('group_by')
+        if group_by:
+            return {'query': str(cohort.query), 'count': len(cohort),
+                    'groups': cohort.group_by(group_by)}
+        return self.list_patients(query, cohort)
+    
+    async def add_patients(self, data):
+        """Один пациент или список; ID выдаются после сохранения"""
+        if isinstance(data, list):
+            patients = [parse_patient(item) for item in data]
+            keys = await self.writes.submit(
+                lambda: [self.manager.add_patient(patient) for patient in patients])
+            return {'ids': keys}
+        key = await self.writes.submit(self.manager.add_patient, parse_patient(data))
+        return {'id': key}
+    
+    async def update_patient(self, key, data):
+        patient = parse_patient(data)
+        version = data.get('version')
+        if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+            raise HTTPError(400, "Поле version должно быть целым числом")
+        
+        def update():
+            self.manager.update_patient(key, patient, version)
+            return patient_record(self.manager.get_patient(key))
+        return await self.writes.submit(update)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP-сервис ЕМИАС")
+    parser.add_argument('--host', default='127.0.0.1', help='адрес')
+    parser.add_argument('--port', type=int, default=8080, help='порт')
+    parser.add_argument('--storage', choices=['journal', 'binary', 'json', 'sqlite'], default=None,
+                        help='способ хранения (по умолчанию EMIAS_STORAGE или journal)')
+    parser.add_argument('--store', default=None, help='файл хранилища')
+    parser.add_argument('--flush-delay', type=float, default=0.002,
+                        help='сколько секунд собирать изменения в одну запись на диск')
+    parser.add_argument('--metrics', action='store_true',
+                        help='замерять запросы и операции хранилища (GET /metrics)')
+    args = parser.parse_args(argv)
+    if args.metrics:
+        METRICS.enabled = True
+    manager = create_manager(args.storage, filename=args.store, initial_data=False)
+    server = PatientServer(manager, args.flush_delay)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
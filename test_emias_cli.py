@@ -0,0 +1,49 @@
+"""Тесты командной строки ЕМИАС: команды вызываются через main() на временных файлах."""
+import csv
+import json
+
+import pytest
+
+import emias_cli
+
+ROWS = [('Иванов Иван Иванович', '45', 'М', '180', '90'),
+        ('Петрова Анна Сергеевна', '52', 'Ж', '165', '82'),
+        ('Ошибка Возраста', '40000', 'М', '180', '80'),
+        ('Попова Мария Ивановна', '41', 'Ж', '160', '95.5')]
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('dump.csv', 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(emias_cli.FIELDS)
+        writer.writerows(ROWS)
+    return tmp_path
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def test_import_skips_invalid_rows_and_export_streams_store(capsys):
+    emias_cli.main(['import', 'dump.csv', '--store', 'patients.json'])
+    assert 'Пропущена запись 3' in capsys.readouterr().err
+    
+    emias_cli.main(['export', '--store', 'patients.json', '-o', 'all.jsonl'])
+    exported = read_jsonl('all.jsonl')
+    assert [record['full_name'] for record in exported] == [row[0] for row in ROWS if row[1] != '40000']
+    assert exported[-1]['weight'] == 95.5
+    
+    emias_cli.main(['export', '--store', 'patients.json', '--gender', 'Ж', '--min-age', '45',
+                    '-o', 'women.csv'])
+    with open('women.csv', encoding='utf-8', newline='') as f:
+        assert [row['full_name'] for row in csv.DictReader(f)] == ['Петрова Анна Сергеевна']
+
+def test_strict_import_stops_on_first_invalid_row():
+    with pytest.raises(SystemExit) as error:
+        emias_cli.main(['import', 'dump.csv', '--store', 'patients.json', '--strict'])
+    assert 'Запись 3' in str(error.value.code)
+
+def test_filter_converts_between_formats():
+    emias_cli.main(['filter', 'dump.csv', '--max-bmi', '31', '-o', 'cohort.jsonl'])
+    assert [record['full_name'] for record in read_jsonl('cohort.jsonl')] == [
+        'Иванов Иван Иванович', 'Петрова Анна Сергеевна']
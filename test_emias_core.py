@@ -0,0 +1,317 @@
+"""Тесты ядра ЕМИАС без интерфейса.
+
+    python -m pytest -q
+"""
+import json
+import os
+
+import pytest
+
+from emias_core import (GROUP_FIELDS, CohortQuery, ConflictError, NameIndex, Patient, PatientManager, PatientStore, SQLitePatientManager,
+                        StorageError, load_binary_snapshot, read_journal)
+
+PATIENTS = [Patient('Иванов Иван Иванович', 45, 'М', 180, 90),
+            Patient('Петрова Анна Сергеевна', 52, 'Ж', 165, 82),
+            Patient('Смирнова Ольга Петровна', 30, 'Ж', 170, 55),
+            Patient('Кузнецов Павел Андреевич', 67, 'М', 175, 70),
+            Patient('Попова Мария Ивановна', 41, 'Ж', 160, 95),
+            Patient('Соколов Дмитрий Олегович', 19, 'М', 190, 60)]
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # Менеджеры ищут patients.json в текущем каталоге - не трогаем рабочий
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def records(manager):
+    return [(p.key, p.version, p.full_name, p.age, p.gender, p.height, p.weight)
+            for p in manager.patients]
+
+def journal_manager(filename='patients.json', **options):
+    return PatientManager(filename, journal=True, initial_data=False, **options)
+
+# Журнал: воспроизведение и свертка
+
+def test_journal_replay_restores_state():
+    manager = journal_manager()
+    keys = [manager.add_patient(p) for p in PATIENTS]
+    manager.update_patient(keys[1], Patient('Петрова Анна Сергеевна', 53, 'Ж', 165, 80))
+    manager.delete_patient(keys[2])
+    
+    reopened = journal_manager()
+    assert records(reopened) == records(manager)
+    assert reopened.get_patient(keys[1]).age == 53
+    with pytest.raises(KeyError):
+        reopened.get_patient(keys[2])
+
+def test_compaction_folds_journal_into_snapshot():
+    manager = journal_manager(compact_every=4)
+    keys = [manager.add_patient(p) for p in PATIENTS]
+    manager.delete_patient(keys[0])
+    
+    header, pending = read_journal('patients.json')
+    assert header is not None
+    assert len(pending) < 4
+    with open('patients.json', encoding='utf-8') as f:
+        assert len(json.load(f)) >= 4
+    assert records(journal_manager()) == records(manager)
+
+def test_torn_journal_tail_is_cut_off():
+    manager = journal_manager()
+    for p in PATIENTS[:2]:
+        manager.add_patient(p)
+    with open('patients.json.wal', 'ab') as f:
+        f.write(b'{"op":"add","id":99,"patient":{"full_na')
+    
+    reopened = journal_manager()
+    assert records(reopened) == records(manager)
+    # Следующая запись ложится после последней целой строки, а не склеивается с обрывком
+    key = reopened.add_patient(PATIENTS[2])
+    assert key in [p.key for p in journal_manager().patients]
+
+def test_journal_of_other_snapshot_is_discarded():
+    manager = journal_manager()
+    manager.add_patient(PATIENTS[0])
+    manager.compact()
+    manager.add_patient(PATIENTS[1])
+    expected = records(manager)
+    # Сбой при свертке: снимок заменен, а журнал остался от прежнего
+    with open('patients.json.wal', 'rb') as f:
+        lines = f.readlines()
+    header = json.loads(lines[0])
+    header['crc'] = (header['crc'] + 1) % 2 ** 32
+    with open('patients.json.wal', 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8') + b'\n' + b''.join(lines[1:]))
+    
+    assert read_journal('patients.json') == (None, [])
+    assert records(journal_manager()) == expected[:1]
+
+# Несколько рабочих мест: изменения других, конфликты версий, сбой записи
+
+def test_other_workplace_changes_are_picked_up():
+    first, second = journal_manager(), journal_manager()
+    key = first.add_patient(PATIENTS[0])
+    first.update_patient(key, PATIENTS[1])
+    assert second.poll_changes() == [('add', key), ('update', key)]
+    assert records(second) == records(first)
+
+def test_failed_write_rolls_back(monkeypatch):
+    manager = journal_manager()
+    manager.add_patient(PATIENTS[0])
+    saved = records(manager)
+    
+    def broken(*records):
+        raise StorageError("диск заполнен")
+    monkeypatch.setattr(manager, 'append_journal', broken)
+    with pytest.raises(StorageError):
+        manager.add_patient(PATIENTS[1])
+    assert records(manager) == saved
+    assert manager.poll_changes() == [('reload', None)]
+
+@pytest.fixture(params=['journal', 'sqlite'])
+def manager(request):
+    if request.param == 'sqlite':
+        manager = SQLitePatientManager('patients.db', initial_data=False)
+    else:
+        manager = journal_manager()
+    manager.add_patients(PATIENTS)
+    return manager
+
+def test_stale_update_raises_conflict(manager):
+    key = manager.patients[0].key
+    version = manager.get_patient(key).version
+    manager.update_patient(key, PATIENTS[1], version)
+    with pytest.raises(ConflictError):
+        manager.update_patient(key, PATIENTS[2], version)
+    assert manager.get_patient(key).full_name == PATIENTS[1].full_name
+
+def test_stale_delete_raises_conflict(manager):
+    key = manager.patients[0].key
+    version = manager.get_patient(key).version
+    manager.update_patient(key, PATIENTS[1])
+    with pytest.raises(ConflictError):
+        manager.delete_patient(key, version)
+    manager.delete_patient(key, version + 1)
+    with pytest.raises(ConflictError):
+        manager.update_patient(key, PATIENTS[2], version + 1)
+
+def test_missing_patient_raises_key_error(manager):
+    with pytest.raises(KeyError):
+        manager.update_patient(10 ** 6, PATIENTS[0])
+    with pytest.raises(KeyError):
+        manager.delete_patient(10 ** 6)
+
+def test_batch_writes_journal_once():
+    manager = journal_manager()
+    with manager.batch():
+        keys = [manager.add_patient(p) for p in PATIENTS[:3]]
+        manager.delete_patient(keys[0])
+    _, pending = read_journal('patients.json')
+    assert [record['op'] for record in pending] == ['add', 'add', 'add', 'delete']
+    assert records(journal_manager()) == records(manager)
+
+# Поиск по ФИО
+
+NAMES = ['Иванова Анна Петровна', 'Иванова Анастасия Сергеевна', 'Иванова Анна Ивановна',
+         'Иванов Иван Иванович', 'Смирнова Анна Ивановна', 'Иванова Анна Олеговна']
+
+@pytest.mark.parametrize('materialize_limit', [0, 50000])
+def test_search_ranks_exact_matches_first(materialize_limit):
+    index = NameIndex(NAMES.__getitem__)
+    for key, name in enumerate(NAMES):
+        index.add(key, name)
+    # Оба пути (пересечение множеств и перебор записей) дают один порядок
+    assert index.search('иванова анна', materialize_limit=materialize_limit) == [0, 2, 5]
+    assert index.search('иванова анна', 2, materialize_limit) == [0, 2]
+    assert index.search('иван ан', materialize_limit=materialize_limit) == [0, 1, 2, 4, 5]
+    # Точных совпадений меньше limit - за ними идут совпавшие префиксом
+    assert index.search('иванов иван', 3, materialize_limit) == [3, 0, 1]
+    assert index.search('смирнва анна ивановна', materialize_limit=materialize_limit) == [4]
+
+# Постоянные ID и надгробия
+
+def test_tombstones_keep_rows_and_positions():
+    store = PatientStore(PATIENTS)
+    store.delete_row(1)
+    store.delete_row(3)
+    assert len(store) == 4
+    assert [store.row_at(position) for position in range(4)] == [0, 2, 4, 5]
+    assert [store.position_of(row) for row in (0, 2, 4, 5)] == [0, 1, 2, 3]
+    assert store.is_deleted(3) and not store.is_deleted(2)
+    with pytest.raises(KeyError):
+        store.row_of(store.keys[1])
+    assert [p.full_name for p in store] == [PATIENTS[i].full_name for i in (0, 2, 4, 5)]
+
+def test_purge_drops_tombstones_and_keeps_keys():
+    store = PatientStore(PATIENTS)
+    keys = list(store.keys)
+    store.delete_row(0)
+    store.delete_row(4)
+    store.purge()
+    assert not store.deleted
+    assert list(store.keys) == [keys[i] for i in (1, 2, 3, 5)]
+    assert store.get(keys[3]).full_name == PATIENTS[3].full_name
+    assert len(store.ages) == len(store.names) == len(store.bmi_column()) == 4
+    # Новый ID продолжает счет, а не занимает освободившийся
+    assert store.append(PATIENTS[0]) == keys[-1] + 1
+
+def test_ids_are_not_reused_after_compaction():
+    manager = journal_manager(compact_every=2)
+    keys = [manager.add_patient(p) for p in PATIENTS[:3]]
+    manager.delete_patient(keys[-1])
+    manager.compact()
+    
+    reopened = journal_manager()
+    assert reopened.add_patient(PATIENTS[3]) == keys[-1] + 1
+
+# Столбцовое хранилище
+
+def test_failed_append_leaves_columns_aligned():
+    store = PatientStore(PATIENTS[:2])
+    with pytest.raises(OverflowError):
+        store.append(Patient('Ошибка', 10 ** 6, 'М', 180, 80))
+    assert len({len(store.keys), len(store.ages), len(store.names), len(store.heights)}) == 1
+    assert store.append(PATIENTS[2]) == 2
+
+def test_failed_update_keeps_patient():
+    manager = journal_manager()
+    key = manager.add_patient(PATIENTS[0])
+    with pytest.raises(OverflowError):
+        manager.update_patient(key, Patient('Ошибка', 10 ** 6, 'М', 180, 80))
+    assert records(manager) == records(journal_manager())
+
+def test_first_edit_of_mapped_binary_snapshot():
+    manager = PatientManager('patients.bin', journal=True, initial_data=False)
+    manager.add_patients(PATIENTS)
+    manager.save_data()
+    
+    # Журнал пуст: столбцы - еще memoryview над файлом, первая правка их копирует
+    reopened = PatientManager('patients.bin', journal=True, initial_data=False)
+    key = reopened.patients[0].key
+    reopened.update_patient(key, Patient('Иванов Иван Иванович', 46, 'М', 180, 88.5))
+    added = reopened.add_patient(PATIENTS[1])
+    assert reopened.get_patient(key).age == 46
+    assert records(PatientManager('patients.bin', journal=True, initial_data=False)) == records(reopened)
+    assert added == len(PATIENTS)
+
+# Когорты
+
+def test_query_parsing_is_canonical():
+    query = CohortQuery.parse("пол=ж возраст=40..60, имт>=30")
+    assert query == CohortQuery.parse("bmi>=30 и age>=40 age<=60 gender=Ж")
+    assert str(query) == "age<=60 age>=40 bmi>=30 gender=Ж"
+    assert CohortQuery.parse("категория=норма|obese").conditions == (
+        ('category', 'in', ('норма', 'ожирение')),)
+
+@pytest.mark.parametrize('expression', ["рост<<5", "цвет=синий", "пол>М", "возраст=abc",
+                                        "категория=худой", "возраст>=40..60"])
+def test_query_parsing_errors(expression):
+    with pytest.raises(ValueError):
+        CohortQuery.parse(expression)
+
+@pytest.mark.parametrize('expression', ["", "пол=Ж", "возраст=40..60", "пол!=М имт<25",
+                                        "категория=избыток|ожирение возраст>30", "вес<0"])
+def test_numpy_mask_matches_row_and_sql_paths(expression):
+    pytest.importorskip('numpy')
+    query = CohortQuery.parse(expression)
+    store = PatientStore(PATIENTS)
+    store.delete_row(2)
+    by_mask = [key for key, hit in zip(store.keys, query.mask(store)) if hit]
+    by_rows = [store.keys[row] for row in store.live_rows() if query.matches(store, row)]
+    assert by_mask == by_rows
+    
+    sqlite = SQLitePatientManager('patients.db', initial_data=False)
+    sqlite.add_patients(PATIENTS)
+    sqlite.delete_patient(sqlite.patients[2].key)
+    assert (sorted(sqlite.get_patient(key).full_name for key in sqlite.query(expression))
+            == sorted(store.get(key).full_name for key in by_mask))
+
+def test_cohort_groups_match_sqlite():
+    pytest.importorskip('numpy')
+    journal = journal_manager()
+    journal.add_patients(PATIENTS)
+    sqlite = SQLitePatientManager('patients.db', initial_data=False)
+    sqlite.add_patients(PATIENTS)
+    for field in GROUP_FIELDS:
+        assert journal.query("возраст>=30").group_by(field) == sqlite.query("возраст>=30").group_by(field)
+
+def test_cohort_drops_deleted_patients():
+    pytest.importorskip('numpy')
+    manager = journal_manager()
+    manager.add_patients(PATIENTS)
+    cohort = manager.query("пол=Ж")
+    removed = cohort[0]
+    manager.delete_patient(removed)
+    assert removed not in cohort
+    assert len(cohort) == 2
+    assert len(cohort.column('age')) == 2
+
+# Бинарный снимок
+
+def test_binary_snapshot_round_trip():
+    manager = PatientManager('patients.bin', journal=True, initial_data=False)
+    manager.add_patients(PATIENTS)
+    keys = [p.key for p in manager.patients]
+    manager.delete_patient(keys[1])
+    manager.update_patient(keys[0], Patient('Иванов Иван Иванович', 46, 'М', 180, 88.5))
+    manager.save_data()
+    
+    store, crc = load_binary_snapshot('patients.bin')
+    assert crc == manager._snapshot_crc
+    assert [(p.key, p.version, p.full_name, p.age, p.gender, p.height, p.weight) for p in store] \
+        == records(manager)
+    assert store.append(PATIENTS[0]) == keys[-1] + 1
+
+def test_binary_snapshot_with_journal_reopens():
+    manager = PatientManager('patients.bin', journal=True, initial_data=False)
+    manager.add_patients(PATIENTS)
+    manager.save_data()
+    size = os.path.getsize('patients.bin')
+    key = manager.add_patient(Patient('Новиков Андрей Петрович', 33, 'М', 178, 77))
+    
+    reopened = PatientManager('patients.bin', journal=True, initial_data=False)
+    assert records(reopened) == records(manager)
+    # Правка отображенного снимка копирует столбцы, файл снимка не меняется
+    reopened.update_patient(key, PATIENTS[0])
+    assert reopened.get_patient(key).full_name == PATIENTS[0].full_name
+    assert os.path.getsize('patients.bin') == size
@@ -0,0 +1,106 @@
+"""Тесты таблицы ЕМИАС без Tk: Treeview и полоса прокрутки заменены заглушками."""
+import importlib.util
+import itertools
+import os
+
+import pytest
+
+from emias_core import Cohort, Patient, SQLitePatientManager
+
+pytest.importorskip('tkinter')
+
+spec = importlib.util.spec_from_file_location(
+    'emias_gui', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'EMIAS_version_4.20.py'))
+gui = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(gui)
+
+class FakeTree:
+    """Заглушка ttk.Treeview: только порядок элементов и выбор"""
+    
+    def __init__(self):
+        self.children = []
+        self.selected = ()
+    
+    def bind(self, *args):
+        pass
+    
+    def insert(self, parent, index, iid=None, values=()):
+        self.children.insert(index, iid)
+    
+    def delete(self, iid):
+        self.children.remove(iid)
+    
+    def item(self, iid, values=None):
+        pass
+    
+    def move(self, iid, parent, index):
+        self.children.remove(iid)
+        self.children.insert(index, iid)
+    
+    def selection(self):
+        return self.selected
+    
+    def selection_set(self, items):
+        self.selected = (items,) if isinstance(items, str) else tuple(items)
+
+class FakeScrollbar:
+    def configure(self, **options):
+        pass
+    
+    def set(self, first, last):
+        pass
+
+class Row:
+    def __init__(self, key):
+        self.key = key
+
+def make_table(visible_rows):
+    tree = FakeTree()
+    table = gui.VirtualTable(tree, FakeScrollbar(), lambda: 0, None, lambda row: (), Row,
+                             visible_rows=visible_rows)
+    return tree, table
+
+def test_refresh_reorders_rows_to_match_view():
+    # Все перестановки окна из 4 строк в любые 4 строки из 5
+    for old in itertools.permutations(range(4)):
+        for new in itertools.permutations(range(5), 4):
+            tree, table = make_table(4)
+            table.set_view(list(old))
+            table.view = list(new)
+            table.refresh()
+            assert tree.children == [str(key) for key in new]
+
+def test_replace_view_keeps_offset_and_selected_patient():
+    tree, table = make_table(4)
+    table.set_view(list(range(20)))
+    table.set_offset(10)
+    table.selected_index = 11
+    table.sync_selection()
+    
+    # Выше выбранного пациента удалена строка: окно не прыгает, выбор следует за пациентом
+    table.replace_view([key for key in range(20) if key != 3])
+    assert table.offset == 10
+    assert table.selected_index == 10 and tree.selected == ('11',)
+    
+    # Выбранный пациент ушел из когорты - выбор снимается
+    table.replace_view([key for key in range(20) if key not in (3, 11)])
+    assert table.selected_index is None and tree.selected == ()
+
+def test_stats_on_sqlite_take_columns_from_sql(tmp_path, monkeypatch):
+    pytest.importorskip('matplotlib')
+    monkeypatch.chdir(tmp_path)
+    manager = SQLitePatientManager('patients.db', initial_data=False)
+    manager.add_patients([Patient('Иванов Иван Иванович', 45, 'М', 180, 90),
+                          Patient('Петрова Анна Сергеевна', 52, 'Ж', 165, 82)])
+    opened = []
+    monkeypatch.setattr(gui, 'StatsWindow', lambda root, patients, aggregates: opened.append(
+        (patients, aggregates)))
+    app = gui.MainApp.__new__(gui.MainApp)
+    app.root, app.manager, app.cohort = None, manager, None
+    
+    app.show_stats()
+    [(patients, aggregates)] = opened
+    # Все пациенты идут когортой SQLite, а не перебором SQLitePatientList
+    assert isinstance(patients, Cohort)
+    assert list(gui.patient_column(patients, 'age')) == [45, 52]
+    assert dict(aggregates.gender_counts) == {'М': 1, 'Ж': 1}
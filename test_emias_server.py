@@ -0,0 +1,125 @@
+"""Тесты HTTP-сервиса ЕМИАС: запросы идут через настоящий сокет и разбор HTTP."""
+import asyncio
+import json
+from urllib.parse import quote
+
+import pytest
+
+from emias_core import PatientManager, SQLitePatientManager, StorageError
+from emias_server import PatientServer
+
+PATIENT = {'full_name': 'Иванов Иван Иванович', 'age': 45, 'gender': 'М', 'height': 180, 'weight': 90}
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def journal_manager():
+    return PatientManager('patients.json', journal=True, initial_data=False)
+
+async def exchange(server, requests):
+    """Отправка запросов [(метод, путь, тело)] по одному соединению; ответы (статус, JSON)"""
+    listener = await asyncio.start_server(server.handle_connection, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    responses = []
+    try:
+        for method, path, body in requests:
+            data = b'' if body is None else json.dumps(body).encode('utf-8')
+            writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\n"
+                         f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if headers.get('transfer-encoding') == 'chunked':
+                payload = b''
+                while size := int(await reader.readline(), 16):
+                    payload += await reader.readexactly(size)
+                    await reader.readline()
+                await reader.readline()
+            else:
+                payload = await reader.readexactly(int(headers.get('content-length', 0)))
+            responses.append((status, json.loads(payload) if payload else None))
+    finally:
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+    return responses
+
+def request(server, *requests):
+    return asyncio.run(exchange(server, requests))
+
+@pytest.fixture(params=['journal', 'sqlite'])
+def server(request):
+    if request.param == 'sqlite':
+        return PatientServer(SQLitePatientManager('patients.db', initial_data=False))
+    return PatientServer(journal_manager())
+
+# Пациенты
+
+def test_patient_lifecycle(server):
+    [(status, created)] = request(server, ('POST', '/patients', PATIENT))
+    assert status == 201
+    path = f"/patients/{created['id']}"
+    (_, patient), (_, updated), (stale, _), (deleted, _), (gone, _) = request(
+        server,
+        ('GET', path, None),
+        ('PUT', path, {**PATIENT, 'age': 46, 'version': 1}),
+        ('PUT', path, {**PATIENT, 'age': 47, 'version': 1}),
+        ('DELETE', path + '?version=2', None),
+        ('GET', path, None))
+    assert patient['bmi'] == 27.78 and patient['version'] == 1
+    assert updated['age'] == 46 and updated['version'] == 2
+    assert (stale, deleted, gone) == (409, 204, 404)
+
+@pytest.mark.parametrize('method, path, body, expected', [
+    ('PUT', '/patients/999', PATIENT, 404),
+    ('DELETE', '/patients/999', None, 404),
+    ('PUT', '/patients/999', {**PATIENT, 'version': '1'}, 400),
+    ('POST', '/patients', {**PATIENT, 'age': 40000}, 400)])
+def test_request_errors(server, method, path, body, expected):
+    [(status, payload)] = request(server, (method, path, body))
+    assert status == expected
+    assert payload['error']
+
+# Ошибки записи
+
+def test_failed_write_answers_503_and_keeps_connection(monkeypatch):
+    manager = journal_manager()
+    server = PatientServer(manager)
+    
+    def broken(*records):
+        raise StorageError("диск заполнен")
+    monkeypatch.setattr(manager, 'append_journal', broken)
+    (status, payload), (list_status, listing) = request(
+        server, ('POST', '/patients', PATIENT), ('GET', '/patients', None))
+    assert status == 503
+    assert 'диск заполнен' in payload['error']
+    # Ответ получен полностью, соединение живо, а пациент не появился
+    assert list_status == 200
+    assert listing['total'] == 0
+
+# Когорты
+
+def test_cohort_page_and_groups(server):
+    pytest.importorskip('numpy')
+    women = [{**PATIENT, 'full_name': 'Петрова Анна Сергеевна', 'gender': 'Ж', 'age': age}
+             for age in (35, 52, 58)]
+    request(server, ('POST', '/patients', [PATIENT] + women))
+    q = quote('пол=Ж возраст=40..60')
+    (status, page), (_, groups) = request(server, ('GET', f'/cohort?q={q}&sort=age&desc=1', None),
+                                          ('GET', f'/cohort?q={q}&group_by=gender', None))
+    assert status == 200
+    assert page['total'] == 2
+    assert [p['age'] for p in page['patients']] == [58, 52]
+    assert groups['count'] == 2 and groups['query'] == 'age<=60 age>=40 gender=Ж'
+
+@pytest.mark.parametrize('expression', ['цвет=синий', 'возраст>=40..60'])
+def test_bad_cohort_expression_answers_400(server, expression):
+    [(status, payload)] = request(server, ('GET', f'/cohort?q={quote(expression)}', None))
+    assert status == 400
+    assert payload['error']